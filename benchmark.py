@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Benchmark end2end_k8s offline
+
+Run benchmarks against local stand-ins for kubectl, the Kubernetes API, the
+LoadBalancer, Lemur, Datadog and AWS. Nothing leaves the machine.
+
+Example:
+    python benchmark.py -o bench.json
+    python benchmark.py -o bench.json --compare baseline.json check fleet
+
+"""
+import argparse
+import json
+import logging
+import sys
+from benchmarks import fakes, report, scenarios
+from library import defaults
+
+def levels(argument):
+    ''' Parse a comma-separated list of concurrency levels
+    '''
+    try:
+        parsed = sorted(set(int(i) for i in argument.split(',') if i.strip()))
+    except ValueError:
+        raise argparse.ArgumentTypeError('Levels must be integers, e.g. 1,4,8')
+    if not parsed or parsed[0] < 1:
+        raise argparse.ArgumentTypeError('Levels must be 1 or more')
+    return parsed
+
+def main():
+    ''' Main method
+    '''
+    parser = argparse.ArgumentParser('Benchmark end2end_k8s offline')
+    parser.add_argument('scenarios',
+                        help='Scenarios to run, from %s (default: all)'
+                        % ', '.join(scenarios.SCENARIOS),
+                        nargs='*',
+                        default=list(scenarios.SCENARIOS))
+    parser.add_argument('-o', '--output',
+                        help='Write the results to this JSON file')
+    parser.add_argument('--compare',
+                        help='Results file of an earlier run to compare \
+against. Exits non-zero if anything regressed.')
+    parser.add_argument('--threshold',
+                        help='Relative change which counts as a regression',
+                        type=float,
+                        default=0.25)
+    parser.add_argument('-i', '--iterations',
+                        help='Runs of each operation measured for latency',
+                        type=int,
+                        default=10)
+    parser.add_argument('--clusters',
+                        help='Clusters in the fake kubectl config file',
+                        type=int,
+                        default=8)
+    parser.add_argument('--levels',
+                        help='Comma-separated concurrency levels for the \
+fleet, load, sweep and secret rotation scenarios',
+                        type=levels,
+                        default=[1, 4, 8])
+    parser.add_argument('-b', '--backend',
+                        help='Backend used by the fleet scenario',
+                        choices=defaults.KUBE_BACKENDS,
+                        default=defaults.KUBE_BACKEND)
+    parser.add_argument('--lb_delay',
+                        help='Seconds before a new LoadBalancer has an address',
+                        type=float,
+                        default=0.2)
+    parser.add_argument('--poll',
+                        help='Seconds between polls for the LoadBalancer',
+                        type=float,
+                        default=0.05)
+    parser.add_argument('--latency',
+                        help='Seconds added to every fake API response',
+                        type=float,
+                        default=0.0)
+    parser.add_argument('--error_rate',
+                        help='Fraction of Kubernetes API requests which fail',
+                        type=float,
+                        default=0.0)
+    parser.add_argument("-v", '--verbose',
+                        help="Log what the library is doing",
+                        action='store_true',
+                        default=False)
+    args = parser.parse_args()
+    unknown = [i for i in args.scenarios if i not in scenarios.SCENARIOS]
+    if unknown:
+        parser.error('Unknown scenario(s): %s' % ', '.join(unknown))
+    logger = logging.getLogger(defaults.LOGGER)
+    logger.addHandler(logging.StreamHandler())
+    # Injected errors are expected; only show them when asked to
+    logger.setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+    results = {}
+    with fakes.Environment(clusters=args.clusters,
+                           lb_delay=args.lb_delay,
+                           error_rate=args.error_rate,
+                           latency=args.latency) as env:
+        for name in args.scenarios:
+            sys.stderr.write('Running %s...\n' % name)
+            results[name] = scenarios.SCENARIOS[name](env, args)
+    output = {'meta': report.meta(args), 'results': results}
+    output['meta']['peak_rss_bytes'] = report.peak_rss_bytes()
+    text = json.dumps(output, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as data:
+            data.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, 'r') as data:
+            baseline = json.load(data)
+        rows = report.compare(baseline['results'], results, args.threshold)
+        sys.stderr.write(report.format_comparison(rows) + '\n')
+        if [i for i in rows if i[-1] == 'regressed']:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
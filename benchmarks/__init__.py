@@ -0,0 +1,3 @@
+''' define the value of __all__ for import *
+'''
+__all__ = ['fakes', 'scenarios', 'report']
@@ -0,0 +1,734 @@
+#!/usr/bin/env python
+''' Local stand-ins for everything a check or a secret refresh talks to: the
+    Kubernetes API (and a kubectl binary which uses it), the LoadBalancer
+    itself, Lemur, Datadog, and the AWS S3 and IAM APIs
+'''
+
+import gzip
+import http.server
+import itertools
+import json
+import os
+import random
+import re
+import stat
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from library import dd, kubeconfig, lemur
+import yaml
+
+# Hostnames handed out as LoadBalancer ingresses; only FakeElb answers them
+ELB_DOMAIN = 'bench.invalid'
+# Path to a cluster's objects on FakeKubeApi, after /clusters/<context>
+OBJECT_PATH = re.compile(r'^/clusters/(?P<cluster>[^/]+)'
+                         r'/apis?/(?:[^/]+/)?v[^/]*'
+                         r'(?:/namespaces/(?P<namespace>[^/]+))?'
+                         r'/(?P<plural>[^/]+)(?:/(?P<name>[^/]+))?$')
+WATCH_POLL = 0.05
+# Pods of Deployments running this image never start, and Services with this
+# annotation never get a LoadBalancer (its value is the error reported)
+FAILING_IMAGE = 'registry.%s/missing:1' % ELB_DOMAIN
+LB_ERROR = 'bench.invalid/lb-error'
+# Pods answering behind each LoadBalancer, and the header naming them
+PODS_PER_ELB = 2
+POD_HEADER = 'X-Backend-Pod'
+
+KUBECTL = r'''#!%(python)s
+# Fake kubectl for benchmarks: supports the commands end2end_k8s runs, by
+# calling the API server named in the kubeconfig file (a FakeKubeApi)
+import json, sys, time, urllib.error, urllib.parse, urllib.request
+import yaml
+
+OPENER = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+def call(server, method, path, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    request = urllib.request.Request(server + path, data=data, method=method)
+    request.add_header('Content-Type', 'application/json')
+    try:
+        with OPENER.open(request) as response:
+            return response.status, json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as err:
+        return err.code, json.loads(err.read() or b'{}')
+
+def path(doc, name=None):
+    version = doc['apiVersion']
+    parts = ['/api/' + version if '/' not in version else '/apis/' + version]
+    if doc['kind'] != 'Namespace':
+        parts += ['namespaces', doc['metadata'].get('namespace') or 'default']
+    parts.append(doc['kind'].lower() + 's')
+    if name:
+        parts.append(name)
+    return '/'.join(parts)
+
+def main(argv):
+    config = yaml.safe_load(open(argv[argv.index('--kubeconfig') + 1]))
+    context = argv[argv.index('--context') + 1]
+    cluster = [i['context']['cluster'] for i in config['contexts']
+               if i['name'] == context][0]
+    server = [i['cluster']['server'] for i in config['clusters']
+              if i['name'] == cluster][0]
+    args = argv[argv.index('--context') + 2:]
+    namespace = args[args.index('--namespace') + 1] \
+                if '--namespace' in args else 'default'
+    failed = False
+    if args[0] == 'get' and '--all-namespaces' in args:
+        query = urllib.parse.urlencode({
+            'labelSelector': args[args.index('--selector') + 1]})
+        items = []
+        for plural in args[1].split(','):
+            version = 'extensions/v1beta1' if plural == 'deployments' \
+                      else 'v1'
+            kind = plural[:-1].capitalize()
+            status, body = call(server, 'GET', path(
+                {'apiVersion': version, 'kind': kind,
+                 'metadata': {}}).replace('/namespaces/default', '') + '?' +
+                                query)
+            if status >= 400:
+                sys.stderr.write('Error from server (%%s): %%s\n'
+                                 %% (body.get('reason'), body.get('message')))
+                return 1
+            items += [dict(i, kind=kind, apiVersion=version)
+                      for i in body['items']]
+        print(json.dumps({'apiVersion': 'v1', 'kind': 'List',
+                          'items': items}))
+        return 0
+    if args[0] == 'get' and args[1] in ('pods', 'events'):
+        selector = '--selector' if args[1] == 'pods' else '--field-selector'
+        query = urllib.parse.urlencode({
+            'labelSelector' if args[1] == 'pods' else 'fieldSelector':
+            args[args.index(selector) + 1]})
+        status, body = call(server, 'GET', '/api/v1/namespaces/%%s/%%s?%%s'
+                            %% (namespace, args[1], query))
+        if status >= 400:
+            sys.stderr.write('Error from server (%%s): %%s\n'
+                             %% (body.get('reason'), body.get('message')))
+            return 1
+        print(json.dumps(body))
+        return 0
+    if args[0] == 'get' and '-f' in args:
+        items = []
+        for doc in yaml.safe_load_all(sys.stdin.read()):
+            if not doc:
+                continue
+            status, body = call(server, 'GET',
+                                path(doc, doc['metadata']['name']))
+            if status == 404 and '--ignore-not-found' in args:
+                continue
+            if status >= 400:
+                sys.stderr.write('Error from server (%%s): %%s\n'
+                                 %% (body.get('reason'), body.get('message')))
+                return 1
+            items.append(body)
+        if items:
+            print(json.dumps({'apiVersion': 'v1', 'kind': 'List',
+                              'items': items}))
+        return 0
+    if args[0] in ('create', 'replace', 'delete') and '-f' in args:
+        verb = {'create': 'creating', 'replace': 'replacing',
+                'delete': 'deleting'}[args[0]]
+        for doc in yaml.safe_load_all(sys.stdin.read()):
+            if not doc:
+                continue
+            name = doc['metadata']['name']
+            if args[0] == 'create':
+                status, body = call(server, 'POST', path(doc), doc)
+            elif args[0] == 'replace':
+                status, body = call(server, 'PUT', path(doc, name), doc)
+            else:
+                status, body = call(server, 'DELETE', path(doc, name))
+                if status == 404 and '--ignore-not-found' in args:
+                    continue
+            if status >= 400:
+                failed = True
+                sys.stderr.write('Error from server (%%s): error when %%s '
+                                 '"STDIN": %%s\n' %% (body.get('reason'), verb,
+                                                     body.get('message')))
+            else:
+                print('%%s "%%s" %%sd' %% (doc['kind'].lower(), name, args[0]))
+        return 1 if failed else 0
+    if args[0] == 'get' and args[1] == 'svc':
+        doc = {'apiVersion': 'v1', 'kind': 'Service',
+               'metadata': {'namespace': namespace}}
+        last = None
+        while True:
+            status, body = call(server, 'GET', path(doc, args[2]))
+            if status == 404 and '--ignore-not-found' in args:
+                return 0
+            if status >= 400:
+                sys.stderr.write('Error from server (%%s): %%s\n'
+                                 %% (body.get('reason'), body.get('message')))
+                return 1
+            if '--watch' not in args:
+                print(json.dumps(body))
+                return 0
+            ingress = (body.get('status', {}).get('loadBalancer', {})
+                       .get('ingress') or [{}])[0].get('hostname', '')
+            if ingress != last:
+                print(ingress, flush=True)
+                last = ingress
+            time.sleep(%(watch_poll)s)
+    sys.stderr.write('fake kubectl: unsupported command %%s\n' %% args)
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+'''
+
+class FakeServer(object):
+    ''' Threaded HTTP server on a free local port, with request counting and
+        optional latency and error injection
+    '''
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        ''' Initialization method
+            Keyword Arguments:
+                latency: Seconds added to every response
+                error_rate: Fraction of requests answered with a 500
+                seed: Seed for the error injection, so runs are repeatable
+        '''
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        fake = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            ''' Hand every request to the FakeServer
+            '''
+            protocol_version = 'HTTP/1.1'
+            # Send headers and body in one segment: split writes meet the
+            # client's delayed ACK and add 40ms to every response
+            wbufsize = -1
+            disable_nagle_algorithm = True
+            def do_GET(self):
+                ''' Dispatch a GET
+                '''
+                fake.dispatch(self)
+            do_POST = do_PUT = do_DELETE = do_GET
+            def handle_expect_100(self):
+                ''' Let S3 uploads through: the interim response has to
+                    leave the write buffer before the client sends the body
+                '''
+                http.server.BaseHTTPRequestHandler.handle_expect_100(self)
+                self.wfile.flush()
+                return True
+            def log_message(self, *args):
+                ''' Stay quiet
+                '''
+                pass
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                       Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name=type(self).__name__,
+                                        daemon=True)
+    @property
+    def url(self):
+        ''' Return the base URL of the server
+        '''
+        return 'http://127.0.0.1:%s' % self._server.server_port
+    @property
+    def port(self):
+        ''' Return the port the server listens on
+        '''
+        return self._server.server_port
+    def start(self):
+        ''' Start serving in the background
+        '''
+        self._thread.start()
+        return self
+    def stop(self):
+        ''' Stop serving
+        '''
+        self._server.shutdown()
+        self._server.server_close()
+    def reset(self):
+        ''' Forget the request and error counts
+        '''
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+    def dispatch(self, handler):
+        ''' Count, delay and maybe fail a request, then answer it
+        '''
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        if handler.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            return self.reply(handler, 500, {'kind': 'Status',
+                                             'reason': 'InternalError',
+                                             'message': 'injected failure',
+                                             'code': 500})
+        return self.handle(handler, body)
+    def handle(self, handler, body):
+        ''' Answer a request. Override in subclasses.
+        '''
+        return self.reply(handler, 404, {})
+    @staticmethod
+    def reply(handler, status, body, content_type='application/json',
+              headers=None):
+        ''' Send a complete response
+        '''
+        # pylint: disable=too-many-arguments
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        data = body.encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+class FakeKubeApi(FakeServer):
+    ''' Kubernetes API server for any number of clusters, each under
+        /clusters/<context>. Services get a LoadBalancer ingress lb_delay
+        seconds after they are created.
+    '''
+    def __init__(self, lb_delay=0.0, **kwargs):
+        ''' Initialization method
+            Keyword Arguments:
+                lb_delay: Seconds before a new Service has an ingress
+            Any other keyword arguments are passed on to FakeServer
+        '''
+        FakeServer.__init__(self, **kwargs)
+        self.lb_delay = lb_delay
+        self._objects = {}
+        self._uids = itertools.count(1)
+    def _key(self, handler):
+        ''' Return (cluster, namespace, plural, name) for a request path
+        '''
+        match = OBJECT_PATH.match(urllib.parse.urlsplit(handler.path).path)
+        if not match:
+            return None
+        return match.group('cluster', 'namespace', 'plural', 'name')
+    def _status(self, key, obj, created):
+        ''' Add the status the API server would report for an object
+        '''
+        obj = dict(obj)
+        ready = time.monotonic() - created >= self.lb_delay
+        if key[2] == 'services' and ready and not self._lb_error(obj):
+            obj['status'] = {'loadBalancer': {'ingress': [
+                {'hostname': 'elb-%s.%s' % (key[0], ELB_DOMAIN)}]}}
+        elif key[2] == 'deployments':
+            replicas = obj.get('spec', {}).get('replicas', 1)
+            obj['status'] = {'replicas': replicas,
+                             'updatedReplicas': replicas,
+                             'availableReplicas': 0 if self._failing(obj)
+                                                  else replicas}
+        return obj
+    @staticmethod
+    def _lb_error(obj):
+        ''' Return the LoadBalancer error a Service was annotated with
+        '''
+        return (obj['metadata'].get('annotations') or {}).get(LB_ERROR)
+    @staticmethod
+    def _failing(obj):
+        ''' Return whether a Deployment runs FAILING_IMAGE
+        '''
+        return FAILING_IMAGE in [i.get('image') for i in obj['spec']
+                                 ['template']['spec']['containers']]
+    @staticmethod
+    def _selected(obj, selector):
+        ''' Return whether an object's labels match a label selector made of
+            "key=value", "key" and "!key" terms
+        '''
+        labels = obj['metadata'].get('labels') or {}
+        for term in selector.split(','):
+            name, equals, value = term.partition('=')
+            if name.startswith('!'):
+                if name[1:] in labels:
+                    return False
+            elif name and (name not in labels or
+                           (equals and labels[name] != value)):
+                return False
+        return True
+    def _list(self, key, query):
+        ''' Return the pods of the Deployments, the events about the
+            Services, or any other kind of object in a namespace or in every
+            namespace. Only "involvedObject.name=" field selectors are
+            understood.
+        '''
+        selector = query.get('labelSelector', [''])[0]
+        fields = dict(i.partition('=')[::2] for i in
+                      query.get('fieldSelector', [''])[0].split(',') if i)
+        with self._lock:
+            objects = [(k, v[0]) for k, v in self._objects.items()
+                       if k[0] == key[0] and key[1] in (None, k[1])]
+        items = []
+        if key[2] == 'pods':
+            for (_, _, plural, name), obj in objects:
+                if plural != 'deployments':
+                    continue
+                items += [i for i in
+                          (self._pod(obj, i)
+                           for i in range(obj['spec'].get('replicas', 1)))
+                          if self._selected(i, selector)]
+        elif key[2] == 'events':
+            items = [{'type': 'Warning',
+                      'reason': 'CreatingLoadBalancerFailed',
+                      'message': self._lb_error(obj),
+                      'involvedObject': {'kind': 'Service',
+                                         'name': name,
+                                         'uid': obj['metadata']['uid']}}
+                     for (_, _, plural, name), obj in objects
+                     if plural == 'services' and self._lb_error(obj) and
+                     fields.get('involvedObject.name', name) == name]
+        else:
+            items = [obj for k, obj in objects
+                     if k[2] == key[2] and self._selected(obj, selector)]
+        return {'kind': 'List', 'apiVersion': 'v1', 'items': items}
+    def _pod(self, deployment, index):
+        ''' Return the status of one of a Deployment's pods
+        '''
+        name = deployment['metadata']['name']
+        if self._failing(deployment):
+            state = {'waiting': {'reason': 'ImagePullBackOff',
+                                 'message': 'Back-off pulling image "%s"'
+                                            % FAILING_IMAGE}}
+        else:
+            state = {'running': {}}
+        return {'kind': 'Pod',
+                'metadata': {'name': '%s-%s' % (name, index),
+                             'labels': {'name': name}},
+                'status': {'containerStatuses': [{'name': 'nginx',
+                                                  'state': state}]}}
+    @staticmethod
+    def _missing(key):
+        ''' Return the Status body for an object which does not exist
+        '''
+        return {'kind': 'Status', 'reason': 'NotFound', 'code': 404,
+                'message': '%s "%s" not found' % (key[2], key[3])}
+    def handle(self, handler, body):
+        ''' Create, replace, get, watch or delete an object
+        '''
+        key = self._key(handler)
+        if not key:
+            return self.reply(handler, 404, {'kind': 'Status',
+                                             'reason': 'NotFound'})
+        method = handler.command
+        if method == 'POST':
+            obj = json.loads(body.decode('utf-8'))
+            key = key[:3] + (obj['metadata']['name'],)
+            with self._lock:
+                if key in self._objects:
+                    return self.reply(handler, 409, {
+                        'kind': 'Status', 'reason': 'AlreadyExists',
+                        'code': 409, 'message': '%s "%s" already exists'
+                                                % (key[2], key[3])})
+                obj['metadata']['creationTimestamp'] = time.strftime(
+                    '%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+                obj['metadata']['uid'] = '%s-%s' % (key[3],
+                                                    next(self._uids))
+                self._objects[key] = (obj, time.monotonic())
+            return self.reply(handler, 201, obj)
+        query = urllib.parse.parse_qs(urllib.parse
+                                      .urlsplit(handler.path).query)
+        if method == 'GET' and 'watch' in query:
+            return self._watch(handler, key, query)
+        if method == 'GET' and not key[3]:
+            return self.reply(handler, 200, self._list(key, query))
+        with self._lock:
+            found = self._objects.get(key)
+            if not found:
+                return self.reply(handler, 404, self._missing(key))
+            if method == 'PUT':
+                obj = json.loads(body.decode('utf-8'))
+                self._objects[key] = (obj, found[1])
+                return self.reply(handler, 200, obj)
+            if method == 'DELETE':
+                del self._objects[key]
+                if key[2] == 'namespaces':
+                    for inside in [i for i in self._objects
+                                   if i[:2] == (key[0], key[3])]:
+                        del self._objects[inside]
+                return self.reply(handler, 200, {'kind': 'Status',
+                                                 'status': 'Success'})
+        return self.reply(handler, 200, self._status(key, *found))
+    def _watch(self, handler, key, query):
+        ''' Stream one MODIFIED event once the named object has its status,
+            or nothing if the watch times out first
+        '''
+        name = query.get('fieldSelector', [''])[0].partition('=')[2]
+        key = key[:3] + (name,)
+        deadline = time.monotonic() + float(query.get('timeoutSeconds',
+                                                      ['30'])[0])
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Connection', 'close')
+        handler.end_headers()
+        handler.wfile.flush()
+        while time.monotonic() < deadline:
+            with self._lock:
+                found = self._objects.get(key)
+            if not found:
+                event = {'type': 'DELETED', 'object': {'metadata': {
+                    'name': name}}}
+            else:
+                obj = self._status(key, *found)
+                event = {'type': 'MODIFIED', 'object': obj} \
+                        if 'status' in obj else None
+            if event:
+                handler.wfile.write(json.dumps(event).encode('utf-8') + b'\n')
+                break
+            time.sleep(WATCH_POLL)
+        handler.close_connection = True
+
+class FakeElb(FakeServer):
+    ''' Every LoadBalancer at once: an HTTP proxy which answers any request
+        for a bench.invalid host with nginx's welcome page, from each of
+        PODS_PER_ELB pods in turn
+    '''
+    def __init__(self, **kwargs):
+        ''' Initialization method. See FakeServer.
+        '''
+        FakeServer.__init__(self, **kwargs)
+        self._turns = itertools.count()
+    def handle(self, handler, body):
+        ''' Answer a proxied request
+        '''
+        host = urllib.parse.urlsplit(handler.path).hostname or ''
+        if not host.endswith(ELB_DOMAIN):
+            return self.reply(handler, 502, 'Not a benchmark host',
+                              content_type='text/plain')
+        pod = '%s-%s' % (host.split('.')[0], next(self._turns) % PODS_PER_ELB)
+        return self.reply(handler, 200, '<h1>Welcome to nginx!</h1>',
+                          content_type='text/html',
+                          headers={POD_HEADER: pod})
+
+class FakeLemur(FakeServer):
+    ''' Lemur API issuing throwaway client certificates
+    '''
+    def __init__(self, **kwargs):
+        ''' Initialization method. See FakeServer.
+        '''
+        FakeServer.__init__(self, **kwargs)
+        self._certs = {}
+        self._ids = itertools.count(1)
+    def handle(self, handler, body):
+        ''' Log in, find, create, or fetch the key of a certificate
+        '''
+        path = urllib.parse.urlsplit(handler.path)
+        if path.path.endswith('/auth/login'):
+            return self.reply(handler, 200, {'token': 'bench-token'})
+        if handler.headers.get('Authorization') != 'Bearer bench-token':
+            return self.reply(handler, 401, {'message': 'Not logged in'})
+        if path.path.endswith('/key'):
+            cert_id = int(path.path.split('/')[-2])
+            return self.reply(handler, 200, {'key': 'KEY %s' % cert_id})
+        if handler.command == 'POST':
+            manifest = json.loads(body.decode('utf-8'))
+            with self._lock:
+                cert_id = next(self._ids)
+                item = {'id': cert_id,
+                        'chain': 'CA CHAIN',
+                        'body': 'CERTIFICATE %s' % cert_id,
+                        'notAfter': time.strftime('%Y-%m-%dT%H:%M:%S+00:00',
+                                                  time.gmtime(time.time() +
+                                                              86400)),
+                        'description': manifest['description']}
+                self._certs[manifest['description']] = item
+            return self.reply(handler, 201, item)
+        wanted = urllib.parse.parse_qs(path.query).get('filter', [''])[0]
+        with self._lock:
+            item = self._certs.get(wanted.partition(';')[2])
+        return self.reply(handler, 200, {'total': 1 if item else 0,
+                                         'items': [item] if item else []})
+
+class FakeDatadog(FakeServer):
+    ''' Datadog intake counting the events and metric points it accepts
+    '''
+    def __init__(self, **kwargs):
+        ''' Initialization method. See FakeServer.
+        '''
+        FakeServer.__init__(self, **kwargs)
+        self.events = 0
+        self.points = 0
+    def handle(self, handler, body):
+        ''' Accept an event or a batch of series
+        '''
+        payload = json.loads(body.decode('utf-8'))
+        with self._lock:
+            if handler.path.startswith('/api/v2/series'):
+                self.points += sum(len(i.get('points', []))
+                                   for i in payload['series'])
+            else:
+                self.events += 1
+        return self.reply(handler, 202, {'status': 'ok'})
+
+class FakeAws(FakeServer):
+    ''' The S3 PutObject and IAM access key APIs, enough for secret refreshes
+    '''
+    IAM_NS = 'https://iam.amazonaws.com/doc/2010-05-08/'
+    def __init__(self, **kwargs):
+        ''' Initialization method. See FakeServer.
+        '''
+        FakeServer.__init__(self, **kwargs)
+        self._keys = itertools.count(1)
+    def _iam(self, handler, action, params):
+        ''' Answer an IAM query API call
+        '''
+        user = params.get('UserName', [''])[0]
+        if action == 'CreateAccessKey':
+            key_id = next(self._keys)
+            result = ('<AccessKey><UserName>%s</UserName>'
+                      '<AccessKeyId>AKIABENCH%08d</AccessKeyId>'
+                      '<Status>Active</Status>'
+                      '<SecretAccessKey>bench-secret-%s</SecretAccessKey>'
+                      '<CreateDate>2017-05-01T00:00:00Z</CreateDate>'
+                      '</AccessKey>' % (user, key_id, key_id))
+        else:
+            result = ''
+        return self.reply(handler, 200, '<%sResponse xmlns="%s"><%sResult>%s\
+</%sResult><ResponseMetadata><RequestId>bench</RequestId></ResponseMetadata>\
+</%sResponse>' % (action, self.IAM_NS, action, result, action, action),
+                          content_type='text/xml')
+    def handle(self, handler, body):
+        ''' Answer an IAM (form POST) or S3 (PUT object) request
+        '''
+        if handler.command == 'POST':
+            params = urllib.parse.parse_qs(body.decode('utf-8'))
+            return self._iam(handler, params.get('Action', [''])[0], params)
+        if handler.command == 'PUT':
+            handler.send_response(200)
+            handler.send_header('ETag', '"bench"')
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return None
+        return self.reply(handler, 404, {}, content_type='text/plain')
+
+class Environment(object):
+    ''' Start every fake, write a kubectl config file for them and a fake
+        kubectl, and point the library and the process environment at them
+        for the duration of a with block
+    '''
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, clusters=4, lb_delay=0.0, error_rate=0.0, latency=0.0):
+        ''' Initialization method
+            Keyword Arguments:
+                clusters: Number of contexts in the kubectl config file
+                lb_delay: Seconds before a new Service has an ingress
+                error_rate: Fraction of Kubernetes API requests which fail
+                latency: Seconds added to every Kubernetes API, Lemur and
+                         Datadog response
+        '''
+        self.clusters = ['bench-%s' % i for i in range(clusters)]
+        self.kube = FakeKubeApi(lb_delay=lb_delay,
+                                error_rate=error_rate,
+                                latency=latency)
+        self.elb = FakeElb()
+        self.lemur = FakeLemur(latency=latency)
+        self.datadog = FakeDatadog(latency=latency)
+        self.aws = FakeAws(latency=latency)
+        self._dir = None
+        self._saved = {}
+    @property
+    def servers(self):
+        ''' Return every fake server
+        '''
+        return [self.kube, self.elb, self.lemur, self.datadog, self.aws]
+    @property
+    def directory(self):
+        ''' Return the temporary directory holding the config and binaries
+        '''
+        return self._dir.name
+    @property
+    def kubeconfig(self):
+        ''' Return the path of the kubectl config file
+        '''
+        return os.path.join(self.directory, 'config')
+    @property
+    def aws_keys(self):
+        ''' Return an aws_keys entry for a secrets map which uses FakeAws
+        '''
+        return {'aws_access_key_id': 'AKIABENCH',
+                'aws_secret_access_key': 'bench',
+                'region_name': 'us-east-1',
+                'endpoint_url': self.aws.url}
+    def _write_kubeconfig(self):
+        ''' Write one context, cluster and user per benchmark cluster
+        '''
+        config = {'apiVersion': 'v1', 'kind': 'Config',
+                  'clusters': [], 'users': [], 'contexts': []}
+        for name in self.clusters:
+            config['clusters'].append({'name': name, 'cluster': {
+                'server': '%s/clusters/%s' % (self.kube.url, name),
+                'certificate-authority': '%s-ca.pem' % name}})
+            config['users'].append({'name': 'bench-%s-user' % name, 'user': {
+                'client-certificate': '%s-cert.pem' % name,
+                'client-key': '%s-key.pem' % name}})
+            config['contexts'].append({'name': name, 'context': {
+                'cluster': name, 'user': 'bench-%s-user' % name}})
+        with open(self.kubeconfig, 'w') as data:
+            yaml.safe_dump(config, data, default_flow_style=False)
+    def _write_kubectl(self):
+        ''' Write the fake kubectl into a bin directory
+        '''
+        bin_dir = os.path.join(self.directory, 'bin')
+        os.mkdir(bin_dir)
+        path = os.path.join(bin_dir, 'kubectl')
+        with open(path, 'w') as data:
+            data.write(KUBECTL % {'python': sys.executable,
+                                  'watch_poll': WATCH_POLL})
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+        return bin_dir
+    def _setenv(self, name, value):
+        ''' Set an environment variable until the block ends
+        '''
+        self._saved.setdefault(name, os.environ.get(name))
+        os.environ[name] = value
+    def __enter__(self):
+        ''' Start the fakes and point everything at them
+        '''
+        for server in self.servers:
+            server.start()
+        self._dir = tempfile.TemporaryDirectory(prefix='end2end-bench-')
+        self._write_kubeconfig()
+        bin_dir = self._write_kubectl()
+        self._setenv('PATH', bin_dir + os.pathsep + os.environ.get('PATH', ''))
+        # LoadBalancer hostnames only resolve through FakeElb
+        self._setenv('HTTP_PROXY', self.elb.url)
+        self._setenv('http_proxy', self.elb.url)
+        self._setenv('NO_PROXY', '127.0.0.1,localhost')
+        self._setenv('no_proxy', '127.0.0.1,localhost')
+        self._setenv('LEMUR_USER', 'bench')
+        self._setenv('LEMUR_PASS', 'bench')
+        self._saved['lemur_url'] = lemur.LEMUR_URL.get('bench')
+        lemur.LEMUR_URL['bench'] = self.lemur.url
+        self._saved['dd_api'] = dd.DD_API
+        dd.DD_API = self.datadog.url + '/api'
+        return self
+    def __exit__(self, *exc_info):
+        ''' Stop the fakes and put everything back
+        '''
+        dd.close_all()
+        dd.DD_API = self._saved.pop('dd_api')
+        url = self._saved.pop('lemur_url')
+        if url is None:
+            lemur.LEMUR_URL.pop('bench', None)
+        else:
+            lemur.LEMUR_URL['bench'] = url
+        for name, value in self._saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        self._saved = {}
+        kubeconfig.KubeConfig.clear()
+        for server in self.servers:
+            server.stop()
+        self._dir.cleanup()
+        return False
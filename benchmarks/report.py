@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+''' Describe the machine a benchmark ran on, and compare two result files
+'''
+
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+# Result keys (the last part of their dotted path) where bigger is worse, and
+# where bigger is better. Anything else is informational.
+LOWER_IS_BETTER = ('mean', 'p50', 'p90', 'p95', 'p99', 'seconds',
+                   'check_p50', 'check_p90', 'peak_memory_bytes',
+                   'lemur_requests', 'first_seconds')
+HIGHER_IS_BETTER = ('checks_per_second', 'instances_per_second',
+                    'requests_per_second')
+
+def git_revision():
+    ''' Return the commit being benchmarked, or None outside a git checkout
+    '''
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                      stderr=subprocess.DEVNULL)
+        return out.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def meta(args):
+    ''' Return what is needed to tell whether two result files are
+        comparable
+    '''
+    return {'revision': git_revision(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'parameters': {'iterations': args.iterations,
+                           'clusters': args.clusters,
+                           'levels': args.levels,
+                           'backend': args.backend,
+                           'lb_delay': args.lb_delay,
+                           'latency': args.latency,
+                           'error_rate': args.error_rate,
+                           'poll': args.poll}}
+
+def peak_rss_bytes():
+    ''' Return the most resident memory the process has used
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def flatten(results, prefix=''):
+    ''' Return {dotted.path: number} for every number in nested results
+    '''
+    flat = {}
+    for key, value in results.items():
+        path = '%s.%s' % (prefix, key) if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+def compare(baseline, current, threshold):
+    ''' Compare the results of two runs. Return a list of (path, baseline,
+        current, relative change, verdict) for every comparable number, where
+        verdict is 'regressed', 'improved' or ''.
+        Positional Arguments:
+            baseline: The "results" of the earlier run
+            current: The "results" of this run
+            threshold: Relative change, e.g. 0.25, beyond which a number
+                       counts as regressed or improved
+    '''
+    old, new = flatten(baseline), flatten(current)
+    rows = []
+    for path in sorted(set(old) & set(new)):
+        name = path.rsplit('.', 1)[-1]
+        if name in LOWER_IS_BETTER:
+            sign = 1
+        elif name in HIGHER_IS_BETTER:
+            sign = -1
+        else:
+            continue
+        if not old[path]:
+            continue
+        change = (new[path] - old[path]) / float(old[path])
+        verdict = ''
+        if sign * change > threshold:
+            verdict = 'regressed'
+        elif sign * change < -threshold:
+            verdict = 'improved'
+        rows.append((path, old[path], new[path], change, verdict))
+    return rows
+
+def format_comparison(rows):
+    ''' Return a comparison as a text table
+    '''
+    width = max([len(i[0]) for i in rows] + [6])
+    lines = ['%-*s %14s %14s %8s' % (width, 'metric', 'baseline', 'current',
+                                    'change')]
+    for path, old, new, change, verdict in rows:
+        lines.append('%-*s %14s %14s %+7.1f%% %s' % (width, path, old, new,
+                                                     change * 100, verdict))
+    return '\n'.join(lines)
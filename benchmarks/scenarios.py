@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+''' Benchmarks of the real code paths, run against benchmarks.fakes
+'''
+
+import collections
+import concurrent.futures
+import glob
+import math
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from benchmarks import fakes
+from library import certcache, check, dd, defaults, fleet, k8s, lemur
+from library import loadprobe
+from library import manifests, retry, rotation, secret, sweep
+
+DD_API_KEY = 'bench'
+# Cert files and cache index written next to the kubectl config file
+CERT_FILES = ('*-ca.pem', '*-cert.pem', '*-key.pem', certcache.INDEX)
+# Namespaces each cluster gets a copy of every benchmark secret in
+SECRET_NAMESPACES = 4
+# Workloads left behind on each cluster for the sweep benchmark
+LEAKED_WORKLOADS = 5
+# Seconds each load probe in the load benchmark runs for
+LOAD_SECONDS = 1
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))), 'end2end_k8s.py')
+
+def percentiles(samples):
+    ''' Summarize latency samples, in seconds, by nearest-rank percentiles
+    '''
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    def rank(percent):
+        ''' Return the nearest-rank percentile
+        '''
+        return ordered[max(0, int(math.ceil(percent / 100.0 *
+                                            len(ordered))) - 1)]
+    return {'count': len(ordered),
+            'min': round(ordered[0], 4),
+            'mean': round(sum(ordered) / len(ordered), 4),
+            'p50': round(rank(50), 4),
+            'p90': round(rank(90), 4),
+            'p99': round(rank(99), 4),
+            'max': round(ordered[-1], 4)}
+
+def timed(func, *args, **kwargs):
+    ''' Return (seconds taken, result) of a call
+    '''
+    started = time.monotonic()
+    result = func(*args, **kwargs)
+    return time.monotonic() - started, result
+
+def peak_memory(func, *args, **kwargs):
+    ''' Return the most memory Python allocated at once during a call, in
+        bytes. Allocations made by other threads at the time are counted too.
+    '''
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def clear_certs(env):
+    ''' Remove every certificate file and the cache index, so the next
+        provisioning has to go to Lemur
+    '''
+    for pattern in CERT_FILES:
+        for path in glob.glob(os.path.join(env.directory, pattern)):
+            os.remove(path)
+
+def bench_check(env, args):
+    ''' Latency of single checks (check.run_check) with each backend, polling
+        and watching for the LoadBalancer
+    '''
+    results = collections.OrderedDict()
+    strategy = retry.Fixed(args.poll)
+    for backend in ('kubectl', 'api'):
+        for watch in (False, True):
+            # one() only runs during this iteration
+            # pylint: disable=cell-var-from-loop
+            def one():
+                ''' Run one check
+                '''
+                return check.run_check(env.clusters[0],
+                                       env.kubeconfig,
+                                       DD_API_KEY,
+                                       backend=backend,
+                                       watch=watch,
+                                       strategy=strategy)
+            samples, failures = [], 0
+            phases = collections.defaultdict(list)
+            for _ in range(args.iterations):
+                seconds, result = timed(one)
+                samples.append(seconds)
+                failures += not result.ok
+                for phase, value in result.timer.phases.items():
+                    phases[phase].append(value)
+            variant = percentiles(samples)
+            variant['failures'] = failures
+            variant['phases_p50'] = {k: percentiles(v)['p50']
+                                     for k, v in sorted(phases.items())}
+            variant['peak_memory_bytes'] = peak_memory(one)
+            results['%s%s' % (backend, '-watch' if watch else '')] = variant
+    dd.batch_client(DD_API_KEY).flush(dd.RETRY_TIMEOUT)
+    results['datadog'] = {'events': env.datadog.events,
+                          'points': env.datadog.points}
+    return results
+
+def bench_canary(env, args):
+    ''' Latency of persistent checks (check.run_check with persistent=True)
+        with each backend: the first creates the canary, the rest reuse it
+    '''
+    results = collections.OrderedDict()
+    for backend in ('kubectl', 'api'):
+        # one() only runs during this iteration
+        # pylint: disable=cell-var-from-loop
+        def one():
+            ''' Run one persistent check
+            '''
+            return check.run_check(env.clusters[0],
+                                   env.kubeconfig,
+                                   backend=backend,
+                                   strategy=retry.Fixed(args.poll),
+                                   persistent=True)
+        first, _ = timed(one)
+        reused = [timed(one) for _ in range(args.iterations)]
+        variant = percentiles([i[0] for i in reused])
+        variant['first_seconds'] = round(first, 4)
+        variant['failures'] = sum(not i[1].ok for i in reused)
+        results[backend] = variant
+        # So the next backend starts without a canary too
+        k8s.JustOKKube(env.clusters[0],
+                       env.kubeconfig,
+                       backend=backend,
+                       workload=manifests.Workload(**defaults.CANARY)
+                      ).delete_workload()
+    return results
+
+class LoadBalancerErrorWorkload(manifests.Workload):
+    ''' Workload whose Service never gets a LoadBalancer from the fakes
+    '''
+    def service(self):
+        ''' Return the Service manifest, annotated to fail
+        '''
+        service = super(LoadBalancerErrorWorkload, self).service()
+        service['metadata']['annotations'] = {fakes.LB_ERROR:
+                                              'Quota exceeded'}
+        return service
+
+def bench_failfast(env, args):
+    ''' How long a check with each backend takes to report pods which cannot
+        start and a LoadBalancer which cannot be created
+    '''
+    results = collections.OrderedDict()
+    failures = (('image', manifests.Workload(image=fakes.FAILING_IMAGE)),
+                ('loadbalancer', LoadBalancerErrorWorkload()))
+    for backend in ('kubectl', 'api'):
+        for name, workload in failures:
+            # workload only changes between iterations of the loops
+            # pylint: disable=cell-var-from-loop
+            checked = [timed(lambda: check.run_check(
+                env.clusters[0],
+                env.kubeconfig,
+                backend=backend,
+                strategy=retry.Fixed(args.poll),
+                workload=workload)) for _ in range(args.iterations)]
+            variant = percentiles([i[0] for i in checked])
+            variant['passed'] = sum(i[1].ok for i in checked)
+            results['%s-%s' % (backend, name)] = variant
+    return results
+
+def bench_load(env, args):
+    ''' Requests per second and latency of loadprobe.LoadProbe against one
+        fake LoadBalancer at each concurrency level
+    '''
+    results = collections.OrderedDict()
+    url = 'http://elb-%s.%s' % (env.clusters[0], fakes.ELB_DOMAIN)
+    for concurrency in args.levels:
+        probe = loadprobe.LoadProbe(url,
+                                    concurrency=concurrency,
+                                    duration=LOAD_SECONDS)
+        record = probe.run().record()
+        level = {'requests_per_second': record['requests_per_second'],
+                 'error_rate': record['error_rate'],
+                 'pods': len(record['pods'])}
+        level.update(record['latency'])
+        level.update({'connection_%s' % k: v
+                      for k, v in record['connection'].items()})
+        results['concurrency-%s' % concurrency] = level
+    return results
+
+def bench_fleet(env, args):
+    ''' Throughput of fleet.FleetCheck over every cluster at each concurrency
+        level
+    '''
+    results = collections.OrderedDict()
+    for concurrency in args.levels:
+        fleet_check = fleet.FleetCheck(env.clusters,
+                                       env.kubeconfig,
+                                       DD_API_KEY,
+                                       concurrency,
+                                       backend=args.backend,
+                                       strategy=retry.Fixed(args.poll))
+        seconds, checked = timed(lambda: list(fleet_check.run()))
+        level = {'clusters': len(checked),
+                 'failures': sum(not i.ok for i in checked),
+                 'seconds': round(seconds, 4),
+                 'checks_per_second': round(len(checked) / seconds, 3)}
+        level.update({'check_%s' % k: v
+                      for k, v in percentiles([i.elapsed
+                                               for i in checked]).items()
+                      if k in ('p50', 'p90', 'max')})
+        results['concurrency-%s' % concurrency] = level
+    return results
+
+def bench_parallel(env, args):
+    ''' Latency of concurrent checks of one cluster (check.run_check), each
+        with its own run ID, sharing a namespace or each in its own
+    '''
+    results = collections.OrderedDict()
+    concurrency = max(args.levels)
+    for own_namespace in (False, True):
+        # one() only runs during this iteration
+        # pylint: disable=cell-var-from-loop
+        def one(_):
+            ''' Run one check
+            '''
+            return check.run_check(env.clusters[0],
+                                   env.kubeconfig,
+                                   backend=args.backend,
+                                   strategy=retry.Fixed(args.poll),
+                                   own_namespace=own_namespace)
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            seconds, checked = timed(lambda: list(pool.map(one,
+                                                           range(concurrency))))
+        variant = percentiles([i.elapsed for i in checked])
+        variant['checks'] = len(checked)
+        variant['failures'] = sum(not i.ok for i in checked)
+        variant['run_ids'] = len(set(i.record()['run_id'] for i in checked))
+        variant['seconds'] = round(seconds, 4)
+        results['own-namespace' if own_namespace else 'shared'] = variant
+    return results
+
+def leak_workloads(env, count=LEAKED_WORKLOADS):
+    ''' Leave count check workloads, as many more in Namespaces of their own,
+        and the persistent canary, on every cluster
+    '''
+    workloads = [manifests.Workload(name='end2end-leaked-%s' % i)
+                 for i in range(count)]
+    workloads += [manifests.Workload(run_id=manifests.run_id(),
+                                     own_namespace=True)
+                  for _ in range(count)]
+    workloads.append(manifests.Workload(**defaults.CANARY))
+    for cluster in env.clusters:
+        for workload in workloads:
+            k8s.JustOKKube(cluster,
+                           env.kubeconfig,
+                           backend='api',
+                           workload=workload).create_workload()
+
+def bench_sweep(env, args):
+    ''' Time sweep.Sweeper takes with each backend to delete the workloads
+        left behind on every cluster, leaving the persistent canary alone
+    '''
+    results = collections.OrderedDict()
+    for backend in ('kubectl', 'api'):
+        leak_workloads(env)
+        sweeper = sweep.Sweeper(env.clusters,
+                                env.kubeconfig,
+                                max_age=0,
+                                concurrency=max(args.levels),
+                                backend=backend)
+        seconds, swept = timed(lambda: list(sweeper.run()))
+        left = sweep.Sweeper(env.clusters,
+                             env.kubeconfig,
+                             max_age=0,
+                             dry_run=True,
+                             backend='api')
+        canaries = k8s.JustOKKube(env.clusters[0],
+                                  env.kubeconfig,
+                                  backend='api',
+                                  workload=manifests.Workload(
+                                      **defaults.CANARY))
+        results[backend] = {'clusters': len(swept),
+                            'failures': sum(not i.ok for i in swept),
+                            'deleted': sweeper.summary()['deleted'],
+                            'left': sum(len(i.stale) for i in left.run()),
+                            'canary_kept': all(canaries.get_workload()),
+                            'seconds': round(seconds, 4)}
+        for cluster in env.clusters:
+            k8s.JustOKKube(cluster,
+                           env.kubeconfig,
+                           backend='api',
+                           workload=manifests.Workload(**defaults.CANARY)
+                          ).delete_workload()
+    return results
+
+def bench_certs(env, args):
+    ''' Latency of lemur.CertificateSet.run with and without cached
+        certificates, and how many Lemur requests concurrent provisioning of
+        the same certificates makes
+    '''
+    cluster = env.clusters[0]
+    def cold():
+        ''' Provision with nothing cached
+        '''
+        clear_certs(env)
+        return lemur.CertificateSet(cluster, env.kubeconfig).run()
+    def warm():
+        ''' Provision with the certificates already on disk
+        '''
+        return lemur.CertificateSet(cluster, env.kubeconfig).run()
+    results = collections.OrderedDict()
+    for name, func in (('cold', cold), ('warm', warm)):
+        results[name] = percentiles([timed(func)[0]
+                                     for _ in range(args.iterations)])
+        results[name]['peak_memory_bytes'] = peak_memory(func)
+    callers = max(args.levels)
+    clear_certs(env)
+    env.lemur.reset()
+    registry = lemur.ProvisionRegistry()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=callers) as pool:
+        seconds, _ = timed(lambda: list(pool.map(
+            lambda _: registry.provision(cluster, env.kubeconfig),
+            range(callers))))
+    results['concurrent'] = {'callers': callers,
+                             'seconds': round(seconds, 4),
+                             'lemur_requests': env.lemur.requests}
+    return results
+
+def make_secrets(env, namespaces=SECRET_NAMESPACES):
+    ''' Return an IAM and an S3 secret, each with a copy in several namespaces
+        of every cluster, all backed by FakeAws
+    '''
+    keys = {'bench': env.aws_keys}
+    places = [(cluster, 'bench-%s' % i)
+              for cluster in env.clusters
+              for i in range(namespaces)]
+    iam = secret.MakoIAMSecret('bench-iam',
+                               [{'cluster': cluster,
+                                 'namespace': namespace,
+                                 'iam_user': 'bench-user',
+                                 'aws_keys': 'bench',
+                                 'key': 'credentials'}
+                                for cluster, namespace in places],
+                               keys,
+                               env.kubeconfig)
+    s3 = secret.MakoLemurSecret('bench-s3',
+                                [{'cluster': cluster,
+                                  'namespace': namespace,
+                                  'bucket': 'bench-bucket',
+                                  'aws_keys': 'bench',
+                                  'key': 'shared-secret'}
+                                 for cluster, namespace in places],
+                                keys,
+                                env.kubeconfig)
+    return [iam, s3]
+
+def bench_secrets(env, args):
+    ''' Latency of secret.SharedSecret.create for each kind of secret, and
+        throughput of rotation.RotationScheduler at each concurrency level
+    '''
+    # The first AWS call loads botocore's service models; keep it out of the
+    # measurements
+    for the_secret in make_secrets(env, namespaces=1):
+        the_secret.create()
+    results = collections.OrderedDict()
+    for index, name in enumerate(('iam', 's3')):
+        results['create-%s' % name] = percentiles(
+            [timed(make_secrets(env)[index].create)[0]
+             for _ in range(args.iterations)])
+        results['create-%s' % name]['peak_memory_bytes'] = peak_memory(
+            make_secrets(env)[index].create)
+    for concurrency in args.levels:
+        scheduler = rotation.RotationScheduler(make_secrets(env), concurrency)
+        seconds, rotated = timed(scheduler.run)
+        results['rotate-concurrency-%s' % concurrency] = {
+            'instances': len(rotated),
+            'failures': sum(not i.ok for i in rotated),
+            'seconds': round(seconds, 4),
+            'instances_per_second': round(len(rotated) / seconds, 3)}
+    return results
+
+def bench_startup(env, args):
+    ''' Latency of starting the command line for "clusters", which should
+        not pay for importing the AWS SDK or an HTTP client, next to starting
+        a bare interpreter
+    '''
+    commands = (('bare', [sys.executable, '-c', 'pass']),
+                ('clusters', [sys.executable, SCRIPT, '-k', env.kubeconfig,
+                              'clusters', '-j']))
+    results = collections.OrderedDict()
+    for name, command in commands:
+        results[name] = percentiles(
+            [timed(subprocess.check_call, command,
+                   stdout=subprocess.DEVNULL)[0]
+             for _ in range(args.iterations)])
+    results['over_bare'] = {'seconds': round(results['clusters']['p50'] -
+                                             results['bare']['p50'], 4)}
+    return results
+
+SCENARIOS = collections.OrderedDict([('check', bench_check),
+                                     ('canary', bench_canary),
+                                     ('failfast', bench_failfast),
+                                     ('load', bench_load),
+                                     ('fleet', bench_fleet),
+                                     ('parallel', bench_parallel),
+                                     ('sweep', bench_sweep),
+                                     ('certs', bench_certs),
+                                     ('secrets', bench_secrets),
+                                     ('startup', bench_startup)])
@@ -2,47 +2,151 @@
 ''' Main script of k8s end to end cluster check
 '''
 import argparse
+import atexit
 import logging
 import json
 import os
 import sys
-from library import defaults, k8s, dd, kube_choices, secret
-import yaml
+from library import defaults, retry
 
 LOGGER = logging.getLogger(defaults.LOGGER)
 
+# Each subcommand imports what it needs when it runs: "clusters" is called
+# constantly to fill option lists and must not wait for boto3 and requests.
+# pylint: disable=import-outside-toplevel
+
 def run_tests(args):
     ''' Defaults function for argument parser
         Run the end to end test
     '''
-    kube = k8s.JustOKKube(args.clustername, args.kubeconfig)
-    LOGGER.info('Attempting to create, check, and delete service on cluster \
-"%s"', args.clustername)
+    if args.all or args.clusters:
+        run_fleet(args)
+        return
+    if not args.clustername:
+        LOGGER.error('A cluster name, --clusters, or --all is required.')
+        sys.exit(2)
+    from library import check
+    result = check.run_check(args.clustername,
+                             args.kubeconfig,
+                             args.dd_api_key,
+                             **kube_options(args))
+    if args.json:
+        print(json.dumps(result.record()), flush=True)
+
+def kube_options(args):
+    ''' Collect the check.run_check and k8s.JustOKKube options given on the
+        command line
+    '''
+    load = None
+    if args.load:
+        load = {'concurrency': args.load_concurrency,
+                'duration': args.load_duration,
+                'requests_total': args.load_requests}
+    return {'backend': args.backend,
+            'watch': args.watch,
+            'strategy': retry.strategy_from_str(args.retry_strategy),
+            'persistent': args.persistent,
+            'full_every': args.full_every,
+            'own_namespace': args.ephemeral_namespace,
+            'load': load,
+            'max_error_rate': args.load_max_error_rate}
+
+def run_fleet(args):
+    ''' Run the end to end test against several clusters at once, printing
+        one JSON record per cluster as it finishes and a summary at the end
+    '''
+    from library import fleet, kube_choices
+    known = kube_choices.KubeChoice.from_path(args.kubeconfig)
+    if args.all:
+        clusters = known
+    else:
+        clusters = [i.strip() for i in args.clusters.split(',') if i.strip()]
+        unknown = [i for i in clusters if i not in known]
+        if unknown:
+            LOGGER.error('Unknown cluster(s) "%s" in kubectl config file "%s"',
+                         ', '.join(unknown),
+                         args.kubeconfig)
+            sys.exit(2)
+    fleet_check = fleet.FleetCheck(clusters,
+                                   args.kubeconfig,
+                                   args.dd_api_key,
+                                   args.concurrency,
+                                   **kube_options(args))
+    for result in fleet_check.run():
+        print(json.dumps(result.record()), flush=True)
+    summary = fleet_check.summary()
+    print(json.dumps({'summary': summary}), flush=True)
+    if summary['failed']:
+        sys.exit(1)
+
+def run_serve(args):
+    ''' Check clusters on a schedule until interrupted, serving the results
+        as Prometheus metrics
+    '''
+    from library import serve
+    import signal
+    clusters = None
+    if args.clusters:
+        clusters = [i.strip() for i in args.clusters.split(',') if i.strip()]
+    try:
+        daemon = serve.CheckDaemon(args.kubeconfig,
+                                   clusters,
+                                   args.dd_api_key,
+                                   args.concurrency,
+                                   args.schedule,
+                                   args.interval,
+                                   args.jitter,
+                                   **kube_options(args))
+        daemon.reload()
+    except serve.ScheduleError as err:
+        LOGGER.error(str(err))
+        sys.exit(2)
+    server = serve.MetricsServer(daemon.metrics, args.address, args.port)
+    server.start()
+    LOGGER.warning('Checking %d cluster(s), metrics on http://%s:%d/metrics',
+                   len(daemon.clusters),
+                   *server.server_address[:2])
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
     try:
-        kube.create_deploy()
-        kube.create_svc()
-        event_msg = kube.verify_ingress()
-        alert_type = 'info'
-    except (k8s.KubeError, ValueError) as error:
-        event_msg = str(error)
-        alert_type = 'error'
-        LOGGER.exception(event_msg)
+        daemon.run()
+    except KeyboardInterrupt:
+        # run has already waited for the checks under way to clean up
+        daemon.stop()
     finally:
-        kube.delete_deploy()
-        kube.delete_svc()
-    kube.cleanup()
-    LOGGER.info('Attempting to send event message "%s" to datadog for cluster "%s"',
-                event_msg,
-                args.clustername)
-    dd_client = dd.DDClient(args.dd_api_key)
-    result = dd_client.send_event(event_msg,
-                                  alert_type=alert_type,
-                                  tags=['k8s_cluster:%s' % args.clustername])
-    LOGGER.info('Results from sending event to datadog: "%s"', result.text)
+        server.shutdown()
+
+def run_sweep(args):
+    ''' Delete the check workloads left behind on clusters, printing one JSON
+        record per cluster as it finishes and a summary at the end
+    '''
+    from library import kube_choices, sweep
+    known = kube_choices.KubeChoice.from_path(args.kubeconfig)
+    clusters = known
+    if args.clusters:
+        clusters = [i.strip() for i in args.clusters.split(',') if i.strip()]
+        unknown = [i for i in clusters if i not in known]
+        if unknown:
+            LOGGER.error('Unknown cluster(s) "%s" in kubectl config file "%s"',
+                         ', '.join(unknown),
+                         args.kubeconfig)
+            sys.exit(2)
+    sweeper = sweep.Sweeper(clusters,
+                            args.kubeconfig,
+                            args.max_age,
+                            args.concurrency,
+                            args.dry_run,
+                            backend=args.backend)
+    for result in sweeper.run():
+        print(json.dumps(result.record()), flush=True)
+    summary = sweeper.summary()
+    print(json.dumps({'summary': summary}), flush=True)
+    if summary['failed']:
+        sys.exit(1)
 
 def list_choices(args):
     ''' List out the known clusters in the kubectl config file, if it exists
     '''
+    from library import kube_choices
     if args.json:
         print(json.dumps([{'name': i, 'value': i}
                           for i in (kube_choices
@@ -55,22 +159,86 @@ def refresh_secrets(args):
     ''' This is a highly-specific workflow relying on a highly-specific
         configuration file. Use only if you know exactly what you're doing.
     '''
-    secrets_map = yaml.load(args.secretsmap)
-    try:
-        secret_type = (secret
-                       .SecretChoice
-                       .from_str(secrets_map['secrets'][args.secret]['type']))
-    except KeyError:
-        LOGGER.exception('Unable to find secret "%s" in secrets map!',
-                         args.secret)
+    from library import ratelimit, rotation, secret
+    import yaml
+    secrets_map = yaml.safe_load(args.secretsmap)
+    if args.all:
+        names = sorted(secrets_map['secrets'])
+    elif args.secret:
+        names = [args.secret]
+    else:
+        LOGGER.error('A secret name or --all is required.')
+        sys.exit(2)
+    limiter = ratelimit.RateLimiter(args.aws_rate, args.aws_burst)
+    secrets = []
+    for name in names:
+        try:
+            secret_type = (secret
+                           .SecretChoice
+                           .from_str(secrets_map['secrets'][name]['type']))
+        except KeyError:
+            LOGGER.exception('Unable to find secret "%s" in secrets map!',
+                             name)
+            sys.exit(1)
+        instances = [i for i in secrets_map['secrets'][name]['instances']
+                     if i['env'] == args.environment]
+        secrets.append(secret_type(name,
+                                   instances,
+                                   secrets_map['aws_keys'],
+                                   args.kubeconfig,
+                                   limiter=limiter))
+    scheduler = rotation.RotationScheduler(secrets, args.concurrency)
+    for result in scheduler.run():
+        print(json.dumps(result.record()), flush=True)
+    summary = scheduler.summary()
+    print(json.dumps({'summary': summary}), flush=True)
+    if summary['failed']:
         sys.exit(1)
-    instances = [i for i in secrets_map['secrets'][args.secret]['instances']
-                 if i['env'] == args.environment]
-    the_secret = secret_type(args.secret,
-                             instances,
-                             secrets_map['aws_keys'],
-                             args.kubeconfig)
-    the_secret.create()
+
+def start_trace(path):
+    ''' Record a span for every kubectl and API call, HTTP request and sleep
+        the run makes, and write them to path as Chrome trace-event JSON when
+        the program exits
+    '''
+    from library import trace
+    # Registered before anything else, so it runs after Datadog's last flush
+    atexit.register(trace.start().write, path)
+
+def start_profile(path):
+    ''' Profile the main thread and every thread started after it with
+        cProfile, and write their merged pstats to path when the program
+        exits
+    '''
+    import cProfile
+    import pstats
+    import threading
+    profiles = [cProfile.Profile()]
+    lock = threading.Lock()
+    def profile_thread(*_):
+        ''' Give a new thread a profile of its own, on its first call
+        '''
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # From Python 3.12 one profile sees every thread, and the main
+            # thread's is already running
+            return
+        with lock:
+            profiles.append(profile)
+    def stop():
+        ''' Stop profiling and write the stats of every thread
+        '''
+        threading.setprofile(None)
+        with lock:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+        stats.dump_stats(path)
+    atexit.register(stop)
+    threading.setprofile(profile_thread)
+    profiles[0].enable()
 
 def mk_dd_api(argument):
     ''' Function to help argparse collect the value of the DD api key
@@ -83,6 +251,20 @@ program args or environment variables. Will not be able to submit results to \
 datadog.')
     return argument
 
+def mk_positive(cast):
+    ''' Create an argparse type which converts its argument with cast and
+        rejects anything not greater than zero
+    '''
+    def positive(argument):
+        ''' Convert argument, which must be greater than zero
+        '''
+        value = cast(argument)
+        if value <= 0:
+            raise argparse.ArgumentTypeError('%s is not greater than zero'
+                                             % argument)
+        return value
+    return positive
+
 def mk_secrets_map(argument):
     ''' Function to help argparse collect the value of the secret map
         regardless of the way in which it was provided
@@ -105,16 +287,153 @@ def main():
     parser.add_argument('-k', '--kubeconfig',
                         help='Path to Kubectl Config file',
                         default=defaults.KUBECONFIG)
+    parser.add_argument('--trace',
+                        help='Write a Chrome trace-event JSON file of every \
+kubectl and API call, HTTP request and sleep, by cluster and phase',
+                        metavar='FILE')
+    parser.add_argument('--profile',
+                        help='Profile every thread with cProfile and write \
+the merged pstats to this file',
+                        metavar='FILE')
+    # Options for how to talk to clusters, shared by check and serve
+    kube_parser = argparse.ArgumentParser(add_help=False)
+    kube_parser.add_argument('-b', '--backend',
+                             help='How to talk to the cluster: shell out to \
+kubectl or use the Kubernetes API directly',
+                             choices=defaults.KUBE_BACKENDS,
+                             default=defaults.KUBE_BACKEND)
+    kube_parser.add_argument('-w', '--watch',
+                             help='Watch the service for its LoadBalancer \
+Ingress instead of polling it',
+                             action='store_true',
+                             default=False)
+    kube_parser.add_argument('-r', '--retry_strategy',
+                             help='How to space out attempts while waiting \
+for the LoadBalancer and its address',
+                             choices=sorted(retry.STRATEGIES),
+                             default=defaults.RETRY_STRATEGY)
+    workload_group = kube_parser.add_mutually_exclusive_group()
+    workload_group.add_argument('--persistent',
+                                help='Keep a canary Deployment and Service \
+on the cluster between checks, only recreating what is missing or drifted',
+                                action='store_true',
+                                default=False)
+    workload_group.add_argument('--ephemeral_namespace',
+                                help='Create the test Deployment and Service \
+in a namespace of their own, and delete just that afterwards',
+                                action='store_true',
+                                default=False)
+    kube_parser.add_argument('--full_every',
+                             help='Seconds after which the persistent canary \
+is deleted and created again',
+                             type=float,
+                             default=defaults.CANARY_FULL_EVERY)
+    kube_parser.add_argument('--load',
+                             help='Once the LoadBalancer answers, send it \
+concurrent requests for a while and report latency percentiles, errors and \
+how requests spread over the pods',
+                             action='store_true',
+                             default=False)
+    kube_parser.add_argument('--load_concurrency',
+                             help='Connections the load probe keeps open at \
+once',
+                             type=int,
+                             default=defaults.LOAD_CONCURRENCY)
+    kube_parser.add_argument('--load_duration',
+                             help='Seconds the load probe sends requests for',
+                             type=float,
+                             default=defaults.LOAD_DURATION)
+    kube_parser.add_argument('--load_requests',
+                             help='Stop the load probe after this many \
+requests, if that comes first',
+                             type=int)
+    kube_parser.add_argument('--load_max_error_rate',
+                             help='Fraction of load probe requests which may \
+fail before the check does',
+                             type=float,
+                             default=defaults.LOAD_MAX_ERROR_RATE)
+    kube_parser.add_argument('-d', '--dd_api_key',
+                             help='Datadog API key for submitting events.',
+                             default='', # set default to ensure call to
+                                         # mk_dd_api()
+                             type=mk_dd_api)
     subparsers = parser.add_subparsers(dest='subparser_name')
-    check_parser = subparsers.add_parser('check')
+    check_parser = subparsers.add_parser('check', parents=[kube_parser])
     check_parser.add_argument('clustername',
-                              help='Name of the cluster')
-    check_parser.add_argument('-d', '--dd_api_key',
-                              help='Datadog API key for submitting events.',
-                              default='', # set default to ensure call to
-                                          # mk_dd_api()
-                              type=mk_dd_api)
+                              help='Name of the cluster',
+                              nargs='?')
+    fleet_group = check_parser.add_mutually_exclusive_group()
+    fleet_group.add_argument('-a', '--all',
+                             help='Check every cluster in the kubectl config \
+file',
+                             action='store_true',
+                             default=False)
+    fleet_group.add_argument('--clusters',
+                             help='Comma-separated list of clusters to check')
+    check_parser.add_argument('-j', '--json',
+                              help='Print the result and per-phase timings \
+as JSON. Always on with --all or --clusters.',
+                              action='store_true',
+                              default=False)
+    check_parser.add_argument('-c', '--concurrency',
+                              help='Maximum number of clusters to check at \
+once with --all or --clusters',
+                              type=int,
+                              default=defaults.FLEET_CONCURRENCY)
     check_parser.set_defaults(func=run_tests)
+    serve_parser = subparsers.add_parser('serve', parents=[kube_parser])
+    serve_parser.add_argument('--clusters',
+                              help='Comma-separated list of clusters to \
+check. Every cluster in the kubectl config file is checked by default.')
+    serve_parser.add_argument('-c', '--concurrency',
+                              help='Maximum number of clusters to check at \
+once',
+                              type=int,
+                              default=defaults.FLEET_CONCURRENCY)
+    serve_parser.add_argument('-i', '--interval',
+                              help='Seconds between checks of each cluster',
+                              type=float,
+                              default=defaults.SERVE_INTERVAL)
+    serve_parser.add_argument('--jitter',
+                              help='Fraction of the interval randomly added \
+or taken away, so checks do not line up',
+                              type=float,
+                              default=defaults.SERVE_JITTER)
+    serve_parser.add_argument('-s', '--schedule',
+                              help='YAML file of per-cluster intervals and \
+jitter. Reloaded when it changes.')
+    serve_parser.add_argument('--address',
+                              help='Address to serve metrics on',
+                              default='127.0.0.1')
+    serve_parser.add_argument('-p', '--port',
+                              help='Port to serve metrics on',
+                              type=int,
+                              default=defaults.SERVE_PORT)
+    serve_parser.set_defaults(func=run_serve)
+    sweep_parser = subparsers.add_parser('sweep')
+    sweep_parser.add_argument('--clusters',
+                              help='Comma-separated list of clusters to \
+sweep. Every cluster in the kubectl config file is swept by default.')
+    sweep_parser.add_argument('-b', '--backend',
+                              help='How to talk to the cluster: shell out to \
+kubectl or use the Kubernetes API directly',
+                              choices=defaults.KUBE_BACKENDS,
+                              default=defaults.KUBE_BACKEND)
+    sweep_parser.add_argument('-c', '--concurrency',
+                              help='Maximum number of clusters to sweep at \
+once',
+                              type=int,
+                              default=defaults.FLEET_CONCURRENCY)
+    sweep_parser.add_argument('--max_age',
+                              help='Seconds after which a check\'s \
+Deployment and Service are considered left behind',
+                              type=float,
+                              default=defaults.SWEEP_AGE)
+    sweep_parser.add_argument('-n', '--dry_run',
+                              help='Only list what would be deleted',
+                              action='store_true',
+                              default=False)
+    sweep_parser.set_defaults(func=run_sweep)
     list_parser = subparsers.add_parser('clusters')
     list_parser.add_argument('-j', '--json',
                              help='Print clusters in json',
@@ -123,7 +442,27 @@ def main():
     list_parser.set_defaults(func=list_choices)
     refresh_parser = subparsers.add_parser('refresh')
     refresh_parser.add_argument('secret',
-                                help='Name of the secret to refresh')
+                                help='Name of the secret to refresh',
+                                nargs='?')
+    refresh_parser.add_argument('-a', '--all',
+                                help='Refresh every secret in the secrets map',
+                                action='store_true',
+                                default=False)
+    refresh_parser.add_argument('-c', '--concurrency',
+                                help='Maximum number of secret instances to \
+refresh at once',
+                                type=int,
+                                default=defaults.ROTATION_CONCURRENCY)
+    refresh_parser.add_argument('--aws_rate',
+                                help='AWS API calls per second allowed for \
+each set of aws_keys',
+                                type=mk_positive(float),
+                                default=defaults.AWS_RATE)
+    refresh_parser.add_argument('--aws_burst',
+                                help='AWS API calls allowed in a burst for \
+each set of aws_keys',
+                                type=mk_positive(int),
+                                default=defaults.AWS_BURST)
     refresh_parser.add_argument('-s', '--secretsmap',
                                 help='Yaml string containing map of secrets \
 to refresh',
@@ -141,6 +480,10 @@ environments.',
     level = levels[min(len(levels)-1, args.verbose)]
     LOGGER.setLevel(level)
     LOGGER.addHandler(logging.StreamHandler())
+    if args.trace:
+        start_trace(args.trace)
+    if args.profile:
+        start_profile(args.profile)
     args.func(args)
 
 if __name__ == '__main__':
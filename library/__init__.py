@@ -1,3 +1,6 @@
 ''' Module Initialization
 '''
-__all__ = ['k8s', 'dd', 'defaults', 'kube_choices']
+__all__ = ['k8s', 'dd', 'defaults', 'kube_choices', 'check', 'fleet',
+           'kubeapi', 'retry', 'certcache', 'kubeconfig', 'timing',
+           'ratelimit', 'rotation', 'manifests', 'metrics', 'serve',
+           'pipeline', 'sweep', 'loadprobe', 'trace']
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+''' On-disk record of the client certificates we have written, so they can be
+    reused until shortly before they expire instead of asking Lemur again
+'''
+
+import calendar
+import contextlib
+import datetime
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from library import defaults
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+INDEX = '.end2end-certcache.json'
+LOCKFILE = '.end2end-certcache.lock'
+# Fetch new certificates this many seconds before the old ones expire
+REFRESH_MARGIN = 3600
+
+def parse_time(value):
+    ''' Turn a Lemur timestamp ("2017-05-02T00:00:00+00:00") or manifest date
+        ("2017-05-02") into seconds since the epoch, assuming UTC
+    '''
+    for fmt, width in (('%Y-%m-%dT%H:%M:%S', 19), ('%Y-%m-%d', 10)):
+        try:
+            parsed = datetime.datetime.strptime(value[:width], fmt)
+            return calendar.timegm(parsed.timetuple())
+        except (TypeError, ValueError):
+            continue
+    raise ValueError('Unrecognized certificate validity time "%s"' % value)
+
+def atomic_write(path, content, mode=0o600):
+    ''' Write content to path so that readers only ever see the old or the new
+        file, never a partial one
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, tmp_path = tempfile.mkstemp(dir=directory,
+                                        prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(handle, 'w') as data:
+            # data.write() is definitely callable
+            # pylint: disable=not-callable
+            data.write(content)
+            data.flush()
+            os.fsync(data.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def _sha256(path):
+    ''' Return the hex digest of a file's contents
+    '''
+    with open(path, 'rb') as data:
+        return hashlib.sha256(data.read()).hexdigest()
+
+class CertCache(object):
+    ''' Index of certificate files in a directory, keyed by whatever
+        identifies the certificate (cluster user, manifest digest and the
+        files it is written to)
+    '''
+    def __init__(self, directory, margin=REFRESH_MARGIN, clock=time.time):
+        ''' Initialization method
+            Positional Arguments:
+                directory: Where the certificate files and index live
+            Keyword Arguments:
+                margin: Seconds before expiry at which entries stop being valid
+                clock: Wall clock, for testing
+        '''
+        self._dir = directory
+        self._margin = margin
+        self._clock = clock
+    @property
+    def directory(self):
+        ''' Return the cache directory
+        '''
+        return self._dir
+    @contextlib.contextmanager
+    def lock(self):
+        ''' Hold an exclusive lock on the cache for the duration of the block,
+            across threads and processes
+        '''
+        with open(os.path.join(self._dir, LOCKFILE), 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield self
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+    def _read_index(self):
+        ''' Return the index, or an empty one if it is missing or unreadable
+        '''
+        try:
+            with open(os.path.join(self._dir, INDEX), 'r') as data:
+                return json.load(data)
+        except (IOError, ValueError):
+            return {}
+    def valid(self, key, paths):
+        ''' Return whether the files in paths are the ones recorded for key and
+            are not about to expire
+            Positional Arguments:
+                key: Cache key for the certificate
+                paths: Iterable of the file paths making up the certificate
+        '''
+        entry = self._read_index().get(key)
+        if not entry:
+            return False
+        if entry['not_after'] - self._margin <= self._clock():
+            LOGGER.info('Cached certificate "%s" expires soon.', key)
+            return False
+        try:
+            return all(entry['files'].get(i) == _sha256(i) for i in paths)
+        except IOError:
+            return False
+    def expiry(self, key):
+        ''' Return when the certificate recorded under key expires, in seconds
+            since epoch, or None if there is no such record
+        '''
+        return self._read_index().get(key, {}).get('not_after')
+    def store(self, key, contents, not_after):
+        ''' Atomically write the certificate files and record them under key
+            Positional Arguments:
+                key: Cache key for the certificate
+                contents: Dictionary of file path to file content
+                not_after: Expiry of the certificate, in seconds since epoch
+        '''
+        for path, content in contents.items():
+            LOGGER.info('Writing certificate contents to file "%s"', path)
+            atomic_write(path, content)
+        now = self._clock()
+        index = {k: v
+                 for k, v in self._read_index().items()
+                 if v.get('not_after', 0) > now}
+        index[key] = {'not_after': not_after,
+                      'files': {i: _sha256(i) for i in contents}}
+        atomic_write(os.path.join(self._dir, INDEX), json.dumps(index))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+''' Run the end to end check against a single cluster and report the result
+'''
+
+import logging
+import time
+from library import defaults, k8s, dd, manifests, trace
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+
+class CheckResult(object):
+    ''' Outcome of an end to end check on one cluster
+    '''
+    # pylint: disable=too-many-arguments
+    def __init__(self, cluster, message, alert_type, elapsed, timer=None,
+                 load=None, nodes=None, run_id=None):
+        ''' Initialization method
+            Positional Arguments:
+                cluster: Name of the cluster that was checked
+                message: Human readable result of the check
+                alert_type: Datadog alert type, 'info' or 'error'
+                elapsed: Wall-clock seconds the check took
+            Keyword Arguments:
+                timer: timing.PhaseTimer holding the per-phase timings
+                load: loadprobe.LoadResult of the load probe, if there was one
+                nodes: {address: seconds until it returned 200, or None} for
+                       each address of the LoadBalancer, if they were probed
+                run_id: ID of the run, in the names and labels of the objects
+                        it created
+        '''
+        self._cluster = cluster
+        self._message = message
+        self._alert_type = alert_type
+        self._elapsed = elapsed
+        self._timer = timer
+        self._load = load
+        self._nodes = nodes
+        self._run_id = run_id
+    @property
+    def cluster(self):
+        ''' Return the cluster
+        '''
+        return self._cluster
+    @property
+    def message(self):
+        ''' Return the result message
+        '''
+        return self._message
+    @property
+    def alert_type(self):
+        ''' Return the datadog alert type
+        '''
+        return self._alert_type
+    @property
+    def ok(self):
+        ''' Return whether or not the check passed
+        '''
+        # pylint: disable=invalid-name
+        return self._alert_type != 'error'
+    @property
+    def elapsed(self):
+        ''' Return the seconds the check took
+        '''
+        return self._elapsed
+    @property
+    def timer(self):
+        ''' Return the per-phase timer, if there is one
+        '''
+        return self._timer
+    @property
+    def load(self):
+        ''' Return the load probe result, if there is one
+        '''
+        return self._load
+    def record(self):
+        ''' Return a machine-readable record of the result
+        '''
+        record = {'cluster': self._cluster,
+                  'ok': self.ok,
+                  'message': self._message,
+                  'seconds': round(self._elapsed, 3)}
+        if self._run_id:
+            record['run_id'] = self._run_id
+        if self._timer:
+            timings = self._timer.record()
+            record['phases'] = timings['phases']
+            record['failed_phases'] = timings['failed_phases']
+        if self._nodes:
+            record['nodes'] = {k: v if v is None else round(v, 3)
+                               for k, v in self._nodes.items()}
+        if self._load:
+            record['load'] = self._load.record()
+        return record
+
+def run_check(cluster,
+              kubeconfig=defaults.KUBECONFIG,
+              dd_api_key=None,
+              persistent=False,
+              full_every=defaults.CANARY_FULL_EVERY,
+              own_namespace=False,
+              **kube_kwargs):
+    ''' Create, check, and delete the test service on a cluster, then send the
+        outcome to datadog
+        Positional Arguments:
+            cluster: Name of the cluster (kubeconfig context) to check
+        Keyword Arguments:
+            kubeconfig: Path to kubernetes config file
+            dd_api_key: Datadog API key. No event is sent without one.
+            persistent: Check a canary workload which is left in place for
+                        the next check instead (see check_canary)
+            full_every: Seconds after which a persistent canary is deleted
+                        and created again
+            own_namespace: Create the test service in a Namespace of its
+                           own, deleted in one go afterwards
+        Any other keyword arguments are passed on to k8s.JustOKKube. Unless
+        one is given, the workload is named after a new run ID, so checks of
+        the same cluster cannot collide.
+    '''
+    # pylint: disable=too-many-arguments
+    started = time.monotonic()
+    # Only a load probe needs the pods to name themselves; without one the
+    # stock image runs as it is and the canary's spec hash stays put
+    pod_header = (defaults.POD_HEADER if kube_kwargs.get('load') is not None
+                  else None)
+    if persistent:
+        kube_kwargs.setdefault('workload',
+                               manifests.Workload(pod_header=pod_header,
+                                                  **defaults.CANARY))
+    else:
+        kube_kwargs.setdefault('workload',
+                               manifests.Workload(
+                                   pod_header=pod_header,
+                                   run_id=manifests.run_id(),
+                                   own_namespace=own_namespace))
+    kube = k8s.JustOKKube(cluster, kubeconfig, **kube_kwargs)
+    LOGGER.info('Attempting to %s service "%s" on cluster "%s"',
+                'check the persistent' if persistent
+                else 'create, check, and delete',
+                kube.workload.name,
+                cluster)
+    with trace.attributes(cluster=cluster), \
+            trace.span('check', 'check', workload=kube.workload.name):
+        try:
+            if persistent:
+                event_msg = check_canary(kube, full_every)
+            else:
+                kube.create_workload()
+                event_msg = kube.verify_workload()
+            alert_type = 'info'
+        except (k8s.KubeError, ValueError) as error:
+            event_msg = str(error)
+            alert_type = 'error'
+            LOGGER.exception(event_msg)
+        finally:
+            if not persistent:
+                teardown(kube)
+    result = CheckResult(cluster,
+                         event_msg,
+                         alert_type,
+                         time.monotonic() - started,
+                         kube.timer,
+                         kube.load_result,
+                         kube.ingress_nodes,
+                         kube.workload.run_id)
+    if dd_api_key:
+        send_result(result, dd_api_key)
+    return result
+
+def teardown(kube):
+    ''' Ask the cluster to delete the workload, without waiting for it (or the
+        cloud provider's LoadBalancer) to be gone. A failure only shows up as
+        a failed "teardown" phase: whatever is left is reclaimed by "sweep".
+        Positional Arguments:
+            kube: k8s.JustOKKube for the cluster and workload
+    '''
+    try:
+        with kube.timer.phase('teardown'):
+            kube.delete_workload()
+    except k8s.KubeError as error:
+        LOGGER.warning('Unable to delete the workload from cluster "%s", \
+leaving it to "sweep": %s', kube.cluster, error)
+
+def check_canary(kube, full_every=defaults.CANARY_FULL_EVERY):
+    ''' Check a canary workload which stays on the cluster between checks:
+        create it if it is missing, replace whatever drifted, and replace all
+        of it once it is full_every seconds old. Then make sure its pods are
+        available and its LoadBalancer answers, as for a new workload.
+        Positional Arguments:
+            kube: k8s.JustOKKube for the cluster and canary workload
+    '''
+    state = kube.reconcile_workload(full_every)
+    return '%s (canary %s)' % (kube.verify_workload(), state)
+
+def run_guarded(cluster,
+                kubeconfig=defaults.KUBECONFIG,
+                dd_api_key=None,
+                **kube_kwargs):
+    ''' Run the check like run_check, turning any unexpected failure into a
+        failed result so one bad cluster cannot take down a caller checking
+        many of them
+    '''
+    started = time.monotonic()
+    try:
+        return run_check(cluster, kubeconfig, dd_api_key, **kube_kwargs)
+    # Anything escaping run_check (teardown, lemur, datadog) still has to be
+    # reported against its cluster
+    # pylint: disable=broad-except
+    except Exception as error:
+        LOGGER.exception('Check on cluster "%s" failed unexpectedly', cluster)
+        return CheckResult(cluster,
+                           '%s: %s' % (type(error).__name__, error),
+                           'error',
+                           time.monotonic() - started)
+
+def send_result(result, dd_api_key):
+    ''' Queue a check result for datadog as an event. It is submitted in the
+        background and at the latest when the process exits.
+    '''
+    LOGGER.info('Queueing event message "%s" for datadog for cluster "%s"',
+                result.message,
+                result.cluster)
+    dd_client = dd.batch_client(dd_api_key)
+    dd_client.send_event(result.message,
+                         alert_type=result.alert_type,
+                         tags=['k8s_cluster:%s' % result.cluster])
+    if result.timer:
+        result.timer.send(dd_client)
+    if result.load:
+        result.load.send(dd_client, result.cluster)
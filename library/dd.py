@@ -2,12 +2,31 @@
 ''' Wrap Datadog's API, at least for events
 '''
 
+import atexit
+import gzip
 import logging
 import json
+import queue
+import threading
+import time
 from library import defaults
+from library import retry
+from library import trace
 import requests
 
 LOGGER = logging.getLogger(defaults.LOGGER)
+RETRY_TIMEOUT = 30
+REQUEST_TIMEOUT = (5, 10)
+DD_API = 'https://app.datadoghq.com/api'
+# Limits for DDBatchClient
+MAX_QUEUE = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 5
+# Datadog v2 series metric types
+METRIC_TYPES = {'count': 1, 'rate': 2, 'gauge': 3}
+_SESSION = None
+_BATCH_CLIENTS = {}
+_SHARED_LOCK = threading.Lock()
 
 class DDClientError(Exception):
     ''' Custom error
@@ -24,6 +43,39 @@ class DatadogRequestError(DDClientError):
     ''' Custom error
     '''
     pass
+class DatadogUnavailableError(DatadogRequestError):
+    ''' Custom error for server-side failures worth retrying
+    '''
+    pass
+
+def session():
+    ''' Return the connection-pooled session shared by every client
+    '''
+    # pylint: disable=global-statement
+    global _SESSION
+    with _SHARED_LOCK:
+        if _SESSION is None:
+            _SESSION = requests.Session()
+        return _SESSION
+
+def batch_client(apikey):
+    ''' Return the process-wide DDBatchClient for an api key
+    '''
+    with _SHARED_LOCK:
+        if apikey not in _BATCH_CLIENTS:
+            _BATCH_CLIENTS[apikey] = DDBatchClient(apikey)
+        return _BATCH_CLIENTS[apikey]
+
+def close_all():
+    ''' Flush and stop every DDBatchClient created by batch_client()
+    '''
+    with _SHARED_LOCK:
+        clients = list(_BATCH_CLIENTS.values())
+        _BATCH_CLIENTS.clear()
+    for client in clients:
+        client.close()
+
+atexit.register(close_all)
 
 class DDClient(object):
     ''' Not-too-bad wrapper around datadog API
@@ -36,20 +88,20 @@ class DDClient(object):
         '''
         self._apikey = apikey
         self._run = False
-        self._url = 'https://app.datadoghq.com/api/v1/events'
+        self._url = DD_API + '/v1/events'
+        self._series_url = DD_API + '/v2/series'
         self._headers = {'Content-type': 'application/json'}
     @property
     def apikey(self):
         ''' Get the api key from shell exports file and/or return it
         '''
         return self._apikey
-    def send_event(self,
-                   text,
-                   title='K8s End-to-End Test',
-                   tags=None,
-                   alert_type='info'):
-        ''' Send an event via Datadog API
-            ...shittily
+    @staticmethod
+    def event(text,
+              title='K8s End-to-End Test',
+              tags=None,
+              alert_type='info'):
+        ''' Build the payload for an event
         '''
         data = {'title': title,
                 'text': text,
@@ -58,16 +110,215 @@ class DDClient(object):
                 'alert_type': alert_type}
         if tags:
             data['tags'] += tags
+        return data
+    @staticmethod
+    def metric(name, value, tags=None, metric_type='gauge', timestamp=None):
+        ''' Build a v2 series entry for a single metric point
+        '''
+        return {'metric': name,
+                'type': METRIC_TYPES[metric_type],
+                'points': [{'timestamp': int(timestamp or time.time()),
+                            'value': value}],
+                'tags': ['end2end_k8s'] + list(tags or [])}
+    @trace.traced('datadog')
+    def send_event(self,
+                   text,
+                   title='K8s End-to-End Test',
+                   tags=None,
+                   alert_type='info'):
+        ''' Send an event via Datadog API
+            ...shittily
+        '''
+        return self._submit(self._post_event,
+                            self.event(text, title, tags, alert_type))
+    @trace.traced('datadog')
+    def send_series(self, series):
+        ''' Send a list of metric() entries in one gzip-compressed request
+        '''
+        return self._submit(self._post_series, series)
+    @staticmethod
+    def _submit(post, payload):
+        ''' Post a payload, retrying with backoff while Datadog is
+            unreachable or failing
+        '''
+        poller = retry.Retry(RETRY_TIMEOUT,
+                             retry.Exponential(),
+                             retry_on=(requests.exceptions.ConnectionError,
+                                       requests.exceptions.Timeout,
+                                       DatadogUnavailableError))
+        try:
+            return poller.call(post, payload)
+        except retry.RetryTimeoutError as err:
+            raise err.last_error
+    def _post_event(self, data):
+        ''' Make one attempt at submitting an event. The v1 events endpoint
+            takes one event per request and is not documented to accept a
+            compressed body, so unlike metrics the event is sent as it is.
+        '''
         params = {'api_key': self.apikey}
-        result = requests.post(self._url,
-                               params=params,
-                               headers=self._headers,
-                               data=json.dumps(data))
-        LOGGER.info('Made a request to "%s"', self._url)
-        LOGGER.info('Request headers: "%s"', self._headers)
-        LOGGER.info('Request json: "%s"', json.dumps(data))
+        with trace.span('datadog POST', 'http', url=self._url,
+                        tags=data.get('tags')):
+            result = session().post(self._url,
+                                    params=params,
+                                    headers=self._headers,
+                                    data=json.dumps(data),
+                                    timeout=REQUEST_TIMEOUT)
+        LOGGER.debug('Posted event to "%s": "%s"', self._url, json.dumps(data))
+        return self._check(result)
+    def _post_series(self, series):
+        ''' Make one attempt at submitting a batch of metrics
+        '''
+        headers = {'Content-type': 'application/json',
+                   'Content-Encoding': 'gzip',
+                   'DD-API-KEY': self.apikey}
+        body = gzip.compress(json.dumps({'series': series}).encode('utf-8'))
+        with trace.span('datadog POST', 'http', url=self._series_url,
+                        series=len(series)):
+            result = session().post(self._series_url,
+                                    headers=headers,
+                                    data=body,
+                                    timeout=REQUEST_TIMEOUT)
+        LOGGER.debug('Posted %s metric series to "%s"',
+                     len(series),
+                     self._series_url)
+        return self._check(result)
+    @staticmethod
+    def _check(result):
+        ''' Raise an error for unsuccessful responses
+        '''
         if result.status_code not in range(200, 400):
             msg = ('Status code: %s\nText: %s\n'
                    % (result.status_code, result.text))
+            if result.status_code >= 500:
+                raise DatadogUnavailableError(msg)
             raise DatadogRequestError(msg)
         return result
+
+class DDBatchClient(DDClient):
+    ''' Datadog client which queues events and metrics and submits them from a
+        background thread, so callers never wait on Datadog
+    '''
+    _STOP = object()
+    def __init__(self,
+                 apikey,
+                 max_queue=MAX_QUEUE,
+                 batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        ''' Initialization method
+            Positional Arguments:
+                apikey: Secret string allowing submission to Datadog for your
+                        account
+            Keyword Arguments:
+                max_queue: Most items held in memory; newer items are dropped
+                           while the queue is full
+                batch_size: Most metric points sent in one request
+                flush_interval: Seconds to wait for more items before sending
+        '''
+        DDClient.__init__(self, apikey)
+        self._queue = queue.Queue(max_queue)
+        self._batch_size = batch_size
+        self._interval = flush_interval
+        self._dropped = 0
+        self._thread = threading.Thread(target=self._loop,
+                                        name='dd-submitter',
+                                        daemon=True)
+        self._thread.start()
+    @property
+    def dropped(self):
+        ''' Return how many items were dropped because the queue was full
+        '''
+        return self._dropped
+    def send_event(self,
+                   text,
+                   title='K8s End-to-End Test',
+                   tags=None,
+                   alert_type='info'):
+        ''' Queue an event for submission and return its payload
+        '''
+        data = self.event(text, title, tags, alert_type)
+        self._put(('event', data))
+        return data
+    def send_metric(self,
+                    name,
+                    value,
+                    tags=None,
+                    metric_type='gauge',
+                    timestamp=None):
+        ''' Queue a metric point for submission and return it
+        '''
+        data = self.metric(name, value, tags, metric_type, timestamp)
+        self._put(('metric', data))
+        return data
+    def flush(self, timeout=None):
+        ''' Wait until everything queued so far has been submitted. Return
+            whether that happened within timeout seconds.
+        '''
+        done = threading.Event()
+        try:
+            self._queue.put(('flush', done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+    def close(self, timeout=RETRY_TIMEOUT):
+        ''' Submit everything queued and stop the background thread
+        '''
+        if not self._thread.is_alive():
+            return
+        self._queue.put(('stop', self._STOP))
+        self._thread.join(timeout)
+    def _put(self, item):
+        ''' Queue an item without blocking the caller
+        '''
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._dropped += 1
+            LOGGER.warning('Datadog submission queue is full. Dropped %s \
+items so far.', self._dropped)
+    def _loop(self):
+        ''' Background loop: gather items until the batch is full or the
+            flush interval passes, then submit them
+        '''
+        events, series = [], []
+        deadline = time.monotonic() + self._interval
+        while True:
+            try:
+                kind, data = self._queue.get(timeout=max(0, deadline -
+                                                         time.monotonic()))
+            except queue.Empty:
+                kind, data = 'timer', None
+            if kind == 'event':
+                events.append(data)
+            elif kind == 'metric':
+                series.append(data)
+            if (kind in ('timer', 'flush', 'stop') or
+                    len(series) >= self._batch_size):
+                self._send_batch(events, series)
+                events, series = [], []
+                deadline = time.monotonic() + self._interval
+            if kind == 'flush':
+                data.set()
+            elif kind == 'stop':
+                return
+    def _send_batch(self, events, series):
+        ''' Submit gathered items, logging rather than raising failures so
+            the background thread keeps running
+        '''
+        # Datadog's events endpoint takes a single uncompressed event per
+        # request, so only metrics are batched and gzipped; events are few
+        # (one or two per check) and go out over the same pooled session
+        for data in events:
+            try:
+                self._submit(self._post_event, data)
+            # pylint: disable=broad-except
+            except Exception:
+                LOGGER.exception('Unable to send event "%s" to datadog',
+                                 data['text'])
+        for start in range(0, len(series), self._batch_size):
+            batch = series[start:start + self._batch_size]
+            try:
+                self._submit(self._post_series, batch)
+            # pylint: disable=broad-except
+            except Exception:
+                LOGGER.exception('Unable to send %s metric series to datadog',
+                                 len(batch))
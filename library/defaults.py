@@ -10,46 +10,78 @@ KUBE_SECRETS_DIR = '/etc/kube/ssl/'
 KUBECONFIG = (os.path.abspath(os.path.join(os.path.dirname(__file__),
                                            '..',
                                            '.kube/config')))
+FLEET_CONCURRENCY = 8
+KUBE_BACKENDS = ('kubectl', 'api')
+KUBE_BACKEND = 'kubectl'
+RETRY_STRATEGY = 'fast-then-slow'
+# "serve": seconds between checks of each cluster, the fraction of that added
+# or taken away at random, the metrics port, and seconds between looks at the
+# kubectl config and schedule files for changes
+SERVE_INTERVAL = 300
+SERVE_JITTER = 0.1
+SERVE_PORT = 9180
+SERVE_RELOAD = 5
 KUBECTL = '''kubectl --kubeconfig %s --context %s %s'''
 
 SUB_KUBECTL = {'create': 'create -f %s',
-               'delete': 'delete -f %s',
-               'describe svc': 'describe svc %s'}
+               'get': 'get -f %s -o json --ignore-not-found',
+               'get pods': 'get pods --namespace %s --selector %s -o json',
+               'get events': ('get events --namespace %s --field-selector %s '
+                              '-o json'),
+               'delete': 'delete --ignore-not-found --wait=false -f %s',
+               'get managed': ('get namespaces,deployments,services '
+                               '--all-namespaces --selector %s -o json'),
+               'get svc': ('get svc %s --namespace %s -o json '
+                           '--ignore-not-found'),
+               'watch svc': ('get svc %s --namespace %s --watch -o \'jsonpath='
+                             '{.status.loadBalancer.ingress[0].hostname}'
+                             '{.status.loadBalancer.ingress[0].ip}{"\\n"}\'')}
 
-SERVICE_YAML = {'content': '''apiVersion: v1
-kind: Service
-metadata:
-  name: end2end-externalelbtest
-  labels:
-    name: end2end-externalelbtest
-spec:
-  type: LoadBalancer
-  ports:
-    # the port that this service should serve on
-  - port: 80
-  selector:
-    name: end2end-externalelbtest''',
-                'name': 'end2end-externalelbtest'}
-DEPLOYMENT_YAML = {'content': '''apiVersion: extensions/v1beta1
-kind: Deployment
-metadata:
-  name: end2end-externalelbtest
-  labels:
-    name: end2end-externalelbtest
-spec:
-  replicas: 2
-  template:
-    metadata:
-      labels:
-        name: end2end-externalelbtest
-    spec:
-      containers:
-      - name: nginx
-        image: nginx:1.9.1
-        ports:
-        - containerPort: 80''',
-                   'name': 'end2end-externalelbtest'}
+# Label on everything a check creates, so "sweep" can find what was left
+# behind. Objects of the persistent canary are never swept.
+MANAGED_LABEL = ('app.kubernetes.io/managed-by', 'end2end-k8s')
+SWEEP_SELECTOR = '%s=%s,!end2end-k8s/persistent' % MANAGED_LABEL
+# Objects older than this many seconds are no longer in use by any check
+SWEEP_AGE = 3600
+# (apiVersion, kind) of everything a check can create, as in "get managed"
+SWEEP_KINDS = (('v1', 'Namespace'),
+               ('extensions/v1beta1', 'Deployment'),
+               ('v1', 'Service'))
+# The Deployment and LoadBalancer Service each check creates and deletes; see
+# manifests.Workload
+WORKLOAD = {'name': 'end2end-externalelbtest',
+            'namespace': 'default',
+            'image': 'nginx:1.9.1',
+            'replicas': 2,
+            'port': 80}
+# The workload kept between checks with --persistent, and how old it may get
+# before it is deleted and created again so the full path is still exercised
+CANARY = dict(WORKLOAD,
+              name='end2end-canary',
+              labels={'end2end-k8s/persistent': 'true'})
+CANARY_FULL_EVERY = 6 * 3600
+# Optional load probe once the LoadBalancer answers: connections held open at
+# once, seconds to send requests for, and the fraction of failed requests
+# which fails the check
+LOAD_CONCURRENCY = 8
+LOAD_DURATION = 10
+LOAD_MAX_ERROR_RATE = 0.01
+# Response header the test pods name themselves in, only when a load probe
+# will count the requests each pod answered
+POD_HEADER = 'X-Backend-Pod'
+# Reasons a container waits for which mean its pod will not start by itself,
+# and reasons of warning events about a Service which mean its LoadBalancer
+# could not be created. Either fails a check at once.
+POD_FAILURE_REASONS = ('ErrImageNeverPull', 'ImagePullBackOff',
+                       'InvalidImageName', 'CreateContainerConfigError',
+                       'CrashLoopBackOff')
+LB_FAILURE_REASONS = ('CreatingLoadBalancerFailed', 'SyncLoadBalancerFailed')
 KEYREFRESH_CONFIG = '/mako-secrets-map.yaml'
+# Secret instances rotated at once, and AWS API calls per second (and burst)
+# allowed for each set of aws_keys, by "refresh"
+ROTATION_CONCURRENCY = 8
+AWS_RATE = 5
+AWS_BURST = 10
 KEYREFRESH_CREDS_FMT = '''[default]
 aws_access_key_id = %s
 aws_secret_access_key = %s
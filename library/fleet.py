@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+''' Run end to end checks against many clusters concurrently
+'''
+
+import concurrent.futures
+import logging
+import time
+from library import defaults, check
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+
+class FleetCheck(object):
+    ''' Check a set of clusters with a bounded number of checks in flight
+    '''
+    def __init__(self,
+                 clusters,
+                 kubeconfig=defaults.KUBECONFIG,
+                 dd_api_key=None,
+                 concurrency=defaults.FLEET_CONCURRENCY,
+                 **kube_kwargs):
+        ''' Initialization method
+            Positional Arguments:
+                clusters: List of cluster (kubeconfig context) names
+            Keyword Arguments:
+                kubeconfig: Path to kubernetes config file
+                dd_api_key: Datadog API key used for per-cluster events
+                concurrency: Maximum number of clusters checked at once
+            Any other keyword arguments are passed on to k8s.JustOKKube
+        '''
+        self._clusters = list(clusters)
+        self._kubeconfig = kubeconfig
+        self._dd_api_key = dd_api_key
+        self._concurrency = max(1, concurrency)
+        self._kube_kwargs = kube_kwargs
+        self._results = []
+        self._elapsed = None
+    @property
+    def clusters(self):
+        ''' Return the clusters to be checked
+        '''
+        return self._clusters
+    @property
+    def results(self):
+        ''' Return the results collected so far
+        '''
+        return self._results
+    def _check_one(self, cluster):
+        ''' Check one cluster, so one bad cluster cannot take down the whole
+            fleet run
+        '''
+        return check.run_guarded(cluster,
+                                 self._kubeconfig,
+                                 self._dd_api_key,
+                                 **self._kube_kwargs)
+    def run(self):
+        ''' Check every cluster, yielding each result as soon as it finishes
+        '''
+        started = time.monotonic()
+        workers = min(self._concurrency, len(self._clusters)) or 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self._check_one, cluster)
+                       for cluster in self._clusters]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                self._results.append(result)
+                yield result
+        self._elapsed = time.monotonic() - started
+    def summary(self):
+        ''' Return a machine-readable summary of the results so far
+        '''
+        failed = sorted(i.cluster for i in self._results if not i.ok)
+        return {'total': len(self._clusters),
+                'passed': len(self._results) - len(failed),
+                'failed': failed,
+                'seconds': round(self._elapsed or 0, 3)}
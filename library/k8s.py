@@ -2,21 +2,57 @@
 ''' Python wrapper for kubectl
 '''
 
+import concurrent.futures
 import subprocess
 import shlex
-import tempfile
-import os
+import json
 import logging
-import re
+import socket
 import time
 import functools
+import threading
+import urllib.parse
+from library import certcache
 from library import defaults
 from library import lemur
+from library import kubeapi
+from library import loadprobe
+from library import manifests
+from library import pipeline
+from library import retry
+from library import timing
+from library import trace
 import requests
 
 LOGGER = logging.getLogger(defaults.LOGGER)
-WAIT = 10
 TIMEOUT = 180
+REQUEST_TIMEOUT = (5, 10)
+WATCH_RESTART = 1
+# Seconds between looks at whether a kubectl watch should be stopped
+WATCH_CHECK = 0.5
+# Seconds between lookups of the LoadBalancer's hostname until it resolves,
+# and how long the rest of its addresses get to answer once one has
+DNS_POLL = 1
+NODE_GRACE = 30
+
+def resolve(host, port):
+    ''' Return the sorted IP addresses a hostname resolves to, raising
+        socket.gaierror while it does not
+    '''
+    with trace.span('resolve', 'dns', host=host):
+        return sorted(set(i[4][0] for i in
+                          socket.getaddrinfo(host,
+                                             port,
+                                             type=socket.SOCK_STREAM)))
+
+def command_name(cmd):
+    ''' Return a short name for a kubectl command line, e.g. "kubectl get
+        pods", to trace it under
+    '''
+    words = cmd.split(' --context ', 1)[-1].split()[1:3]
+    if len(words) > 1 and words[1].startswith('-'):
+        words = words[:1]
+    return ' '.join(['kubectl'] + words)
 
 def lemur_setup(func):
     ''' Create a decorator to ensure we have client certificates from Lemur
@@ -29,8 +65,7 @@ def lemur_setup(func):
             LOGGER.info('Lemur certificates not set up. Generating for \
 cluster "%s"',
                         self.cluster)
-            certset = lemur.CertificateSet(self.cluster, self.kubeconfig)
-            certset.run()
+            lemur.provision(self.cluster, self.kubeconfig)
             self.setup = True
         # func will be callable unless somebody misuses it and that's on them
         # pylint: disable=not-callable
@@ -60,22 +95,91 @@ class KubeRequestError(KubeError):
     ''' Custom kube error for requests errors
     '''
     pass
+class KubeApiRequestError(KubeError):
+    ''' Custom kube error for failed calls made with the API backend
+    '''
+    pass
+class KubePodsNotReadyError(KubeError):
+    ''' Custom kube error for a Deployment without all its pods available
+    '''
+    pass
+class KubeStillExistsError(KubeError):
+    ''' Custom kube error for objects which should have been deleted
+    '''
+    pass
+class KubePodsFailedError(KubeError):
+    ''' Custom kube error for pods which cannot start without intervention
+    '''
+    pass
+class KubeDnsError(KubeError):
+    ''' Custom kube error for a LoadBalancer hostname which does not resolve
+    '''
+    pass
+class KubeLoadError(KubeError):
+    ''' Custom kube error for a LoadBalancer which failed too many requests
+        of the load probe
+    '''
+    pass
+class KubeLoadBalancerError(KubeError):
+    ''' Custom kube error for a LoadBalancer the cloud provider failed to
+        create
+    '''
+    pass
 
 class JustOKKube(object):
     ''' Wrap kubectl with an object/methods
     '''
-    def __init__(self, cluster, kubeconfig=defaults.KUBECONFIG):
+    def __init__(self,
+                 cluster,
+                 kubeconfig=defaults.KUBECONFIG,
+                 backend=defaults.KUBE_BACKEND,
+                 watch=False,
+                 strategy=None,
+                 workload=None,
+                 load=None,
+                 max_error_rate=defaults.LOAD_MAX_ERROR_RATE):
         ''' Initialization method
             Positional Arguments:
                 cluster: Dictionary for cluster containing certificats and
                          master address
+            Keyword Arguments:
+                kubeconfig: Path to kubernetes config file
+                backend: 'kubectl' to shell out for every call, or 'api' to
+                         talk to the API server over a pooled connection.
+                         run_raw() always uses kubectl.
+                watch: Wait for the LoadBalancer ingress by watching the
+                       service instead of polling "get svc"
+                strategy: retry strategy (see library.retry) for the polling
+                          loops. Defaults to defaults.RETRY_STRATEGY.
+                workload: manifests.Workload to create and check. Defaults to
+                          one built from defaults.WORKLOAD.
+                load: Keyword arguments for a loadprobe.LoadProbe run against
+                      the address once it answers, or None to skip it
+                max_error_rate: Fraction of load probe requests which may
+                                fail before the check does
         '''
+        # pylint: disable=too-many-arguments
+        if backend not in defaults.KUBE_BACKENDS:
+            raise ValueError('Unknown k8s backend "%s"' % backend)
         self._cluster = cluster
-        self._servicefile = None
-        self._deploymentfile = None
+        self._workload = workload or manifests.Workload()
         self._ingress = None
+        self._service_uid = None
         self._kubeconfig = kubeconfig
+        self._backend = backend
+        self._watch = watch
+        self._strategy = strategy or (retry
+                                      .strategy_from_str(defaults
+                                                         .RETRY_STRATEGY))
+        self._client = None
         self._setup = None
+        self._timer = timing.PhaseTimer(cluster)
+        self._probe_started = None
+        self._nodes = None
+        self._abort = pipeline.Abort()
+        self._load = load
+        self._max_error_rate = max_error_rate
+        self._load_result = None
     @property
     def setup(self):
         ''' Return whether or not we have been set up
@@ -96,155 +200,755 @@ class JustOKKube(object):
         ''' Return the kubeconfig
         '''
         return self._kubeconfig
-    @staticmethod
-    def find_ingress(text):
-        ''' Function to look for an ELB-backed service's address
+    @property
+    def timer(self):
+        ''' Return the timer recording how long each phase took
         '''
-        LOGGER.info('Looking for ingress in text: "%s"', text)
-        regex = r'''Ingress:\s+([\w\.-]+)\n'''
-        result = re.search(regex, text)
-        try:
-            # result.groups() is definitely callable
-            # pylint: disable=not-callable
-            return result.groups()[0]
-        except (AttributeError, IndexError):
-            message = ('Unable to find LoadBalancer Ingress address in text: \
-                       "%s"' % text)
-            raise KubeIngressNotFoundError(message)
-    @staticmethod
-    def kubefile(content):
-        ''' Generic way to generate a k8s yaml file from content
-            Positional Arguments:
-                content: raw string to put in file
-        '''
-        _, path = tempfile.mkstemp()
-        with open(path, 'w') as handle:
-            # handle.write() is definitely callable
-            # pylint: disable=not-callable
-            handle.write(content)
-            return path
+        return self._timer
     @property
-    def servicefile(self):
-        ''' Generate and keep track of a k8s service yaml file
+    def workload(self):
+        ''' Return the workload being checked
         '''
-        if not self._servicefile:
-            LOGGER.info('Service file does not exist, creating.')
-            self._servicefile = self.kubefile(defaults.SERVICE_YAML['content'])
-        return self._servicefile
+        return self._workload
     @property
-    def deploymentfile(self):
-        ''' Generate and keep track of a k8s deployment yaml file
-        '''
-        if not self._deploymentfile:
-            LOGGER.info('Deployment file does not exist, creating.')
-            self._deploymentfile = self.kubefile(defaults
-                                                 .DEPLOYMENT_YAML['content'])
-        return self._deploymentfile
+    def ingress_nodes(self):
+        ''' Return {address: seconds until it first returned 200, or None}
+            for each address the LoadBalancer's hostname resolved to, once
+            they were probed
+        '''
+        return self._nodes
+    @property
+    def load_result(self):
+        ''' Return the loadprobe.LoadResult of the load probe, once it ran
+        '''
+        return self._load_result
+    @property
+    def backend(self):
+        ''' Return the name of the backend in use
+        '''
+        return self._backend
+    @property
+    def client(self):
+        ''' Return the shared API client for our cluster
+        '''
+        if not self._client:
+            try:
+                self._client = (kubeapi
+                                .KubeApiClient
+                                .for_context(self._kubeconfig, self._cluster))
+            except kubeapi.KubeApiConfigError as err:
+                raise KubeApiRequestError(str(err))
+        return self._client
     @staticmethod
-    def run_it(cmd):
-        ''' Run a subprocess command
+    def find_ingress(service):
+        ''' Function to look for an ELB-backed service's address in the
+            status of a Service object
         '''
-        LOGGER.info('Executing k8s command: "%s"', cmd)
+        ingress = ((service.get('status') or {})
+                   .get('loadBalancer', {})
+                   .get('ingress') or [{}])[0]
+        address = ingress.get('hostname') or ingress.get('ip')
+        if not address:
+            raise KubeIngressNotFoundError('Unable to find LoadBalancer \
+Ingress address in status of service "%s"' % (service.get('metadata') or {})
+                                           .get('name'))
+        return address
+    @staticmethod
+    def watch_it(cmd, timeout, abort=None):
+        ''' Run a streaming subprocess command, yielding its output lines
+            until it exits, timeout seconds pass, or abort (a pipeline.Abort)
+            is set
+        '''
+        LOGGER.info('Watching with k8s command: "%s"', cmd)
         proc = subprocess.Popen(shlex.split(cmd),
                                 stdout=subprocess.PIPE,
                                 stderr=subprocess.PIPE)
-        out, err = proc.communicate()
+        finished = threading.Event()
+        killed = []
+        def killer():
+            ''' Kill the command once it should stop
+            '''
+            deadline = time.monotonic() + timeout
+            while not finished.wait(max(0, min(WATCH_CHECK,
+                                               deadline - time.monotonic()))):
+                if time.monotonic() >= deadline or (abort and abort.is_set()):
+                    killed.append(True)
+                    proc.kill()
+                    return
+        threading.Thread(target=killer, daemon=True).start()
+        try:
+            with trace.span(command_name(cmd), 'kubectl', command=cmd):
+                for line in iter(proc.stdout.readline, b''):
+                    yield line.decode('utf-8').strip()
+                err = proc.stderr.read()
+                if proc.wait() and err and not killed:
+                    raise KubeProcError(err)
+        finally:
+            finished.set()
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+    @staticmethod
+    def run_it(cmd, stdin=None):
+        ''' Run a subprocess command, optionally feeding it stdin (a string).
+            Failing commands raise KubeProcError with their stderr; stderr from
+            successful ones (e.g. kubectl warnings) is only logged.
+        '''
+        LOGGER.info('Executing k8s command: "%s"', cmd)
+        with trace.span(command_name(cmd), 'kubectl', command=cmd):
+            proc = subprocess.Popen(shlex.split(cmd),
+                                    stdin=subprocess.PIPE if stdin else None,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            out, err = proc.communicate(stdin.encode('utf-8') if stdin
+                                        else None)
+            if proc.returncode:
+                raise KubeProcError(err)
         if err:
-            raise KubeProcError(err)
+            LOGGER.warning('k8s command "%s" succeeded with errors: "%s"',
+                           cmd,
+                           err.decode('utf-8', 'replace'))
         return out
-    def create_deploy(self):
-        ''' Abstraction for subprocessing of kubectl create -f
+    def create_workload(self, objects=None):
+        ''' Create the Deployment and Service (or just the given manifests)
+            together, with one "kubectl create -f -"
         '''
-        return self._adjust_cluster('create', self.deploymentfile)
-    def create_svc(self):
-        ''' Abstraction for subprocessing of kubectl create -f
+        self._service_uid = None
+        with self._timer.phase('create'):
+            out = self._adjust_cluster('create',
+                                       '-',
+                                       objects or self._workload.objects())
+        if self._backend == 'api':
+            # The API answers with the created objects
+            for obj in out:
+                self._remember_uid(obj)
+        return out
+    def get_workload(self, objects=None):
+        ''' Return the live copy of each of the workload's objects (or of the
+            given manifests), or None for any which do not exist, with one
+            "kubectl get -f -"
         '''
-        return self._adjust_cluster('create', self.servicefile)
-    def desc_svc(self):
-        ''' Abstraction for subprocessing of kubectl describe svc
-
+        objects = objects or self._workload.objects()
+        out = self._adjust_cluster('get', '-', objects)
+        if self._backend == 'api':
+            return out
+        index = {(i.get('kind'), i.get('metadata', {}).get('name')): i
+                 for i in self.items(out)}
+        return [index.get((i['kind'], i['metadata']['name']))
+                for i in objects]
+    @staticmethod
+    def items(out):
+        ''' Return the objects in "kubectl get -o json" output. Several
+            objects come back as a List, a single one on its own, and none
+            (with --ignore-not-found) as nothing at all.
         '''
-        out = self._adjust_cluster('describe svc', defaults.SERVICE_YAML['name'])
-        if bytearray('not found', 'utf-8') in out:
-            raise KubeSvcNotFoundError('Service "%s" should be created but \
-was not found with "kubectl get svc"')
-        return out
-    def create_file(self, kubefile):
-        ''' Abstraction for subprocessing of kubectl create -f on an arbitrary
-            file path
-            Positional Arguments:
-                kubefile: path to a kubernetes yaml file
+        text = out.decode('utf-8').strip()
+        try:
+            found = json.loads(text) if text else {'kind': 'List'}
+        except ValueError:
+            raise KubeProcError('Unable to parse "kubectl get" output: "%s"'
+                                % text)
+        if found.get('kind', '').endswith('List'):
+            return found.get('items') or []
+        return [found]
+    def list_workload(self, which):
+        ''' Return the workload's pods ("get pods") or the events about its
+            Service ("get events", warnings only), in one call
+        '''
+        if which == 'get pods':
+            selector = 'name=%s' % self._workload.name
+        else:
+            selector = ('involvedObject.kind=Service,involvedObject.name=%s,'
+                        'type=Warning' % self._workload.name)
+        out = self._adjust_cluster(which, (self._workload.namespace,
+                                           selector))
+        if self._backend == 'api':
+            return out
+        return self.items(out)
+    def list_managed(self, selector=defaults.SWEEP_SELECTOR):
+        ''' Return the Namespaces, and the Deployments and Services in every
+            namespace, which carry the labels in selector, with one kubectl
+            call or one API request per kind
+        '''
+        out = self._adjust_cluster('get managed', selector)
+        if self._backend == 'api':
+            return out
+        return self.items(out)
+    def wait_deleted(self, objects, timeout=TIMEOUT):
+        ''' Wait until none of the given manifests' objects exist any more
         '''
-        return self._adjust_cluster('create', kubefile)
-    def delete_deploy(self):
-        ''' Abstraction for subprocessing of kubectl delete -f
+        def gone():
+            ''' Raise while any of the objects still exist
+            '''
+            left = [i for i in self.get_workload(objects) if i]
+            if left:
+                raise KubeStillExistsError('%s still being deleted'
+                                           % self.names(left))
+        poller = retry.Retry(timeout,
+                             self._strategy,
+                             sleep=self._abort.sleep,
+                             retry_on=(KubeStillExistsError,),
+                             on_attempt=self._on_attempt('Deletion'))
+        try:
+            poller.call(gone)
+        except retry.RetryTimeoutError as err:
+            raise KubeStillExistsError('Old objects were not deleted in \
+timeout of %s: %s' % (timeout, err.last_error))
+    def reconcile_workload(self, max_age=None):
+        ''' Make sure the workload exists as rendered, reusing whatever is
+            already on the cluster. Objects which are missing are created;
+            objects which drifted from their manifests are deleted and
+            created again. If the Service is older than max_age seconds,
+            everything is deleted and created again, so the full
+            create/destroy path still runs now and then.
+            Returns "reused", "created", "recreated" or "cycled".
+        '''
+        expected = self._workload.objects()
+        with self._timer.phase('reconcile'):
+            live = self.get_workload(expected)
+        service = live[-1]
+        if service and max_age is not None and \
+                self.age(service) >= max_age:
+            LOGGER.info('Canary on cluster "%s" is older than %ss, \
+recreating it', self._cluster, max_age)
+            stale, state = [i for i, j in zip(expected, live) if j], 'cycled'
+        else:
+            stale = [i for i, j in zip(expected, live)
+                     if j and manifests.drifted(i, j)]
+            state = 'recreated' if stale else 'reused'
+        if stale:
+            LOGGER.warning('Deleting %s on cluster "%s" to create again',
+                           self.names(stale),
+                           self._cluster)
+            with self._timer.phase('teardown'):
+                self.delete_workload(stale)
+                self.wait_deleted(stale)
+        create = [i for i, j in zip(expected, live) if not j or i in stale]
+        if create:
+            self.create_workload(create)
+            if len(create) == len(expected) and not stale:
+                state = 'created'
+            elif state == 'reused':
+                state = 'recreated'
+        return state
+    @staticmethod
+    def names(objects):
+        ''' Describe objects for messages, e.g. 'Service "end2end-canary"'
+        '''
+        return ', '.join('%s "%s"' % (i.get('kind'), i['metadata']['name'])
+                         for i in objects)
+    @staticmethod
+    def age(obj):
+        ''' Return the seconds since a live object was created, or 0 if the
+            API server did not say
+        '''
+        created = (obj.get('metadata') or {}).get('creationTimestamp')
+        if not created:
+            return 0
+        return max(0, time.time() - certcache.parse_time(created))
+    def pod_failures(self):
+        ''' Return a message for each of the workload's pods which will not
+            start without somebody stepping in: pods which cannot be
+            scheduled, and containers waiting for one of
+            defaults.POD_FAILURE_REASONS. Pods being deleted are ignored.
+        '''
+        failures = []
+        for pod in self.list_workload('get pods'):
+            metadata = pod.get('metadata') or {}
+            if metadata.get('deletionTimestamp'):
+                continue
+            status = pod.get('status') or {}
+            for condition in status.get('conditions') or []:
+                if condition.get('type') == 'PodScheduled' and \
+                        condition.get('reason') == 'Unschedulable':
+                    failures.append('Pod "%s" cannot be scheduled: %s'
+                                    % (metadata.get('name'),
+                                       condition.get('message')))
+            for container in ((status.get('initContainerStatuses') or []) +
+                              (status.get('containerStatuses') or [])):
+                waiting = (container.get('state') or {}).get('waiting') or {}
+                if waiting.get('reason') in defaults.POD_FAILURE_REASONS:
+                    failures.append('Container "%s" of pod "%s" cannot \
+start: %s: %s' % (container.get('name'), metadata.get('name'),
+                  waiting.get('reason'), waiting.get('message')))
+        return failures
+    def lb_failures(self, uid):
+        ''' Return the messages of warning events, with one of
+            defaults.LB_FAILURE_REASONS, about the Service with the given uid.
+            Events about earlier Services of the same name are ignored.
+        '''
+        return ['%s: %s' % (i.get('reason'), i.get('message'))
+                for i in self.list_workload('get events')
+                if i.get('type') == 'Warning' and
+                i.get('reason') in defaults.LB_FAILURE_REASONS and
+                (i.get('involvedObject') or {}).get('uid') == uid]
+    def _pods_available(self):
+        ''' Check once that every replica of the Deployment is available,
+            failing straight away if any pod cannot start
+        '''
+        failures = self.pod_failures()
+        if failures:
+            raise KubePodsFailedError('; '.join(failures))
+        deployment = self._workload.deployment()
+        live = self.get_workload([deployment])[0]
+        if not live:
+            raise KubeError('Deployment "%s" was not found'
+                            % self._workload.name)
+        available = (live.get('status') or {}).get('availableReplicas') or 0
+        if available < self._workload.replicas:
+            raise KubePodsNotReadyError('%s of %s pods of Deployment "%s" \
+available' % (available, self._workload.replicas, self._workload.name))
+        return available
+    def verify_pods(self, timeout=TIMEOUT):
+        ''' Wait until every replica of the Deployment is available, or time
+            out. Raises KubePodsFailedError as soon as a pod cannot start.
+        '''
+        poller = retry.Retry(timeout,
+                             self._strategy,
+                             sleep=self._abort.sleep,
+                             retry_on=(KubePodsNotReadyError,),
+                             on_attempt=self._on_attempt('Pods'))
+        with self._timer.phase('pods'):
+            try:
+                return poller.call(self._pods_available)
+            except retry.RetryTimeoutError as err:
+                raise KubePodsNotReadyError('Pods did not become available in \
+timeout of %s: %s' % (timeout, err.last_error))
+    def _remember_uid(self, obj):
+        ''' Remember the uid of the workload's Service, if obj is it, so
+            its events can be told from those of earlier Services of the
+            same name
+        '''
+        metadata = (obj or {}).get('metadata') or {}
+        if (obj or {}).get('kind', 'Service') == 'Service' and \
+                metadata.get('name') == self._workload.name and \
+                metadata.get('uid'):
+            self._service_uid = metadata['uid']
+    def _lb_failed(self):
+        ''' Check once whether the cloud provider reported an error creating
+            the Service's LoadBalancer, failing straight away if it did. Only
+            the events are listed: the ingress stage reads the Service, and
+            the uid is taken from it (or from the create), so the Service is
+            only read here if neither has happened yet.
         '''
-        return self._adjust_cluster('delete', self.deploymentfile)
-    def delete_svc(self):
-        ''' Abstraction for subprocessing of kubectl delete -f
+        if self._ingress:
+            return self._ingress
+        if not self._service_uid:
+            self._remember_uid(self.get_svc())
+        failures = self.lb_failures(self._service_uid)
+        if failures:
+            raise KubeLoadBalancerError('LoadBalancer for Service "%s" \
+failed: %s' % (self._workload.name, '; '.join(failures)))
+        raise KubeIngressNotFoundError('LoadBalancer for Service "%s" is \
+not assigned yet' % self._workload.name)
+    def watch_lb_events(self, timeout=TIMEOUT):
+        ''' Wait until the ingress stage has the LoadBalancer's address,
+            raising KubeLoadBalancerError as soon as the cloud provider
+            reports an error creating it. Running out of time is left to
+            ingress_address to report.
         '''
-        out = self._adjust_cluster('delete', self.servicefile)
+        poller = retry.Retry(timeout,
+                             self._strategy,
+                             sleep=self._abort.sleep,
+                             retry_on=(KubeIngressNotFoundError,),
+                             on_attempt=self._on_attempt('LoadBalancer'))
+        try:
+            return poller.call(self._lb_failed)
+        except retry.RetryTimeoutError:
+            return None
+    def verify_workload(self, timeout=TIMEOUT):
+        ''' Check the created workload in three stages at once: its pods
+            rolling out, its LoadBalancer being created, and its address
+            answering HTTP. Returns once the pods are available and the
+            address returned 200; raises the first stage failure as soon as
+            it happens, and stops the other stages. Then puts the address
+            under load, if asked to.
+        '''
+        results = pipeline.run_stages(
+            [('pods', lambda: self.verify_pods(timeout)),
+             ('ingress', lambda: self.verify_ingress(timeout)),
+             ('lb_events', lambda: self.watch_lb_events(timeout))],
+            self._abort)
+        if self._load is None:
+            return results['ingress']
+        return '%s; load probe: %s' % (results['ingress'], self.probe_load())
+    def probe_load(self):
+        ''' Send concurrent requests to the address for a while (see
+            loadprobe.LoadProbe) and return a summary, raising KubeLoadError
+            if too many of them failed
+        '''
+        with self._timer.phase('load'):
+            probe = loadprobe.LoadProbe(self._ingress,
+                                        pod_header=self._workload.pod_header,
+                                        **self._load)
+            self._load_result = probe.run()
+        LOGGER.info('Load probe of cluster "%s": %s',
+                    self._cluster,
+                    self._load_result.summary())
+        if self._load_result.error_rate > self._max_error_rate:
+            raise KubeLoadError('LoadBalancer failed too many requests of \
+the load probe: %s' % self._load_result.summary())
+        return self._load_result.summary()
+    def get_svc(self):
+        ''' Return the Service as an object, from "kubectl get svc -o json"
+            or the API, raising KubeSvcNotFoundError if it does not exist
+        '''
+        out = self._adjust_cluster('get svc',
+                                   (self._workload.name,
+                                    self._workload.namespace))
+        if self._backend == 'kubectl':
+            # --ignore-not-found prints nothing for a missing Service
+            out = (self.items(out) or [None])[0]
+        if not out:
+            raise KubeSvcNotFoundError('Service "%s" should be created but \
+was not found' % self._workload.name)
+        return out
+    def delete_workload(self, objects=None):
+        ''' Delete the Deployment and Service, or their Namespace if they
+            have their own (or just the given manifests), together, with one
+            "kubectl delete -f -". Objects which are already gone are fine.
+            Only the deletion is requested: the cluster and the cloud
+            provider finish it in the background (see wait_deleted).
+        '''
+        out = self._adjust_cluster('delete',
+                                   '-',
+                                   objects or
+                                   self._workload.teardown_objects())
         self._ingress = None
         return out
     @lemur_setup
-    def run_raw(self, command):
+    def run_raw(self, command, stdin=None):
         ''' Issue a raw command to kubectl. Command will be prepended with
             "kubectl --context %s" % cluster
+            Keyword Arguments:
+                stdin: String to feed to kubectl, e.g. manifests for "-f -"
         '''
         cmd = defaults.KUBECTL % (self._kubeconfig, self._cluster, command)
-        return self.run_it(cmd)
+        return self.run_it(cmd, stdin)
     @lemur_setup
-    def _adjust_cluster(self, which, substr):
+    def _adjust_cluster(self, which, substr, objects=None):
+        ''' Run one of defaults.SUB_KUBECTL, feeding kubectl the given
+            manifests on stdin
+        '''
+        if self._backend == 'api':
+            return self._api_verb(which, substr, objects)
         cmd = defaults.KUBECTL % (self._kubeconfig,
                                   self._cluster,
                                   defaults.SUB_KUBECTL[which] % substr)
-        return self.run_it(cmd)
-    def cleanup(self):
-        ''' Remove service file
+        return self.run_it(cmd,
+                           manifests.render(objects) if objects else None)
+    @lemur_setup
+    def _watch_svc(self, timeout):
+        ''' Yield the service's ingress address (or '') each time the service
+            changes, until timeout seconds pass
         '''
-        LOGGER.info('Removing service file "%s"...', self.servicefile)
-        os.remove(self.servicefile)
-        LOGGER.info('Removed service file "%s"', self.servicefile)
-
+        name = self._workload.name
+        if self._backend == 'kubectl':
+            cmd = defaults.KUBECTL % (self._kubeconfig,
+                                      self._cluster,
+                                      defaults.SUB_KUBECTL['watch svc']
+                                      % (name, self._workload.namespace))
+            for line in self.watch_it(cmd, timeout, self._abort):
+                yield line
+            return
+        try:
+            for event_type, obj in self.client.watch('v1',
+                                                     'Service',
+                                                     name,
+                                                     self._workload.namespace,
+                                                     timeout=timeout,
+                                                     abort=self._abort):
+                if event_type == 'DELETED':
+                    raise KubeSvcNotFoundError('Service "%s" was deleted \
+while waiting for its LoadBalancer Ingress' % name)
+                self._remember_uid(obj)
+                try:
+                    yield self.find_ingress(obj)
+                except KubeIngressNotFoundError:
+                    yield ''
+        except kubeapi.KubeApiNotFoundError:
+            raise KubeSvcNotFoundError('Service "%s" should be created but \
+was not found' % name)
+        except kubeapi.KubeApiError as err:
+            raise KubeApiRequestError(str(err))
+    def _watch_once(self, deadline):
+        ''' Watch the service until it has a LoadBalancer Ingress, the watch
+            ends, or the deadline passes
+        '''
+        for address in self._watch_svc(max(0, deadline - time.monotonic())):
+            self._abort.check()
+            if address:
+                self._ingress = 'http://' + address
+                return self._ingress
+            LOGGER.info('LoadBalancer Ingress not available yet. Watching...')
+        raise KubeIngressNotFoundError('Watch on service "%s" ended without \
+a LoadBalancer Ingress' % self._workload.name)
+    def watch_ingress(self, timeout=TIMEOUT):
+        ''' Watch the service until it has a LoadBalancer Ingress and return
+            it, or time out
+        '''
+        # The watch can end early (server-side timeout, dropped stream), in
+        # which case it is reopened without spinning
+        deadline = time.monotonic() + timeout
+        watcher = retry.Retry(timeout,
+                              retry.Fixed(WATCH_RESTART),
+                              sleep=self._abort.sleep,
+                              retry_on=(KubeIngressNotFoundError,),
+                              on_attempt=self._on_attempt('LoadBalancer \
+Ingress'))
+        try:
+            return watcher.call(self._watch_once, deadline)
+        except retry.RetryTimeoutError:
+            raise KubeIngressNotFoundError('LoadBalancer did not come up in \
+timeout of %s. Stop.' % timeout)
+    def _api_verb(self, which, substr, objects=None):
+        ''' Perform one of the defaults.SUB_KUBECTL verbs with the API client
+            and return the structured result. create, get and delete act on
+            the given manifests, one request each.
+        '''
+        try:
+            if which == 'get svc':
+                return self._api_get({'apiVersion': 'v1',
+                                      'kind': 'Service',
+                                      'metadata': {'name': substr[0],
+                                                   'namespace': substr[1]}})
+            if which == 'create':
+                return [self.client.create(i) for i in objects]
+            if which == 'get':
+                return [self._api_get(i) for i in objects]
+            if which in ('get pods', 'get events'):
+                kind = 'Pod' if which == 'get pods' else 'Event'
+                selector = 'label_selector' if kind == 'Pod' \
+                           else 'field_selector'
+                return self.client.list('v1', kind, substr[0],
+                                        **{selector: substr[1]})
+            if which == 'get managed':
+                return self._api_list_managed(substr)
+            out = []
+            for manifest in reversed(objects):
+                try:
+                    out.append(self.client.delete(manifest))
+                except kubeapi.KubeApiNotFoundError:
+                    LOGGER.info('%s "%s" is already gone',
+                                manifest['kind'],
+                                manifest['metadata']['name'])
+            return out
+        except kubeapi.KubeApiError as err:
+            raise KubeApiRequestError(str(err))
+    def _api_list_managed(self, selector):
+        ''' Return the objects of defaults.SWEEP_KINDS in every namespace
+            which match a label selector. Items of a list come without their
+            kind, so it is filled in.
+        '''
+        found = []
+        for api_version, kind in defaults.SWEEP_KINDS:
+            for obj in self.client.list(api_version,
+                                        kind,
+                                        label_selector=selector,
+                                        all_namespaces=True):
+                obj.setdefault('apiVersion', api_version)
+                obj.setdefault('kind', kind)
+                found.append(obj)
+        return found
+    def _api_get(self, manifest):
+        ''' Return the live copy of a manifest's object, or None
+        '''
+        try:
+            return self.client.get(manifest['apiVersion'],
+                                   manifest['kind'],
+                                   manifest['metadata']['name'],
+                                   manifest['metadata'].get('namespace'))
+        except kubeapi.KubeApiNotFoundError:
+            return None
+    def _on_attempt(self, what):
+        ''' Build a retry hook which logs what we are waiting for
+        '''
+        def hook(attempt, elapsed, error, delay):
+            ''' Log a failed attempt
+            '''
+            LOGGER.info('%s not available on cluster "%s" after attempt %s \
+(%.1fs): %s. Waiting %.1fs...', what, self._cluster, attempt, elapsed, error,
+                        delay)
+        return hook
+    def _poll_ingress(self):
+        ''' Get the service once and record its LoadBalancer Ingress
+        '''
+        service = self.get_svc()
+        self._remember_uid(service)
+        self._ingress = 'http://' + self.find_ingress(service)
+        return self._ingress
     def ingress_address(self, timeout=TIMEOUT):
         ''' Check the service (if it exists) for a LoadBalancer Ingress and
             return it or time out
         '''
-        out = self.desc_svc()
-        t_slept = 0
-        while True:
-            if t_slept >= timeout:
-                raise KubeIngressNotFoundError('LoadBalancer did not come up \
-in timeout of %s. Stop.', timeout)
-            try:
-                self._ingress = 'http://' + (self
-                                             .find_ingress(out
-                                                           .decode('utf-8')))
-                break
-            except KubeIngressNotFoundError:
-                LOGGER.info('LoadBalancer Ingress not available. Waiting \
-%ss...', WAIT)
-                t_slept += WAIT
-                time.sleep(WAIT)
-                out = self.desc_svc()
+        with self._timer.phase('ingress'):
+            if self._watch:
+                return self.watch_ingress(timeout)
+            return self._poll_ingress_until(timeout)
+    def _poll_ingress_until(self, timeout):
+        ''' Poll the service for a LoadBalancer Ingress until timeout
+        '''
+        poller = retry.Retry(timeout,
+                             self._strategy,
+                             sleep=self._abort.sleep,
+                             retry_on=(KubeIngressNotFoundError,),
+                             on_attempt=self._on_attempt('LoadBalancer Ingress'))
+        try:
+            return poller.call(self._poll_ingress)
+        except retry.RetryTimeoutError:
+            raise KubeIngressNotFoundError('LoadBalancer did not come up in \
+timeout of %s. Stop.' % timeout)
+    def _get_ingress(self, url=None, session=requests):
+        ''' Make one HTTP GET against the LoadBalancer Ingress, or against
+            one of its addresses (url) with the Ingress as Host header
+        '''
+        headers = {}
+        if url:
+            headers['Host'] = urllib.parse.urlsplit(self._ingress).netloc
+        result = session.get(url or self._ingress,
+                             headers=headers,
+                             timeout=REQUEST_TIMEOUT)
+        self._timer.add('first_reachable',
+                        time.monotonic() - self._probe_started)
+        if result.status_code != 200:
+            raise KubeRequestError('Service is reachable but returned %s with \
+text "%s"' % (result.status_code, result.text))
+        self._timer.add('first_200', time.monotonic() - self._probe_started)
+        return 'Service ingress returned 200'
     def verify_ingress(self, timeout=TIMEOUT):
         ''' Make a request (HTTP GET) against the LoadBalancer Ingress and
-            return it or time out
+            return it or time out. Unless requests go through a proxy, the
+            hostname is resolved first (see resolve_ingress) and each of its
+            addresses probed directly (see verify_nodes).
         '''
         if not self._ingress:
             self.ingress_address()
-        t_slept = 0
-        while True:
-            if t_slept >= timeout:
-                raise KubeRequestError('Unable to successfully query the \
+        self._probe_started = time.monotonic()
+        if requests.utils.get_environ_proxies(self._ingress):
+            # Only the proxy resolves the hostname and picks an address
+            return self._verify_proxied(timeout)
+        addresses = self.resolve_ingress(timeout)
+        return self.verify_nodes(addresses,
+                                 timeout - (time.monotonic() -
+                                            self._probe_started))
+    def _verify_proxied(self, timeout):
+        ''' Make requests against the LoadBalancer Ingress by name until one
+            returns 200 or time out
+        '''
+        poller = retry.Retry(timeout,
+                             self._strategy,
+                             sleep=self._abort.sleep,
+                             retry_on=(requests.exceptions.ConnectionError,
+                                       requests.exceptions.Timeout),
+                             on_attempt=self._on_attempt('Address'))
+        try:
+            return poller.call(self._get_ingress)
+        except retry.RetryTimeoutError:
+            raise KubeRequestError('Unable to successfully query the \
 LoadBalancer Ingress before timing out.')
+    def resolve_ingress(self, timeout=TIMEOUT):
+        ''' Look the LoadBalancer's hostname up every DNS_POLL seconds until
+            it resolves, and return its addresses. The wait is the "dns"
+            phase.
+        '''
+        parts = urllib.parse.urlsplit(self._ingress)
+        def lookup():
+            ''' Resolve the hostname once
+            '''
             try:
-                result = requests.get(self._ingress)
-                if result.status_code != 200:
-                    raise KubeRequestError('Service is reachable but returned \
-%s with text "%s"', result.status_code, result.text)
-                return 'Service ingress returned 200'
-            except requests.exceptions.ConnectionError:
-                LOGGER.info('Address not yet reachable. Waiting %s...', WAIT)
-                t_slept += WAIT
-                time.sleep(WAIT)
+                return resolve(parts.hostname, parts.port or 80)
+            except socket.gaierror as err:
+                raise KubeDnsError('%s does not resolve yet: %s'
+                                   % (parts.hostname, err))
+        poller = retry.Retry(timeout,
+                             retry.Fixed(DNS_POLL),
+                             sleep=self._abort.sleep,
+                             retry_on=(KubeDnsError,),
+                             on_attempt=self._on_attempt('DNS'))
+        with self._timer.phase('dns'):
+            try:
+                addresses = poller.call(lookup)
+            except retry.RetryTimeoutError as err:
+                raise KubeDnsError('LoadBalancer hostname did not resolve \
+before timing out: %s' % err.last_error)
+        LOGGER.info('LoadBalancer of cluster "%s" resolves to %s',
+                    self._cluster,
+                    ', '.join(addresses))
+        return addresses
+    def _probe_node(self, address, timeout, done):
+        ''' Make requests against one of the LoadBalancer's addresses until
+            it returns 200, and return the seconds since probing started
+        '''
+        port = urllib.parse.urlsplit(self._ingress).port or 80
+        url = 'http://%s:%s/' % ('[%s]' % address if ':' in address
+                                 else address, port)
+        poller = retry.Retry(timeout,
+                             self._strategy,
+                             sleep=done.sleep,
+                             retry_on=(requests.exceptions.ConnectionError,
+                                       requests.exceptions.Timeout),
+                             on_attempt=self._on_attempt('LoadBalancer node \
+%s' % address))
+        with trace.span('probe node', 'http', address=address), \
+                requests.Session() as session:
+            # The address is connected to as it is, whatever the environment
+            session.trust_env = False
+            try:
+                poller.call(self._get_ingress, url, session)
+            except retry.RetryTimeoutError as err:
+                raise KubeRequestError('LoadBalancer node %s did not answer \
+before timing out: %s' % (address, err.last_error))
+        return time.monotonic() - self._probe_started
+    def verify_nodes(self, addresses, timeout=TIMEOUT):
+        ''' Probe every address of the LoadBalancer at once. Returns once all
+            of them returned 200, or NODE_GRACE seconds after the first one
+            did, naming those which did not; raises KubeRequestError if none
+            did within timeout.
+        '''
+        done = pipeline.Abort()
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(addresses),
+            thread_name_prefix='node')
+        futures = {pool.submit(trace.bind(self._probe_node), i, timeout,
+                               done): i
+                   for i in addresses}
+        pending = set(futures)
+        answered, failed = {}, {}
+        grace = None
+        try:
+            while pending and not (grace and time.monotonic() >= grace):
+                finished, pending = concurrent.futures.wait(
+                    pending,
+                    timeout=WATCH_CHECK,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    try:
+                        answered[futures[future]] = future.result()
+                    except (KubeError, pipeline.PipelineAbortedError) as err:
+                        failed[futures[future]] = str(err)
+                self._abort.check()
+                if answered and not grace:
+                    grace = time.monotonic() + NODE_GRACE
+        finally:
+            done.set('LoadBalancer probing is over')
+            pool.shutdown(wait=False)
+        for future in pending:
+            failed[futures[future]] = 'no 200 within %ss of the first node' \
+                                      % NODE_GRACE
+        self._nodes = {i: answered.get(i) for i in addresses}
+        if answered and not failed:
+            self._timer.add('all_nodes_200', max(answered.values()))
+        if not answered:
+            raise KubeRequestError('Unable to successfully query any of the \
+LoadBalancer\'s addresses before timing out: %s'
+                                   % '; '.join('%s: %s' % i
+                                               for i in sorted(failed.items())))
+        if failed:
+            LOGGER.warning('LoadBalancer nodes of cluster "%s" not answering: \
+%s', self._cluster, '; '.join('%s: %s' % i for i in sorted(failed.items())))
+            return 'Service ingress returned 200 from %d of %d LoadBalancer \
+nodes (not %s)' % (len(answered), len(addresses), ', '.join(sorted(failed)))
+        return 'Service ingress returned 200 from all %d LoadBalancer \
+node(s)' % len(addresses)
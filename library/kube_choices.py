@@ -4,7 +4,7 @@
 
 import logging
 from library import defaults
-import yaml
+from library import kubeconfig
 
 LOGGER = logging.getLogger(defaults.LOGGER)
 
@@ -44,10 +44,9 @@ class KubeChoice(object):
             # extra check of self._run because maybe we don't get choices from
             # file
             try:
-                with open(self._conf) as data:
-                    kubedict = yaml.load(data.read())
-                    self._choices = [i['name'] for i in kubedict['contexts']]
-                    self._run = True
+                config = kubeconfig.KubeConfig.load(self._conf)
+                self._choices = config.context_names
+                self._run = True
             except IOError:
                 LOGGER.exception('Could not open kubectl config file "%s"',
                                  self._conf)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+''' Minimal Kubernetes API client which talks to the API server directly
+    instead of spawning kubectl for every call
+'''
+
+import os
+import json
+import logging
+import socket
+import threading
+from library import defaults
+from library import kubeconfig as kubeconfig_index
+from library import trace
+import requests
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+# Kinds which do not live in a namespace
+CLUSTER_SCOPED = ('Namespace', 'Node', 'PersistentVolume')
+# Kinds whose plural is not just lower(kind) + 's'
+PLURALS = {'Endpoints': 'endpoints',
+           'Ingress': 'ingresses',
+           'NetworkPolicy': 'networkpolicies'}
+POOL_SIZE = 4
+REQUEST_TIMEOUT = (5, 30)
+# Seconds between checks of whether a watch should stop early
+WATCH_CHECK = 0.5
+DELETE_OPTIONS = {'kind': 'DeleteOptions',
+                  'apiVersion': 'v1',
+                  'propagationPolicy': 'Background'}
+
+class KubeApiError(Exception):
+    ''' Custom kube API error
+    '''
+    def __init__(self, message, status=None, reason=None):
+        ''' Initialization method
+            Positional Arguments:
+                message: Message from the API server (or our own)
+            Keyword Arguments:
+                status: HTTP status code of the response
+                reason: Kubernetes Status reason, e.g. "NotFound"
+        '''
+        Exception.__init__(self, message)
+        self.status = status
+        self.reason = reason
+class KubeApiConfigError(KubeApiError):
+    ''' Custom kube API error for an unusable kubeconfig
+    '''
+    pass
+class KubeApiNotFoundError(KubeApiError):
+    ''' Custom kube API error for objects which do not exist
+    '''
+    pass
+
+def resource_path(api_version, kind, namespace=None, name=None,
+                  all_namespaces=False):
+    ''' Build the REST path for a kind of object
+        Positional Arguments:
+            api_version: apiVersion of the object, e.g. "v1" or "apps/v1"
+            kind: kind of the object, e.g. "Service"
+        Keyword Arguments:
+            namespace: Namespace of the object; ignored for cluster-scoped kinds
+            name: Name of the object; omit for the collection
+            all_namespaces: Build the path of the collection across every
+                            namespace instead
+    '''
+    prefix = '/api/%s' % api_version if '/' not in api_version \
+             else '/apis/%s' % api_version
+    parts = [prefix]
+    if kind not in CLUSTER_SCOPED and not all_namespaces:
+        parts.append('namespaces/%s' % (namespace or 'default'))
+    parts.append(PLURALS.get(kind, kind.lower() + 's'))
+    if name:
+        parts.append(name)
+    return '/'.join(parts)
+
+def close_stream(response):
+    ''' Close a streamed response, waking up any thread blocked reading it.
+        Closing alone leaves a blocked read waiting for the server, so the
+        connection is shut down first, through a copy of its descriptor.
+    '''
+    try:
+        with socket.socket(fileno=os.dup(response.raw.fileno())) as sock:
+            sock.shutdown(socket.SHUT_RDWR)
+    except (AttributeError, OSError, ValueError) as err:
+        LOGGER.info('Unable to shut the stream down: %s', err)
+    response.close()
+
+class KubeApiClient(object):
+    ''' Keep-alive HTTPS client for a single cluster's API server
+    '''
+    _clients = {}
+    _lock = threading.Lock()
+    @classmethod
+    def for_context(cls, kubeconfig, context):
+        ''' Return the shared client for a kubeconfig context, creating it on
+            first use so every caller reuses one connection pool per cluster
+        '''
+        key = (os.path.abspath(kubeconfig), context)
+        with cls._lock:
+            if key not in cls._clients:
+                cls._clients[key] = cls.from_kubeconfig(kubeconfig, context)
+            return cls._clients[key]
+    @classmethod
+    def clear(cls, kubeconfig=None):
+        ''' Forget the shared clients of one kubeconfig, or of all of them, so
+            the next caller builds a client from the file as it is now.
+            Requests already under way keep the client they have.
+        '''
+        with cls._lock:
+            for key in list(cls._clients):
+                if kubeconfig is None or key[0] == os.path.abspath(kubeconfig):
+                    del cls._clients[key]
+    @classmethod
+    def from_kubeconfig(cls, kubeconfig, context):
+        ''' Build a client from the cluster and user entries of a context.
+            Relative file paths are resolved against the kubeconfig's
+            directory, as kubectl does.
+        '''
+        try:
+            config = kubeconfig_index.KubeConfig.load(kubeconfig)
+            _, cluster, _, user = config.resolve(context)
+        except IOError:
+            raise KubeApiConfigError('Unable to open %s for configuration.'
+                                     % kubeconfig)
+        except (KeyError, TypeError):
+            raise KubeApiConfigError('Unable to find cluster and user for \
+context "%s" in %s' % (context, kubeconfig))
+        if cluster.get('insecure-skip-tls-verify'):
+            verify = False
+        else:
+            verify = config.relative(cluster.get('certificate-authority')) \
+                     or True
+        return cls(cluster['server'],
+                   verify=verify,
+                   cert_file=config.relative(user.get('client-certificate')),
+                   key_file=config.relative(user.get('client-key')),
+                   token=user.get('token'))
+    def __init__(self,
+                 server,
+                 verify=True,
+                 cert_file=None,
+                 key_file=None,
+                 token=None):
+        ''' Initialization method
+            Positional Arguments:
+                server: URL of the API server
+            Keyword Arguments:
+                verify: CA bundle path, or a bool, as for requests
+                cert_file: Path to the client certificate
+                key_file: Path to the client key
+                token: Bearer token, if the user authenticates with one
+        '''
+        self._server = server.rstrip('/')
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=POOL_SIZE)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._session.verify = verify
+        if cert_file:
+            self._session.cert = (cert_file, key_file)
+        if token:
+            self._session.headers['Authorization'] = 'Bearer %s' % token
+    @property
+    def server(self):
+        ''' Return the API server URL
+        '''
+        return self._server
+    def request(self, method, path, **kwargs):
+        ''' Make a request against the API server and return the decoded JSON
+            body. Kubernetes Status failures are raised as KubeApiError.
+        '''
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        url = self._server + path
+        LOGGER.info('Making k8s API request: %s %s', method, url)
+        try:
+            with trace.span('k8s api %s' % method, 'http', url=url):
+                response = self._session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as err:
+            raise KubeApiError('%s %s failed: %s' % (method, url, err))
+        try:
+            body = response.json()
+        except ValueError:
+            body = {'message': response.text}
+        if response.status_code >= 400:
+            reason = body.get('reason')
+            message = body.get('message') or response.text
+            error = (KubeApiNotFoundError if response.status_code == 404
+                     else KubeApiError)
+            raise error(message, status=response.status_code, reason=reason)
+        return body
+    def create(self, manifest):
+        ''' Create an object from its manifest (a dict)
+        '''
+        path = resource_path(manifest['apiVersion'],
+                             manifest['kind'],
+                             manifest['metadata'].get('namespace'))
+        return self.request('POST', path, json=manifest)
+    def delete(self, manifest):
+        ''' Delete the object described by a manifest (a dict)
+        '''
+        path = resource_path(manifest['apiVersion'],
+                             manifest['kind'],
+                             manifest['metadata'].get('namespace'),
+                             manifest['metadata']['name'])
+        return self.request('DELETE', path, json=DELETE_OPTIONS)
+    def get(self, api_version, kind, name, namespace=None):
+        ''' Get a single object
+        '''
+        return self.request('GET',
+                            resource_path(api_version, kind, namespace, name))
+    def list(self, api_version, kind, namespace=None, label_selector=None,
+             field_selector=None, all_namespaces=False):
+        ''' Return the objects of a kind in a namespace (or in every namespace),
+            optionally only those matching a label and/or field selector
+        '''
+        # pylint: disable=too-many-arguments
+        params = {}
+        if label_selector:
+            params['labelSelector'] = label_selector
+        if field_selector:
+            params['fieldSelector'] = field_selector
+        path = resource_path(api_version,
+                             kind,
+                             namespace,
+                             all_namespaces=all_namespaces)
+        return self.request('GET', path, params=params).get('items') or []
+    def watch(self, api_version, kind, name, namespace=None, timeout=None,
+              abort=None):
+        ''' Watch a single object, yielding (event type, object) pairs as the
+            API server streams them. The current state of the object is
+            always yielded first. Stops after timeout seconds, or as soon as
+            abort (a pipeline.Abort) is set, even while no events arrive.
+        '''
+        # pylint: disable=too-many-arguments
+        current = self.get(api_version, kind, name, namespace)
+        yield 'ADDED', current
+        params = {'watch': 1,
+                  'fieldSelector': 'metadata.name=%s' % name,
+                  'resourceVersion': current['metadata'].get('resourceVersion')}
+        if timeout:
+            params['timeoutSeconds'] = max(1, int(timeout))
+        url = self._server + resource_path(api_version, kind, namespace)
+        LOGGER.info('Watching k8s API: %s for "%s"', url, name)
+        try:
+            with trace.span('k8s api watch', 'http', url=url):
+                response = self._session.get(url,
+                                             params=params,
+                                             stream=True,
+                                             timeout=(REQUEST_TIMEOUT[0],
+                                                      timeout))
+                finished = threading.Event()
+                stopped = []
+                def closer():
+                    ''' Close the stream once the watch should stop
+                    '''
+                    while not finished.wait(WATCH_CHECK):
+                        if abort.is_set():
+                            stopped.append(True)
+                            close_stream(response)
+                            return
+                if abort:
+                    threading.Thread(target=closer, daemon=True).start()
+                try:
+                    with response:
+                        if response.status_code >= 400:
+                            raise KubeApiError(response.text,
+                                               status=response.status_code)
+                        for line in response.iter_lines():
+                            if not line:
+                                continue
+                            event = json.loads(line.decode('utf-8'))
+                            if event.get('type') == 'ERROR':
+                                status = event.get('object', {})
+                                raise KubeApiError(status.get('message'),
+                                                   status=status.get('code'),
+                                                   reason=status.get('reason'))
+                            yield event.get('type'), event.get('object')
+                # Whatever reading a stream closed under it raises, the watch
+                # was told to stop
+                # pylint: disable=broad-except
+                except Exception:
+                    if not stopped:
+                        raise
+                    LOGGER.info('Watch on "%s" stopped early', name)
+                finally:
+                    finished.set()
+        except requests.exceptions.ConnectionError as err:
+            # A read timeout on a stream surfaces as a ConnectionError; the
+            # caller's deadline is what decides whether that is a failure
+            LOGGER.info('Watch on "%s" ended: %s', name, err)
+        except requests.exceptions.RequestException as err:
+            raise KubeApiError('Watch of %s failed: %s' % (url, err))
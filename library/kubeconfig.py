@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+''' Parsed, indexed kubectl config file shared by every module which needs it
+'''
+
+import os
+import logging
+import threading
+from library import defaults
+import yaml
+try:
+    # LibYAML is an order of magnitude faster on large generated configs
+    from yaml import CSafeLoader as Loader
+except ImportError:
+    from yaml import SafeLoader as Loader
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+
+class KubeConfig(object):
+    ''' Index of a kubectl config file's contexts, clusters and users by name
+    '''
+    _cache = {}
+    _lock = threading.Lock()
+    @classmethod
+    def load(cls, path=defaults.KUBECONFIG):
+        ''' Return the parsed config at path. Parses are shared until the file
+            changes on disk. Raises IOError if the file cannot be read.
+        '''
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with cls._lock:
+            cached = cls._cache.get(path)
+            if cached and cached.stamp == stamp:
+                return cached
+        with open(path, 'r') as data:
+            # data.read() is definitely callable
+            # pylint: disable=not-callable
+            config = cls(path, yaml.load(data.read(), Loader=Loader), stamp)
+        with cls._lock:
+            cls._cache[path] = config
+        return config
+    @classmethod
+    def clear(cls):
+        ''' Forget every cached parse
+        '''
+        with cls._lock:
+            cls._cache.clear()
+    def __init__(self, path, raw, stamp=None):
+        ''' Initialization method
+            Positional Arguments:
+                path: Where the config was read from
+                raw: The parsed YAML document
+            Keyword Arguments:
+                stamp: (mtime, size) of the file when it was read
+        '''
+        self._path = path
+        self._raw = raw if isinstance(raw, dict) else {}
+        self._stamp = stamp
+        self._index = {}
+        for section in ('contexts', 'clusters', 'users'):
+            self._index[section] = {i['name']: i
+                                    for i in self._raw.get(section) or []
+                                    if isinstance(i, dict) and 'name' in i}
+    @property
+    def path(self):
+        ''' Return the path of the config file
+        '''
+        return self._path
+    @property
+    def stamp(self):
+        ''' Return the (mtime, size) of the file when it was read
+        '''
+        return self._stamp
+    @property
+    def raw(self):
+        ''' Return the parsed YAML document
+        '''
+        return self._raw
+    @property
+    def context_names(self):
+        ''' Return the names of all contexts, in file order. Raises KeyError
+            if the file has no contexts section, or an empty one
+            ("contexts: null").
+        '''
+        contexts = self._raw.get('contexts')
+        if contexts is None:
+            raise KeyError('contexts')
+        return [i['name'] for i in contexts]
+    def context(self, name):
+        ''' Return the context entry (the inner "context" mapping) for name.
+            Raises KeyError if there is no such context.
+        '''
+        return self._index['contexts'][name]['context']
+    def cluster(self, name):
+        ''' Return the cluster entry (the inner "cluster" mapping) for name.
+            Raises KeyError if there is no such cluster.
+        '''
+        return self._index['clusters'][name]['cluster']
+    def user(self, name):
+        ''' Return the user entry (the inner "user" mapping) for name.
+            Raises KeyError if there is no such user.
+        '''
+        return self._index['users'][name]['user']
+    def resolve(self, context):
+        ''' Return the (cluster name, cluster entry, user name, user entry) a
+            context refers to. Raises KeyError if any of them are missing.
+        '''
+        context_obj = self.context(context)
+        return (context_obj['cluster'],
+                self.cluster(context_obj['cluster']),
+                context_obj['user'],
+                self.user(context_obj['user']))
+    def relative(self, path):
+        ''' Resolve a path from the config against the config's directory, as
+            kubectl does
+        '''
+        if not path:
+            return None
+        return os.path.join(os.path.dirname(self._path), path)
@@ -4,12 +4,20 @@
 '''
 
 import os
+import concurrent.futures
+import copy
 import datetime
 import collections
 import functools
 import hashlib
 import logging
+import threading
+import time
 from library import defaults
+from library import certcache
+from library import kubeconfig as kubeconfig_index
+from library import retry
+from library import trace
 import yaml
 import requests
 
@@ -18,6 +26,18 @@ LEMUR_URL = collections.defaultdict(lambda: 'https://lemur.example.com')
 LEMUR_URL['prod'] = 'https://lemur-prod.example.com'
 AUTHORITIES = collections.defaultdict(lambda: {'name': 'PipelineCA'})
 AUTHORITIES['prod'] = {'name': 'ProdCA'}
+RETRY_TIMEOUT = 60
+# (connect, read) seconds for every request to Lemur
+REQUEST_TIMEOUT = (5, 30)
+POOL_SIZE = 8
+# Methods which can be sent again after a read timeout or a dropped
+# connection without doing anything twice
+IDEMPOTENT = ('GET', 'HEAD', 'PUT', 'DELETE')
+# Connection-pooled sessions per Lemur URL and bearer tokens per
+# (environment, user), shared by every Lemur instance in the process
+_SESSIONS = {}
+_TOKENS = {}
+_SHARED_LOCK = threading.Lock()
 MANIFEST = {'description': "Client Certificate for Rundeck Automation",
             'authority': '',
             'commonName': 'Rundeck',
@@ -64,27 +84,15 @@ class CertificateSet(object):
         self._cluster = cluster
         self._kubeconfig = kubeconfig
         try:
-            with open(self._kubeconfig, 'r') as data:
-                # data.read() is definitely callable
-                # pylint: disable=not-callable
-                config = yaml.load(data.read())
-            cluster_obj = [i
-                           for i in config['clusters']
-                           if i['name'] == self._cluster][0]
-            self._ca_file = cluster_obj['cluster']['certificate-authority']
-            context_obj = [i
-                           for i in config['contexts']
-                           if i['name'] == self._cluster][0]
-            user = [i
-                    for i in config['users']
-                    if i['name'] == context_obj['context']['user']][0]
-            self._user = user['name']
-            self._cert_file = user['user']['client-certificate']
-            self._key_file = user['user']['client-key']
+            config = kubeconfig_index.KubeConfig.load(self._kubeconfig)
+            _, cluster_obj, self._user, user = config.resolve(self._cluster)
+            self._ca_file = cluster_obj['certificate-authority']
+            self._cert_file = user['client-certificate']
+            self._key_file = user['client-key']
         except IOError:
             raise CertificateSetConfigNotFoundError('Unable to open %s for \
 configuration.', self._kubeconfig)
-        except KeyError:
+        except (KeyError, TypeError):
             raise CertificateSetConfigError('Malformed configuration in %s, \
 unable to read certificate file paths.', self._kubeconfig)
     @property
@@ -103,24 +111,121 @@ unable to read certificate file paths.', self._kubeconfig)
         ''' Return the location of the key file
         '''
         return self._key_file
-    def run(self):
-        ''' Get the certificates and write them to file
+    @property
+    def user(self):
+        ''' Return the kubeconfig user the certificates belong to
+        '''
+        return self._user
+    @property
+    def lemur_env(self):
+        ''' Return the Lemur environment which issues our certificates
         '''
         # str.split() is definitely callable
         # pylint: disable=not-callable
-        lemur_env = self._user.split('-')[0]
-        certs = Lemur.get_from(lemur_env)
-        # dict.items() is definitely callable
-        # pylint: disable=not-an-iterable
-        for key, content in certs.items():
-            filepath = os.path.join(os.path.dirname(self._kubeconfig),
-                                    self.__getattribute__(key))
-            with open(filepath, 'w') as data:
-                LOGGER.info('Writing certificate contents to file "%s"',
-                            filepath)
-                # data.write() is definitely callable
-                # pylint: disable=not-callable
-                data.write(content)
+        return self._user.split('-')[0]
+    @property
+    def directory(self):
+        ''' Return the directory the certificate files are written to
+        '''
+        return os.path.dirname(os.path.abspath(self._kubeconfig))
+    def run(self):
+        ''' Get the certificates and write them to file, unless the files on
+            disk are already the current certificates and not about to expire.
+            Return when the certificates expire, in seconds since epoch.
+        '''
+        client = Lemur(self.lemur_env)
+        paths = {i: os.path.join(self.directory, self.__getattribute__(i))
+                 for i in ('ca', 'cert', 'key')}
+        cache = certcache.CertCache(self.directory)
+        # Clusters sharing a user write the same certificate to their own
+        # files, so each set of files gets its own entry
+        cache_key = '%s:%s:%s' % (self._user,
+                                  client.digest,
+                                  ','.join(paths[i]
+                                           for i in ('ca', 'cert', 'key')))
+        with cache.lock():
+            if cache.valid(cache_key, paths.values()):
+                LOGGER.info('Reusing cached certificates for user "%s"',
+                            self._user)
+                return cache.expiry(cache_key)
+            certs = client.get_or_create_cert()
+            not_after = certs.pop('not_after')
+            cache.store(cache_key,
+                        {paths[key]: content for key, content in certs.items()},
+                        not_after)
+            return not_after
+
+class ProvisionRegistry(object):
+    ''' Make sure each set of client certificates is provisioned once per
+        process: callers wanting the same certificates while a fetch is in
+        flight wait for it instead of starting their own
+    '''
+    def __init__(self, margin=certcache.REFRESH_MARGIN, clock=time.time):
+        ''' Initialization method
+            Keyword Arguments:
+                margin: Seconds before expiry at which to provision again
+                clock: Wall clock, for testing
+        '''
+        self._margin = margin
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flights = {}
+    def provision(self, cluster, kubeconfig=defaults.KUBECONFIG):
+        ''' Make sure the client certificates for a cluster are on disk
+        '''
+        certset = CertificateSet(cluster, kubeconfig)
+        # Clusters sharing a user may still name their files differently, and
+        # each needs its own files written
+        key = (certset.directory, certset.user, certset.lemur_env,
+               certset.ca, certset.cert, certset.key)
+        with self._lock:
+            future = self._flights.get(key)
+            if future and future.done() and not self._fresh(future):
+                future = None
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._flights[key] = future
+        if not owner:
+            LOGGER.info('Waiting for certificates for user "%s" from \
+environment "%s"', certset.user, certset.lemur_env)
+            return future.result()
+        try:
+            future.set_result(certset.run())
+        # The error belongs to every caller waiting on this flight
+        # pylint: disable=broad-except
+        except BaseException as err:
+            with self._lock:
+                self._flights.pop(key, None)
+            future.set_exception(err)
+        return future.result()
+    def _fresh(self, future):
+        ''' Return whether a finished flight's certificates are still good
+        '''
+        return (future.exception() is None and
+                future.result() - self._margin > self._clock())
+
+REGISTRY = ProvisionRegistry()
+
+def provision(cluster, kubeconfig=defaults.KUBECONFIG):
+    ''' Make sure the client certificates for a cluster are on disk, sharing
+        the work with any other caller in this process that needs the same
+        certificates
+    '''
+    with trace.span('provision', 'lemur'):
+        return REGISTRY.provision(cluster, kubeconfig)
+
+def session_for(url):
+    ''' Return the shared, connection-pooled session for a Lemur URL
+    '''
+    with _SHARED_LOCK:
+        if url not in _SESSIONS:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                    pool_maxsize=POOL_SIZE)
+            session.mount(url, adapter)
+            _SESSIONS[url] = session
+        return _SESSIONS[url]
 
 def auth(func):
     ''' Decorator to make sure we've authenticated before making API calls
@@ -156,43 +261,104 @@ class Lemur(object):
         self._api = '/api/1'
         self._authuri = '/auth/login'
         self._certuri = '/certificates'
-        self._token = None
+        self._session = session_for(self._url)
         self._man = None
+        self._digest = None
     @property
     def manifest(self):
-        ''' Generate a manifest for requesting client certificates
+        ''' Generate a manifest for requesting client certificates. The
+            description is prefixed with a digest of the rest of the manifest
+            so we can find certificates we made earlier.
         '''
         if not self._man:
-            self._man = MANIFEST
-            self._man['authority'] = AUTHORITIES[self._env]
-            self._man['validityStart'] = datetime.datetime.now().strftime('%F')
-            self._man['validityEnd'] = ((datetime.datetime.now() +
-                                         datetime.timedelta(1))
-                                        .strftime('%F'))
-            digest = (hashlib
-                      .sha256(yaml
-                              .dump(self._man)
-                              .encode('utf-8'))
-                      .hexdigest())
-            self._man['description'] = '%s:%s' % (digest,
-                                                  self._man['description'])
+            man = copy.deepcopy(MANIFEST)
+            man['authority'] = AUTHORITIES[self._env]
+            man['validityStart'] = datetime.datetime.now().strftime('%F')
+            man['validityEnd'] = ((datetime.datetime.now() +
+                                   datetime.timedelta(1))
+                                  .strftime('%F'))
+            self._digest = (hashlib
+                            .sha256(yaml
+                                    .dump(man)
+                                    .encode('utf-8'))
+                            .hexdigest())
+            man['description'] = '%s:%s' % (self._digest, man['description'])
+            self._man = man
         return self._man
     @property
+    def digest(self):
+        ''' Return the digest identifying our manifest
+        '''
+        if not self._digest:
+            # pylint: disable=pointless-statement
+            self.manifest
+        return self._digest
+    def _request(self, method, url, idempotent=None, **kwargs):
+        ''' Make an HTTP request to Lemur over the shared session, retrying
+            with exponential backoff while Lemur is unreachable
+            Keyword Arguments:
+                idempotent: Whether the request may be sent again after it
+                            could have reached Lemur (a read timeout or a
+                            dropped connection). Defaults to whether the
+                            method is one of IDEMPOTENT; anything else is
+                            only retried when connecting timed out, so e.g.
+                            a certificate is never requested twice.
+        '''
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT
+        if idempotent:
+            retry_on = (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout)
+        else:
+            retry_on = (requests.exceptions.ConnectTimeout,)
+        poller = retry.Retry(RETRY_TIMEOUT,
+                             retry.Exponential(),
+                             retry_on=retry_on)
+        def attempt():
+            ''' Make one attempt at the request
+            '''
+            with trace.span('lemur %s' % method, 'http', url=url):
+                return self._session.request(method, url, **kwargs)
+        try:
+            return poller.call(attempt)
+        except retry.RetryTimeoutError as err:
+            raise err.last_error
+    def _authed_request(self, method, url, **kwargs):
+        ''' Make an authenticated request, logging in again once if Lemur
+            says the cached token is no longer good
+        '''
+        response = self._request(method, url, headers=self.headers, **kwargs)
+        if response.status_code == 401:
+            LOGGER.info('Lemur token for "%s" was rejected. Logging in again.',
+                        self._env)
+            self.authenticate()
+            response = self._request(method,
+                                     url,
+                                     headers=self.headers,
+                                     **kwargs)
+        return response
+    @property
     def token(self):
         ''' Return auth token. Decorator @auth shouldn't be accessing private
             attributes, so publicize it
         '''
-        return self._token
+        return _TOKENS.get((self._env, self._user))
+    @trace.traced('lemur')
     def authenticate(self):
         ''' Request an authentication token for API calls with user/pass
         '''
         data = {'username': self._user,
                 'password': self._pass}
-        response = requests.post(''.join([self._url,
+        # Logging in twice only hands out another token
+        response = self._request('POST',
+                                 ''.join([self._url,
                                           self._api,
                                           self._authuri]),
+                                 idempotent=True,
                                  json=data)
-        self._token = response.json()['token']
+        with _SHARED_LOCK:
+            _TOKENS[(self._env, self._user)] = response.json()['token']
     @property
     @auth
     def headers(self):
@@ -200,45 +366,40 @@ class Lemur(object):
         '''
         return {'Authorization': 'Bearer %s' % self.token,
                 'Content-type': 'application/json'}
+    @trace.traced('lemur')
     @auth
     def get_or_create_cert(self):
         ''' Retrieve the cert for our manifest if it exists or create a new
         one.
         '''
         url = ''.join([self._url, self._api, self._certuri])
-        headers = self.headers
         params = {'sortBy': 'date_created',
                   'sortDir': 'desc',
                   'filter': 'description;%s' % self.manifest['description']}
-        response = requests.get(url,
-                                headers=headers,
-                                params=params)
+        response = self._authed_request('GET', url, params=params)
         data = response.json()
         if data['total'] < 1:
-            ca_cert, client_cert, cert_id = self.create_cert()
+            item = self.create_cert()
         else:
             item = data['items'][0]
-            ca_cert = item['chain']
-            client_cert = item['body']
-            cert_id = item['id']
-        key = self.cert_key(cert_id)
-        return {'ca': ca_cert,
-                'cert': client_cert,
-                'key': key}
+        key = self.cert_key(item['id'])
+        try:
+            not_after = certcache.parse_time(item.get('notAfter'))
+        except ValueError:
+            not_after = certcache.parse_time(self.manifest['validityEnd'])
+        return {'ca': item['chain'],
+                'cert': item['body'],
+                'key': key,
+                'not_after': not_after}
+    @trace.traced('lemur')
     @auth
     def create_cert(self):
-        ''' Create a cert from our manifest
+        ''' Create a cert from our manifest and return Lemur's record of it
         '''
         url = ''.join([self._url, self._api, self._certuri])
-        headers = self.headers
-        response = requests.post(url,
-                                 headers=headers,
-                                 json=self.manifest)
-        data = response.json()
-        ca_cert = data['chain']
-        client_cert = data['body']
-        cert_id = data['id']
-        return ca_cert, client_cert, cert_id
+        response = self._authed_request('POST', url, json=self.manifest)
+        return response.json()
+    @trace.traced('lemur')
     @auth
     def cert_key(self, cert_id):
         ''' Obtain the key for a cert given an id
@@ -251,6 +412,5 @@ class Lemur(object):
                        self._certuri,
                        '/%s' % cert_id,
                        '/key'])
-        headers = self.headers
-        response = requests.get(url, headers=headers)
+        response = self._authed_request('GET', url)
         return response.json()['key']
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+''' Drive concurrent keep-alive HTTP requests at a LoadBalancer and summarize
+    the latency, the errors, and how the requests spread over the pods
+    behind it
+'''
+
+import collections
+import concurrent.futures
+import logging
+import math
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+from library import defaults
+from library import trace
+import requests
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+REQUEST_TIMEOUT = (5, 10)
+# Metrics the results are reported under on datadog
+LATENCY_METRIC = 'end2end_k8s.load.latency.seconds'
+CONNECTION_METRIC = 'end2end_k8s.load.connection.seconds'
+RATE_METRIC = 'end2end_k8s.load.requests_per_second'
+ERROR_METRIC = 'end2end_k8s.load.error_rate'
+QUANTILES = (('p50', 50), ('p95', 95), ('p99', 99))
+# Steps of a new connection, in order
+STEPS = ('dns', 'connect', 'tls', 'ttfb')
+
+def percentile(ordered, percent):
+    ''' Return the nearest-rank percentile of sorted samples
+    '''
+    if not ordered:
+        return None
+    return ordered[max(0, int(math.ceil(percent / 100.0 *
+                                        len(ordered))) - 1)]
+
+def read_head(sock):
+    ''' Read an HTTP response up to the end of its headers and return them
+    '''
+    head = b''
+    while b'\r\n\r\n' not in head:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        head += chunk
+    return head.split(b'\r\n\r\n')[0].decode('latin-1')
+
+def connection_timings(url, timeout=REQUEST_TIMEOUT[0], proxies=None):
+    ''' Open a new connection to url and time each step, in seconds: name
+        resolution ("dns"), the TCP handshake ("connect"), the TLS handshake
+        ("tls", https only) and the wait from sending a GET to the first
+        byte of the response ("ttfb"). Honours the proxy settings requests
+        would use, so through a proxy the first two steps are the proxy's.
+        Positional Arguments:
+            url: URL to connect to
+        Keyword Arguments:
+            timeout: Seconds allowed for each socket operation
+            proxies: Mapping of scheme to proxy URL. Defaults to the
+                     environment's.
+    '''
+    parts = urllib.parse.urlsplit(url)
+    https = parts.scheme == 'https'
+    port = parts.port or (443 if https else 80)
+    if proxies is None:
+        proxies = requests.utils.get_environ_proxies(url)
+    proxy = proxies.get(parts.scheme)
+    host, connect_port = parts.hostname, port
+    if proxy:
+        proxy_parts = urllib.parse.urlsplit(proxy)
+        host, connect_port = proxy_parts.hostname, proxy_parts.port or 80
+    timings = {}
+    started = time.monotonic()
+    family, kind, proto, _, address = socket.getaddrinfo(
+        host, connect_port, type=socket.SOCK_STREAM)[0]
+    timings['dns'] = time.monotonic() - started
+    sock = socket.socket(family, kind, proto)
+    try:
+        sock.settimeout(timeout)
+        started = time.monotonic()
+        sock.connect(address)
+        timings['connect'] = time.monotonic() - started
+        target = parts.path or '/'
+        if proxy and https:
+            sock.sendall(('CONNECT %s:%s HTTP/1.1\r\nHost: %s:%s\r\n\r\n'
+                          % (parts.hostname, port, parts.hostname, port))
+                         .encode('ascii'))
+            status = read_head(sock).split(' ', 2)
+            if len(status) < 2 or status[1] != '200':
+                raise OSError('Proxy refused to connect to %s:%s: %s'
+                              % (parts.hostname, port, ' '.join(status)))
+        elif proxy:
+            target = url
+        if https:
+            started = time.monotonic()
+            sock = ssl.create_default_context().wrap_socket(
+                sock, server_hostname=parts.hostname)
+            timings['tls'] = time.monotonic() - started
+        sock.sendall(('GET %s HTTP/1.1\r\nHost: %s\r\nUser-Agent: end2end-k8s'
+                      '\r\nConnection: close\r\n\r\n'
+                      % (target, parts.netloc)).encode('ascii'))
+        started = time.monotonic()
+        if not sock.recv(1):
+            raise OSError('Connection to %s closed without a response' % url)
+        timings['ttfb'] = time.monotonic() - started
+    finally:
+        sock.close()
+    return timings
+
+class LoadResult(object):
+    ''' Outcome of a load probe
+    '''
+    # pylint: disable=too-many-arguments
+    def __init__(self, latencies, errors, statuses, pods, connections,
+                 elapsed):
+        ''' Initialization method
+            Positional Arguments:
+                latencies: Seconds each successful request took
+                errors: Number of requests which failed or were not a 200
+                statuses: collections.Counter of HTTP status codes
+                pods: collections.Counter of requests per backend pod
+                connections: connection_timings of each new connection
+                elapsed: Wall-clock seconds the probe took
+        '''
+        self._latencies = sorted(latencies)
+        self._errors = errors
+        self._statuses = statuses
+        self._pods = pods
+        self._connections = connections
+        self._elapsed = elapsed
+    @property
+    def requests(self):
+        ''' Return the number of requests made
+        '''
+        return len(self._latencies) + self._errors
+    @property
+    def errors(self):
+        ''' Return the number of failed requests
+        '''
+        return self._errors
+    @property
+    def error_rate(self):
+        ''' Return the fraction of requests which failed
+        '''
+        return float(self._errors) / self.requests if self.requests else 1.0
+    @property
+    def rate(self):
+        ''' Return the requests made per second
+        '''
+        return self.requests / self._elapsed if self._elapsed else 0.0
+    @property
+    def pods(self):
+        ''' Return the number of requests answered by each backend pod
+        '''
+        return dict(self._pods)
+    def latency(self):
+        ''' Return the latency percentiles of successful requests
+        '''
+        latency = {k: percentile(self._latencies, v) for k, v in QUANTILES}
+        latency['max'] = self._latencies[-1] if self._latencies else None
+        return latency
+    def connection(self):
+        ''' Return the median seconds of each step of a new connection
+        '''
+        steps = {}
+        for step in STEPS:
+            samples = sorted(i[step] for i in self._connections if step in i)
+            if samples:
+                steps[step] = percentile(samples, 50)
+        return steps
+    def record(self):
+        ''' Return a machine-readable record of the result
+        '''
+        def rounded(values):
+            ''' Round the seconds in a dictionary
+            '''
+            return {k: v if v is None else round(v, 4)
+                    for k, v in values.items()}
+        return {'requests': self.requests,
+                'errors': self._errors,
+                'error_rate': round(self.error_rate, 4),
+                'requests_per_second': round(self.rate, 2),
+                'seconds': round(self._elapsed, 3),
+                'latency': rounded(self.latency()),
+                'connection': rounded(self.connection()),
+                'statuses': {str(k): v for k, v in self._statuses.items()},
+                'pods': self.pods}
+    def summary(self):
+        ''' Return a one-line description of the result
+        '''
+        p99 = self.latency()['p99']
+        return ('%d requests at %.1f/s, p99 %s, %.1f%% errors, %d pod(s) '
+                'answered' % (self.requests,
+                              self.rate,
+                              '%.0fms' % (p99 * 1000) if p99 is not None
+                              else 'n/a',
+                              self.error_rate * 100,
+                              len(self._pods)))
+    def send(self, dd_client, cluster):
+        ''' Queue the result as metrics on a dd.DDBatchClient
+        '''
+        tags = ['k8s_cluster:%s' % cluster]
+        for name, seconds in self.latency().items():
+            if seconds is not None:
+                dd_client.send_metric(LATENCY_METRIC,
+                                      seconds,
+                                      tags=tags + ['quantile:%s' % name])
+        for step, seconds in self.connection().items():
+            dd_client.send_metric(CONNECTION_METRIC,
+                                  seconds,
+                                  tags=tags + ['step:%s' % step])
+        dd_client.send_metric(RATE_METRIC, self.rate, tags=tags)
+        dd_client.send_metric(ERROR_METRIC, self.error_rate, tags=tags)
+
+class LoadProbe(object):
+    ''' Concurrent keep-alive HTTP load against one URL
+    '''
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 url,
+                 concurrency=defaults.LOAD_CONCURRENCY,
+                 duration=defaults.LOAD_DURATION,
+                 requests_total=None,
+                 pod_header=defaults.POD_HEADER,
+                 clock=time.monotonic):
+        ''' Initialization method
+            Positional Arguments:
+                url: URL to send GET requests to
+            Keyword Arguments:
+                concurrency: Number of connections, each used by one worker
+                duration: Seconds to keep sending requests for
+                requests_total: Stop after this many requests, if sooner
+                pod_header: Response header naming the pod which answered
+                clock: Monotonic clock, for testing
+        '''
+        self._url = url
+        self._concurrency = max(1, int(concurrency))
+        self._duration = duration
+        self._requests_total = requests_total
+        self._pod_header = pod_header
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._issued = 0
+        self._deadline = None
+    @property
+    def url(self):
+        ''' Return the URL under load
+        '''
+        return self._url
+    def _next(self):
+        ''' Return whether a worker should send another request
+        '''
+        with self._lock:
+            if self._clock() >= self._deadline:
+                return False
+            if self._requests_total and self._issued >= self._requests_total:
+                return False
+            self._issued += 1
+            return True
+    def _worker(self):
+        ''' Time a new connection, then send requests over one keep-alive
+            connection until the probe is over. Returns (latencies, errors,
+            statuses, pods, connection timings).
+        '''
+        latencies, errors = [], 0
+        statuses, pods = collections.Counter(), collections.Counter()
+        try:
+            timings = connection_timings(self._url)
+        except (OSError, ssl.SSLError) as err:
+            LOGGER.info('Unable to time a connection to %s: %s',
+                        self._url,
+                        err)
+            timings = {}
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        with session:
+            while self._next():
+                started = self._clock()
+                try:
+                    response = session.get(self._url, timeout=REQUEST_TIMEOUT)
+                except requests.exceptions.RequestException as err:
+                    LOGGER.info('Load probe request to %s failed: %s',
+                                self._url,
+                                err)
+                    errors += 1
+                    continue
+                seconds = self._clock() - started
+                statuses[response.status_code] += 1
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+                latencies.append(seconds)
+                pod = response.headers.get(self._pod_header or '')
+                if pod:
+                    pods[pod] += 1
+        return latencies, errors, statuses, pods, timings
+    def run(self):
+        ''' Send requests from every worker at once until the duration is up
+            or the request count is reached, and return a LoadResult
+        '''
+        LOGGER.info('Probing %s with %d connections for %ss',
+                    self._url,
+                    self._concurrency,
+                    self._duration)
+        started = self._clock()
+        self._deadline = started + self._duration
+        self._issued = 0
+        latencies, errors = [], 0
+        statuses, pods = collections.Counter(), collections.Counter()
+        connections = []
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._concurrency,
+                thread_name_prefix='load') as pool:
+            futures = [pool.submit(trace.bind(self._worker))
+                       for _ in range(self._concurrency)]
+            for future in concurrent.futures.as_completed(futures):
+                worker = future.result()
+                latencies += worker[0]
+                errors += worker[1]
+                statuses.update(worker[2])
+                pods.update(worker[3])
+                if worker[4]:
+                    connections.append(worker[4])
+        return LoadResult(latencies,
+                          errors,
+                          statuses,
+                          pods,
+                          connections,
+                          self._clock() - started)
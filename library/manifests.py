@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+''' Render the manifests for the check's test workload (a Deployment and the
+    LoadBalancer Service in front of it) in memory
+'''
+
+import hashlib
+import json
+import uuid
+from library import defaults
+import yaml
+
+# Annotation holding the hash of the manifest an object was created from, so
+# a persistent canary can tell whether what is on the cluster has drifted
+SPEC_HASH = 'end2end-k8s/spec-hash'
+# Label holding the ID of the run which created an object
+RUN_LABEL = 'end2end-k8s/run'
+
+def run_id():
+    ''' Return a new, short ID for one run of a check
+    '''
+    return uuid.uuid4().hex[:8]
+
+def spec_hash(manifest):
+    ''' Return a short, stable hash of a manifest, ignoring SPEC_HASH itself
+    '''
+    manifest = dict(manifest)
+    metadata = dict(manifest.get('metadata') or {})
+    annotations = dict(metadata.get('annotations') or {})
+    annotations.pop(SPEC_HASH, None)
+    metadata['annotations'] = annotations
+    manifest['metadata'] = metadata
+    text = json.dumps(manifest, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+def annotate(manifest):
+    ''' Return a copy of a manifest with its SPEC_HASH annotation set
+    '''
+    manifest = dict(manifest)
+    metadata = dict(manifest['metadata'])
+    metadata['annotations'] = dict(metadata.get('annotations') or {},
+                                   **{SPEC_HASH: spec_hash(manifest)})
+    manifest['metadata'] = metadata
+    return manifest
+
+def essentials(obj):
+    ''' Return the parts of a Deployment or Service which matter to the check
+        and which the API server leaves as they were given, so a manifest and
+        the live object made from it can be compared directly
+    '''
+    spec = obj.get('spec') or {}
+    if obj.get('kind') == 'Deployment':
+        template = spec.get('template') or {}
+        return (spec.get('replicas'),
+                ((template.get('metadata') or {}).get('labels')),
+                [(i.get('image'),
+                  [j.get('containerPort') for j in i.get('ports') or []],
+                  i.get('command'))
+                 for i in (template.get('spec') or {}).get('containers') or
+                 []])
+    return (spec.get('type'),
+            spec.get('selector'),
+            [i.get('port') for i in spec.get('ports') or []])
+
+def drifted(manifest, live):
+    ''' Return whether a live object (as returned by the API) was not created
+        from manifest, or has since been edited where it matters
+    '''
+    annotations = (live.get('metadata') or {}).get('annotations') or {}
+    return (annotations.get(SPEC_HASH) != spec_hash(manifest) or
+            essentials(live) != essentials(manifest))
+
+def render(objects):
+    ''' Return manifests as one multi-document YAML string, suitable for
+        "kubectl create -f -"
+    '''
+    return yaml.safe_dump_all(objects, default_flow_style=False)
+
+class Workload(object):
+    ''' The Deployment and Service created, checked and deleted by a check,
+        and optionally a Namespace of their own
+    '''
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 name=defaults.WORKLOAD['name'],
+                 namespace=defaults.WORKLOAD['namespace'],
+                 image=defaults.WORKLOAD['image'],
+                 replicas=defaults.WORKLOAD['replicas'],
+                 port=defaults.WORKLOAD['port'],
+                 labels=None,
+                 pod_header=None,
+                 run_id=None,
+                 own_namespace=False):
+        ''' Initialization method
+            Keyword Arguments:
+                name: Name of the Deployment and Service, also used as their
+                      "name" label
+                namespace: Namespace to create them in
+                image: Container image the Deployment runs; it must serve
+                       HTTP on port
+                replicas: Number of pods behind the Service
+                port: Port the containers listen on and the Service exposes
+                labels: Labels added to both objects, besides "name" and
+                        defaults.MANAGED_LABEL
+                pod_header: Response header nginx names the answering pod
+                            in, for the load probe. None (the default) to
+                            run the image as it is.
+                run_id: ID of the run the workload belongs to (see run_id()).
+                        It is appended to name and set as RUN_LABEL, so
+                        several runs can check one cluster at once.
+                own_namespace: Create the Deployment and Service in a
+                               Namespace of their own, named like them,
+                               instead of in namespace. Deleting it deletes
+                               everything.
+        '''
+        if int(replicas) < 1:
+            raise ValueError('A workload needs at least one replica')
+        self._name = '%s-%s' % (name, run_id) if run_id else name
+        self._namespace = self._name if own_namespace else namespace
+        self._run_id = run_id
+        self._own_namespace = own_namespace
+        self._image = image
+        self._replicas = int(replicas)
+        self._port = int(port)
+        self._labels = dict(labels or {})
+        self._pod_header = pod_header
+    @property
+    def name(self):
+        ''' Return the name of the Deployment and Service
+        '''
+        return self._name
+    @property
+    def namespace(self):
+        ''' Return the namespace of the Deployment and Service
+        '''
+        return self._namespace
+    @property
+    def run_id(self):
+        ''' Return the ID of the run the workload belongs to, if any
+        '''
+        return self._run_id
+    @property
+    def own_namespace(self):
+        ''' Return whether the workload has a Namespace of its own
+        '''
+        return self._own_namespace
+    @property
+    def image(self):
+        ''' Return the container image
+        '''
+        return self._image
+    @property
+    def replicas(self):
+        ''' Return the number of replicas
+        '''
+        return self._replicas
+    @property
+    def port(self):
+        ''' Return the port served
+        '''
+        return self._port
+    @property
+    def pod_header(self):
+        ''' Return the response header naming the answering pod, if any
+        '''
+        return self._pod_header
+    @property
+    def labels(self):
+        ''' Return the labels of both objects
+        '''
+        labels = dict(self._labels)
+        labels.update([defaults.MANAGED_LABEL, ('name', self._name)])
+        if self._run_id:
+            labels[RUN_LABEL] = self._run_id
+        return labels
+    def _metadata(self):
+        ''' Return the metadata shared by both objects
+        '''
+        return {'name': self._name,
+                'namespace': self._namespace,
+                'labels': self.labels}
+    def namespace_object(self):
+        ''' Return the manifest of the workload's own Namespace as a
+            dictionary
+        '''
+        return {'apiVersion': 'v1',
+                'kind': 'Namespace',
+                'metadata': {'name': self._namespace,
+                             'labels': self.labels}}
+    def container(self):
+        ''' Return the nginx container. With a pod_header, a configuration
+            file adding it to every response is written before nginx starts,
+            so the stock image can be used.
+        '''
+        container = {'name': 'nginx',
+                     'image': self._image,
+                     'ports': [{'containerPort': self._port}]}
+        if self._pod_header:
+            container['command'] = [
+                'sh', '-c',
+                "echo 'add_header %s $hostname always;' > "
+                "/etc/nginx/conf.d/end2end-pod.conf && "
+                "exec nginx -g 'daemon off;'" % self._pod_header]
+        return container
+    def deployment(self):
+        ''' Return the Deployment manifest as a dictionary
+        '''
+        return {'apiVersion': 'extensions/v1beta1',
+                'kind': 'Deployment',
+                'metadata': self._metadata(),
+                'spec': {'replicas': self._replicas,
+                         'template': {
+                             'metadata': {'labels': {'name': self._name}},
+                             'spec': {'containers': [self.container()]}}}}
+    def service(self):
+        ''' Return the Service manifest as a dictionary
+        '''
+        return {'apiVersion': 'v1',
+                'kind': 'Service',
+                'metadata': self._metadata(),
+                'spec': {'type': 'LoadBalancer',
+                         'ports': [{'port': self._port}],
+                         'selector': {'name': self._name}}}
+    def objects(self):
+        ''' Return every manifest, annotated with its hash, in the order they
+            should be created
+        '''
+        objects = [annotate(self.deployment()), annotate(self.service())]
+        if self._own_namespace:
+            objects.insert(0, annotate(self.namespace_object()))
+        return objects
+    def teardown_objects(self):
+        ''' Return the manifests which have to be deleted to delete
+            everything: just the Namespace, if the workload has its own
+        '''
+        if self._own_namespace:
+            return [self.namespace_object()]
+        return self.objects()
+    def render(self):
+        ''' Return every manifest as one multi-document YAML string
+        '''
+        return render(self.objects())
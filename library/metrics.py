@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+''' In-process record of check results, rendered in the Prometheus text
+    exposition format
+'''
+
+import bisect
+import collections
+import logging
+import threading
+import time
+from library import defaults
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+PREFIX = 'end2end_k8s'
+# Upper bounds, in seconds, of the duration histogram buckets. Checks take
+# from a few seconds to the full LoadBalancer timeout; phases can be quicker.
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 180, 300)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Quantile label of each load probe latency figure
+LOAD_QUANTILES = {'p50': '0.5', 'p95': '0.95', 'p99': '0.99', 'max': '1'}
+
+def escape(value):
+    ''' Escape a label value for the text exposition format
+    '''
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+def labels(**kwargs):
+    ''' Render label names and values as {name="value",...}, sorted by name
+    '''
+    if not kwargs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, escape(v))
+                             for k, v in sorted(kwargs.items()))
+
+def number(value):
+    ''' Render a sample value
+    '''
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram(object):
+    ''' Cumulative histogram of observed values
+    '''
+    def __init__(self, buckets=BUCKETS):
+        ''' Initialization method
+            Keyword Arguments:
+                buckets: Sorted upper bounds of the buckets
+        '''
+        self._bounds = tuple(buckets)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+    def observe(self, value):
+        ''' Count a value
+        '''
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self._sum += value
+    @property
+    def count(self):
+        ''' Return how many values were observed
+        '''
+        return sum(self._counts)
+    @property
+    def total(self):
+        ''' Return the sum of the observed values
+        '''
+        return self._sum
+    def samples(self, name, **kwargs):
+        ''' Return the exposition lines for the histogram
+        '''
+        lines = []
+        running = 0
+        for bound, count in zip(self._bounds + (float('inf'),), self._counts):
+            running += count
+            lines.append('%s_bucket%s %s' % (name,
+                                             labels(le=number(bound), **kwargs),
+                                             running))
+        lines.append('%s_sum%s %s' % (name, labels(**kwargs),
+                                      number(self._sum)))
+        lines.append('%s_count%s %s' % (name, labels(**kwargs), running))
+        return lines
+
+class CheckMetrics(object):
+    ''' Status and latency of the checks run against each cluster
+    '''
+    def __init__(self, buckets=BUCKETS, clock=time.time):
+        ''' Initialization method
+            Keyword Arguments:
+                buckets: Upper bounds of the duration histogram buckets
+                clock: Wall clock, for testing
+        '''
+        self._buckets = buckets
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._clusters = set()
+        self._running = set()
+        self._up = {}
+        self._last_run = {}
+        self._totals = collections.Counter()
+        self._durations = {}
+        self._phases = {}
+        self._load = {}
+        self._reloads = 0
+    def set_clusters(self, clusters):
+        ''' Set the clusters being checked, forgetting everything recorded
+            for clusters which are no longer among them
+        '''
+        with self._lock:
+            self._clusters = set(clusters)
+            for table in (self._up, self._last_run, self._durations,
+                          self._load):
+                for cluster in list(table):
+                    if cluster not in self._clusters:
+                        del table[cluster]
+            for key in list(self._totals):
+                if key[0] not in self._clusters:
+                    del self._totals[key]
+            for key in list(self._phases):
+                if key[0] not in self._clusters:
+                    del self._phases[key]
+    def reloaded(self):
+        ''' Count a reload of the configuration
+        '''
+        with self._lock:
+            self._reloads += 1
+    def started(self, cluster):
+        ''' Record that a check of a cluster started
+        '''
+        with self._lock:
+            self._running.add(cluster)
+    def record(self, result):
+        ''' Record the outcome of a check (a check.CheckResult)
+        '''
+        cluster = result.cluster
+        with self._lock:
+            self._running.discard(cluster)
+            if cluster not in self._clusters:
+                return
+            self._up[cluster] = 1 if result.ok else 0
+            self._last_run[cluster] = self._clock()
+            self._totals[(cluster, 'pass' if result.ok else 'fail')] += 1
+            (self._durations
+             .setdefault(cluster, Histogram(self._buckets))
+             .observe(result.elapsed))
+            phases = result.timer.phases if result.timer else {}
+            for phase, seconds in phases.items():
+                (self._phases
+                 .setdefault((cluster, phase), Histogram(self._buckets))
+                 .observe(seconds))
+            if result.load:
+                self._load[cluster] = result.load
+            else:
+                self._load.pop(cluster, None)
+    @staticmethod
+    def _family(name, kind, text):
+        ''' Return the HELP and TYPE lines of a metric family
+        '''
+        return ['# HELP %s_%s %s' % (PREFIX, name, text),
+                '# TYPE %s_%s %s' % (PREFIX, name, kind)]
+    def _load_lines(self):
+        ''' Return the results of the last load probe of each cluster
+        '''
+        lines = self._family('load_latency_seconds', 'gauge',
+                             'Latency of the last load probe, by quantile')
+        for cluster, load in sorted(self._load.items()):
+            lines += ['%s_load_latency_seconds%s %s'
+                      % (PREFIX,
+                         labels(cluster=cluster,
+                                quantile=LOAD_QUANTILES[name]),
+                         number(seconds))
+                      for name, seconds in sorted(load.latency().items())
+                      if seconds is not None]
+        lines += self._family('load_requests_per_second', 'gauge',
+                              'Requests per second the last load probe made')
+        lines += ['%s_load_requests_per_second%s %s'
+                  % (PREFIX, labels(cluster=k), number(v.rate))
+                  for k, v in sorted(self._load.items())]
+        lines += self._family('load_error_ratio', 'gauge',
+                              'Fraction of the last load probe\'s requests \
+which failed')
+        lines += ['%s_load_error_ratio%s %s'
+                  % (PREFIX, labels(cluster=k), number(v.error_rate))
+                  for k, v in sorted(self._load.items())]
+        return lines
+    def render(self):
+        ''' Return every metric in the Prometheus text exposition format
+        '''
+        with self._lock:
+            lines = self._family('clusters', 'gauge',
+                                 'Clusters being checked')
+            lines.append('%s_clusters %s' % (PREFIX, len(self._clusters)))
+            lines += self._family('config_reloads_total', 'counter',
+                                  'Times the configuration was reloaded')
+            lines.append('%s_config_reloads_total %s' % (PREFIX,
+                                                         self._reloads))
+            lines += self._family('check_running', 'gauge',
+                                  'Whether a check of the cluster is running')
+            lines += ['%s_check_running%s %s'
+                      % (PREFIX, labels(cluster=i), int(i in self._running))
+                      for i in sorted(self._clusters)]
+            lines += self._family('check_up', 'gauge',
+                                  'Whether the last check of the cluster \
+passed')
+            lines += ['%s_check_up%s %s' % (PREFIX, labels(cluster=k), v)
+                      for k, v in sorted(self._up.items())]
+            lines += self._family('check_last_run_timestamp_seconds', 'gauge',
+                                  'When the last check of the cluster \
+finished')
+            lines += ['%s_check_last_run_timestamp_seconds%s %s'
+                      % (PREFIX, labels(cluster=k), number(v))
+                      for k, v in sorted(self._last_run.items())]
+            lines += self._family('checks_total', 'counter',
+                                  'Checks finished, by result')
+            lines += ['%s_checks_total%s %s'
+                      % (PREFIX, labels(cluster=k[0], result=k[1]), v)
+                      for k, v in sorted(self._totals.items())]
+            lines += self._family('check_duration_seconds', 'histogram',
+                                  'How long checks took')
+            for cluster, histogram in sorted(self._durations.items()):
+                lines += histogram.samples('%s_check_duration_seconds'
+                                           % PREFIX,
+                                           cluster=cluster)
+            lines += self._family('phase_duration_seconds', 'histogram',
+                                  'How long each phase of a check took')
+            for (cluster, phase), histogram in sorted(self._phases.items()):
+                lines += histogram.samples('%s_phase_duration_seconds'
+                                           % PREFIX,
+                                           cluster=cluster,
+                                           phase=phase)
+            lines += self._load_lines()
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+''' Run the stages of a check at the same time, stopping all of them as soon
+    as one fails
+'''
+
+import concurrent.futures
+import logging
+import threading
+from library import defaults
+from library import trace
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+
+class PipelineAbortedError(Exception):
+    ''' Error raised inside a stage which was told to stop because another
+        stage failed
+    '''
+    pass
+
+class Abort(object):
+    ''' Flag shared by the stages of a pipeline, and a sleep which wakes up
+        and raises as soon as it is set
+    '''
+    def __init__(self):
+        ''' Initialization method
+        '''
+        self._event = threading.Event()
+        self._reason = None
+    @property
+    def reason(self):
+        ''' Return the error which caused the abort, if there was one
+        '''
+        return self._reason
+    def is_set(self):
+        ''' Return whether the stages should stop
+        '''
+        return self._event.is_set()
+    def set(self, reason=None):
+        ''' Tell every stage to stop
+        '''
+        self._reason = self._reason or reason
+        self._event.set()
+    def check(self):
+        ''' Raise PipelineAbortedError if the stages should stop
+        '''
+        if self._event.is_set():
+            raise PipelineAbortedError('Stopped because another stage \
+failed: %s' % self._reason)
+    def sleep(self, seconds):
+        ''' Sleep, for use as a retry.Retry sleep, unless or until the stages
+            should stop
+        '''
+        self._event.wait(seconds)
+        self.check()
+
+def run_stages(stages, abort=None):
+    ''' Run stages concurrently and return {name: result} once they have all
+        returned. The first stage to raise sets abort and its error is raised
+        straight away; the other stages are left to notice abort and stop on
+        their own.
+        Positional Arguments:
+            stages: List of (name, function) pairs. Functions take no
+                    arguments and should call abort.check() or sleep with
+                    abort.sleep() while they wait.
+        Keyword Arguments:
+            abort: Abort shared with the stages
+        Stages are traced with the caller's trace attributes.
+    '''
+    abort = abort or Abort()
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(stages),
+                                                 thread_name_prefix='stage')
+    futures = {pool.submit(trace.bind(func)): name for name, func in stages}
+    results = {}
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except BaseException as err:
+                LOGGER.info('Stage "%s" failed, stopping the others: %s',
+                            name,
+                            err)
+                abort.set(err)
+                raise
+            LOGGER.info('Stage "%s" finished', name)
+        return results
+    finally:
+        pool.shutdown(wait=False)
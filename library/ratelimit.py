@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+''' Token-bucket rate limiting, keyed so that each account gets its own budget
+'''
+
+import threading
+import time
+from library import defaults
+from library import trace
+
+# Float slack, so a refill landing a hair under a whole token still counts
+EPSILON = 1e-9
+
+class TokenBucket(object):
+    ''' Allow bursts of up to capacity calls, refilled at rate per second
+    '''
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        ''' Initialization method
+            Positional Arguments:
+                rate: Tokens added per second
+                capacity: Most tokens the bucket holds, i.e. the largest burst
+            Keyword Arguments:
+                clock: Monotonic clock, for testing
+                sleep: Sleep function, for testing
+        '''
+        if rate <= 0 or capacity < 1:
+            raise ValueError('Token bucket needs a positive rate and capacity')
+        self._rate = float(rate)
+        self._capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+    def _refill(self):
+        ''' Add the tokens earned since the last refill
+        '''
+        now = self._clock()
+        self._tokens = min(self._capacity,
+                           self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+    def acquire(self):
+        ''' Take a token, waiting until one is available. Return the seconds
+            spent waiting.
+        '''
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1 - EPSILON:
+                    self._tokens = max(0.0, self._tokens - 1)
+                    return waited
+                wait = (1 - self._tokens) / self._rate
+            with trace.span('sleep', 'ratelimit'):
+                self._sleep(wait)
+            waited += wait
+
+class RateLimiter(object):
+    ''' A TokenBucket per key, created on first use
+    '''
+    def __init__(self,
+                 rate=defaults.AWS_RATE,
+                 capacity=defaults.AWS_BURST,
+                 **kwargs):
+        ''' Initialization method
+            Keyword Arguments:
+                rate: Tokens added per second to each key's bucket
+                capacity: Largest burst for each key
+            Any other keyword arguments are passed on to TokenBucket
+        '''
+        self._rate = rate
+        self._capacity = capacity
+        self._kwargs = kwargs
+        self._buckets = {}
+        self._lock = threading.Lock()
+    def bucket(self, key):
+        ''' Return the bucket for a key
+        '''
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self._rate,
+                                                 self._capacity,
+                                                 **self._kwargs)
+            return self._buckets[key]
+    def acquire(self, key):
+        ''' Take a token from a key's bucket, waiting if necessary
+        '''
+        return self.bucket(key).acquire()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+''' Retry a callable with a configurable backoff strategy until a monotonic
+    deadline passes
+'''
+
+import itertools
+import logging
+import random
+import time
+from library import defaults
+from library import trace
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+
+class RetryError(Exception):
+    ''' Custom retry error
+    '''
+    def __init__(self, *args, **kwargs):
+        ''' Initialization method
+        '''
+        Exception.__init__(self, *args, **kwargs)
+class RetryTimeoutError(RetryError):
+    ''' Custom retry error for running out of time. The exception raised by
+        the final attempt is kept as last_error.
+    '''
+    def __init__(self, message, last_error=None, attempts=0):
+        ''' Initialization method
+        '''
+        RetryError.__init__(self, message)
+        self.last_error = last_error
+        self.attempts = attempts
+
+class Fixed(object):
+    ''' Wait the same interval between every attempt
+    '''
+    def __init__(self, interval=10):
+        ''' Initialization method
+            Keyword Arguments:
+                interval: Seconds between attempts
+        '''
+        self._interval = interval
+    def delays(self):
+        ''' Return an iterator of seconds to wait before each retry
+        '''
+        return itertools.repeat(self._interval)
+
+class Exponential(object):
+    ''' Double (or multiply by factor) the wait after every attempt, up to a
+        cap, with "full jitter" so many pollers do not retry in lockstep
+    '''
+    # pylint: disable=too-many-arguments
+    def __init__(self, base=1, factor=2, cap=30, jitter=True, rand=None):
+        ''' Initialization method
+            Keyword Arguments:
+                base: Seconds to wait before the first retry
+                factor: Multiplier applied after every retry
+                cap: Maximum seconds to wait between attempts
+                jitter: Wait a random time up to the computed delay
+                rand: Source of random floats in [0, 1), for testing
+        '''
+        self._base = base
+        self._factor = factor
+        self._cap = cap
+        self._jitter = jitter
+        self._rand = rand or random.random
+    def delays(self):
+        ''' Return an iterator of seconds to wait before each retry
+        '''
+        for attempt in itertools.count():
+            delay = min(self._cap, self._base * self._factor ** attempt)
+            yield delay * self._rand() if self._jitter else delay
+
+class FastThenSlow(object):
+    ''' Poll quickly while the thing we wait for is likely to appear soon,
+        then back off to a slow interval
+    '''
+    def __init__(self, fast=2, fast_for=30, slow=10):
+        ''' Initialization method
+            Keyword Arguments:
+                fast: Seconds between attempts at first
+                fast_for: Seconds of fast polling before slowing down
+                slow: Seconds between attempts afterwards
+        '''
+        self._fast = fast
+        self._fast_for = fast_for
+        self._slow = slow
+    def delays(self):
+        ''' Return an iterator of seconds to wait before each retry
+        '''
+        waited = 0
+        while waited < self._fast_for:
+            waited += self._fast
+            yield self._fast
+        while True:
+            yield self._slow
+
+STRATEGIES = {'fixed': Fixed,
+              'exponential': Exponential,
+              'fast-then-slow': FastThenSlow}
+
+def strategy_from_str(name, **kwargs):
+    ''' Return a strategy instance by name, as given on the command line
+    '''
+    try:
+        return STRATEGIES[name](**kwargs)
+    except KeyError:
+        raise ValueError('Unknown retry strategy "%s"' % name)
+
+# pylint: disable=too-few-public-methods
+class Retry(object):
+    ''' Call something until it stops raising the errors we expect while
+        waiting, or until the deadline passes
+    '''
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 timeout,
+                 strategy=None,
+                 retry_on=(Exception,),
+                 on_attempt=None,
+                 clock=time.monotonic,
+                 sleep=time.sleep):
+        ''' Initialization method
+            Positional Arguments:
+                timeout: Seconds, measured on a monotonic clock from the first
+                         attempt, after which to give up. Time spent inside
+                         the attempts counts.
+            Keyword Arguments:
+                strategy: Object whose delays() gives the waits between
+                          attempts. Defaults to Fixed().
+                retry_on: Exception types which mean "not yet"; anything else
+                          is raised immediately
+                on_attempt: Called after every failed attempt as
+                            on_attempt(attempt, elapsed, error, delay)
+                clock: Monotonic clock, for testing
+                sleep: Sleep function, for testing
+        '''
+        self._timeout = timeout
+        self._strategy = strategy or Fixed()
+        self._retry_on = retry_on
+        self._on_attempt = on_attempt
+        self._clock = clock
+        self._sleep = sleep
+    def call(self, func, *args, **kwargs):
+        ''' Call func(*args, **kwargs) until it returns, and return its
+            result. Each wait between attempts is traced as a "sleep" span.
+        '''
+        started = self._clock()
+        deadline = started + self._timeout
+        delays = self._strategy.delays()
+        for attempt in itertools.count(1):
+            try:
+                return func(*args, **kwargs)
+            except self._retry_on as error:
+                now = self._clock()
+                if now >= deadline:
+                    raise RetryTimeoutError('Gave up after %s attempts in \
+%.1fs: %s' % (attempt, now - started, error),
+                                            last_error=error,
+                                            attempts=attempt)
+                delay = min(next(delays), deadline - now)
+                if self._on_attempt:
+                    self._on_attempt(attempt, now - started, error, delay)
+                else:
+                    LOGGER.info('Attempt %s failed (%s). Retrying in %.1fs...',
+                                attempt, error, delay)
+                with trace.span('sleep', 'retry', attempt=attempt,
+                                error=str(error)):
+                    self._sleep(delay)
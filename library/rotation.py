@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+''' Rotate many secret instances concurrently, within per-account AWS rate
+    limits, updating each cluster once
+'''
+
+import concurrent.futures
+import logging
+import time
+from library import defaults, secret, trace
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+
+# pylint: disable=too-few-public-methods
+class RotationResult(object):
+    ''' Outcome of rotating one instance of a secret
+    '''
+    def __init__(self, secret, instance, error, elapsed):
+        ''' Initialization method
+            Positional Arguments:
+                secret: Name of the secret
+                instance: The instance's configuration from the secrets map
+                error: The exception raised while rotating, or None
+                elapsed: Seconds the rotation took
+        '''
+        self.secret = secret
+        self.instance = instance
+        self.error = error
+        self.elapsed = elapsed
+    @property
+    def ok(self):
+        ''' Return whether or not the rotation succeeded
+        '''
+        # pylint: disable=invalid-name
+        return self.error is None
+    def record(self):
+        ''' Return a machine-readable record of the result
+        '''
+        return {'secret': self.secret,
+                'cluster': self.instance.get('cluster'),
+                'namespace': self.instance.get('namespace'),
+                'aws_keys': self.instance.get('aws_keys'),
+                'ok': self.ok,
+                'error': ('%s: %s' % (type(self.error).__name__, self.error)
+                          if self.error else None),
+                'seconds': round(self.elapsed, 3)}
+
+class RotationScheduler(object):
+    ''' Rotate every instance of a set of secrets on a bounded thread pool
+    '''
+    def __init__(self, secrets, concurrency=defaults.ROTATION_CONCURRENCY):
+        ''' Initialization method
+            Positional Arguments:
+                secrets: List of secret.SharedSecret objects. Give them a
+                         shared ratelimit.RateLimiter to keep AWS calls for
+                         each aws_keys within budget.
+            Keyword Arguments:
+                concurrency: Maximum number of instances rotated at once
+        '''
+        self._secrets = list(secrets)
+        self._concurrency = max(1, concurrency)
+        self._elapsed = None
+        self._results = []
+    @property
+    def results(self):
+        ''' Return the results of the last run
+        '''
+        return self._results
+    @staticmethod
+    def _prepare_one(the_secret, instance):
+        ''' Refresh the AWS side of one instance, returning (content, error,
+            elapsed)
+        '''
+        started = time.monotonic()
+        try:
+            with trace.attributes(cluster=instance.get('cluster'),
+                                  phase='prepare'), \
+                    trace.span('prepare', 'phase', secret=the_secret.name):
+                content = the_secret.prepare(instance)
+            return content, None, time.monotonic() - started
+        # One failed instance must not stop the others being rotated
+        # pylint: disable=broad-except
+        except Exception as err:
+            LOGGER.exception('Unable to refresh secret "%s" for cluster "%s", \
+namespace "%s"', the_secret.name, instance.get('cluster'),
+                             instance.get('namespace'))
+            return None, err, time.monotonic() - started
+    def run(self):
+        ''' Rotate everything and return the results in secrets map order.
+            The AWS side of every instance is refreshed first; then each
+            cluster gets all of its secrets in one update (see
+            secret.apply_secrets, which is best effort, not atomic).
+        '''
+        started = time.monotonic()
+        jobs = [(i, j) for i in self._secrets for j in i.instances]
+        workers = min(self._concurrency, len(jobs)) or 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self._prepare_one, the_secret, instance)
+                       for the_secret, instance in jobs]
+            prepared = [i.result() for i in futures]
+            applied = secret.apply_secrets(
+                [(instance['cluster'],
+                  the_secret.kubeconfig,
+                  the_secret.manifest(instance, content))
+                 for (the_secret, instance), (content, error, _)
+                 in zip(jobs, prepared) if error is None],
+                pool)
+        self._results = []
+        for (the_secret, instance), (_, error, elapsed) in zip(jobs, prepared):
+            if error is None:
+                error, apply_elapsed = applied[(instance['cluster'],
+                                                the_secret.kubeconfig)]
+                elapsed += apply_elapsed
+            self._results.append(RotationResult(the_secret.name,
+                                                instance,
+                                                error,
+                                                elapsed))
+        self._elapsed = time.monotonic() - started
+        return self._results
+    def summary(self):
+        ''' Return a machine-readable summary of the last run
+        '''
+        failed = [i for i in self._results if not i.ok]
+        return {'total': len(self._results),
+                'passed': len(self._results) - len(failed),
+                'failed': len(failed),
+                'seconds': round(self._elapsed or 0, 3)}
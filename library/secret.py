@@ -4,10 +4,18 @@
 import logging
 import abc
 import base64
+import collections
+import concurrent.futures
+import hashlib
+import json
 import os
-from library import defaults, k8s
+import re
+import threading
+import time
+from library import defaults, k8s, trace
 import boto3
 import botocore
+import yaml
 
 LOGGER = logging.getLogger(defaults.LOGGER)
 K8S_SECRET = '''apiVersion: v1
@@ -20,6 +28,146 @@ data:
   {key}: {content}'''
 
 SECRETS_BYTES = 256
+# kubectl's complaint about one document of a replace which does not exist yet
+SECRET_NOT_FOUND = re.compile(r'''secrets? "([^"]+)" not found''')
+SECRET_EXISTS = re.compile(r'''secrets? "([^"]+)" already exists''')
+# boto3 sessions per credential fingerprint and clients per (service,
+# fingerprint), shared by every secret. Sessions are not thread-safe, so they
+# are only touched under the lock; the clients they make are.
+_BOTO_SESSIONS = {}
+_BOTO_CLIENTS = {}
+_BOTO_LOCK = threading.Lock()
+
+def _aws_call_started(model, context, **_):
+    ''' Note when a boto3 call starts, so it can be traced
+    '''
+    context['trace_name'] = '%s %s' % (model.service_model.service_name,
+                                       model.name)
+    context['trace_started'] = trace.now()
+
+def _aws_call_finished(context, exception=None, http_response=None, **_):
+    ''' Trace a boto3 call once it has returned or failed
+    '''
+    args = {}
+    if exception is not None:
+        args['error'] = '%s: %s' % (type(exception).__name__, exception)
+    if http_response is not None:
+        args['status'] = http_response.status_code
+    trace.add(context.get('trace_name'),
+              'aws',
+              context.get('trace_started'),
+              **args)
+
+def aws_client(service, creds):
+    ''' Return the shared boto3 client for a service and set of credentials,
+        building it (and loading the service model) only once. Every call
+        made with it is traced.
+        Positional Arguments:
+            service: Name of the AWS service, e.g. "s3"
+            creds: Dictionary which can be passed as **creds to a boto3 client
+    '''
+    fingerprint = (hashlib
+                   .sha256(json.dumps(creds, sort_keys=True).encode('utf-8'))
+                   .hexdigest())
+    with _BOTO_LOCK:
+        client = _BOTO_CLIENTS.get((service, fingerprint))
+        if client is None:
+            if fingerprint not in _BOTO_SESSIONS:
+                _BOTO_SESSIONS[fingerprint] = boto3.session.Session()
+            client = _BOTO_SESSIONS[fingerprint].client(service, **creds)
+            client.meta.events.register('before-call', _aws_call_started)
+            client.meta.events.register('after-call', _aws_call_finished)
+            client.meta.events.register('after-call-error',
+                                        _aws_call_finished)
+            _BOTO_CLIENTS[(service, fingerprint)] = client
+        return client
+
+def _stderr(err):
+    ''' Return the stderr a KubeProcError carries as text
+    '''
+    out = err.args[0] if err.args else ''
+    if isinstance(out, bytes):
+        out = out.decode('utf-8', 'replace')
+    return str(out)
+
+def _unexpected(err, regex):
+    ''' Return the lines of kubectl's stderr which do not match regex
+    '''
+    return [i for i in _stderr(err).splitlines()
+            if i.strip() and not regex.search(i)]
+
+def _apply_cluster(cluster, kubeconfig, manifests):
+    ''' Replace a batch of K8s secrets on one cluster with a single kubectl
+        call, fed from memory. Each secret is swapped in place, so it never
+        goes missing; any which do not exist yet are then created together.
+    '''
+    kube = k8s.JustOKKube(cluster, kubeconfig)
+    LOGGER.info('Replacing %s secret(s) on cluster "%s"',
+                len(manifests),
+                cluster)
+    try:
+        return kube.run_raw('replace -f -', '\n---\n'.join(manifests))
+    except k8s.KubeProcError as err:
+        missing = set(SECRET_NOT_FOUND.findall(_stderr(err)))
+        if not missing or _unexpected(err, SECRET_NOT_FOUND):
+            raise
+    # kubectl only names the missing secrets, so a name in two namespaces is
+    # created in both; the one which was replaced already exists
+    manifests = [i for i in manifests
+                 if yaml.safe_load(i)['metadata']['name'] in missing]
+    LOGGER.info('Creating %s new secret(s) on cluster "%s"',
+                len(manifests),
+                cluster)
+    try:
+        return kube.run_raw('create -f -', '\n---\n'.join(manifests))
+    except k8s.KubeProcError as err:
+        if _unexpected(err, SECRET_EXISTS):
+            raise
+
+def _apply_timed(cluster, kubeconfig, manifests):
+    ''' Apply one cluster's secrets, returning (error, elapsed)
+    '''
+    started = time.monotonic()
+    try:
+        with trace.attributes(cluster=cluster, phase='apply'), \
+                trace.span('apply', 'phase'):
+            _apply_cluster(cluster, kubeconfig, manifests)
+        return None, time.monotonic() - started
+    # One failed cluster must not stop the others being updated
+    # pylint: disable=broad-except
+    except Exception as err:
+        LOGGER.exception('Unable to update secrets on cluster "%s"', cluster)
+        return err, time.monotonic() - started
+
+def apply_secrets(secrets, pool=None):
+    ''' Update K8s secrets on every cluster they are bound for. Each cluster
+        gets all of its secrets in one "kubectl replace -f -", then one
+        "kubectl create -f -" of any which did not exist yet.
+        This is best effort, not atomic: clusters are updated independently,
+        and a cluster whose update fails may be left with some of its secrets
+        replaced and others not. Failures are logged and returned, not
+        raised, so the other clusters are still updated.
+        Positional Arguments:
+            secrets: List of (cluster, kubeconfig, manifest) tuples; see
+                     SharedSecret.manifest()
+        Keyword Arguments:
+            pool: Executor to update the clusters at once with; by default
+                  they are updated one after another
+        Returns an OrderedDict of (error or None, seconds taken) per
+        (cluster, kubeconfig), in the order the clusters were first given.
+    '''
+    clusters = collections.OrderedDict()
+    for cluster, kubeconfig, manifest in secrets:
+        clusters.setdefault((cluster, kubeconfig), []).append(manifest)
+    if pool is None:
+        return collections.OrderedDict(
+            (key, _apply_timed(key[0], key[1], manifests))
+            for key, manifests in clusters.items())
+    futures = collections.OrderedDict(
+        (key, pool.submit(trace.bind(_apply_timed), key[0], key[1], manifests))
+        for key, manifests in clusters.items())
+    return collections.OrderedDict((key, i.result())
+                                   for key, i in futures.items())
 
 def secret_bytes():
     ''' Generate a string from random bytes.
@@ -54,11 +202,13 @@ class SharedSecret(object):
         directly.
     '''
     __metaclass__ = abc.ABCMeta
+    # pylint: disable=too-many-arguments
     def __init__(self,
                  name,
                  secret_maps,
                  aws_keys,
-                 kubeconfig=defaults.KUBECONFIG):
+                 kubeconfig=defaults.KUBECONFIG,
+                 limiter=None):
         ''' Initialization method.
             Positional arguments:
                 name: Name of the secret.
@@ -69,21 +219,52 @@ class SharedSecret(object):
                     should be able to be passed as **val to a boto3 client.
             Keyword arguments:
                 kubeconfig: Path to kubernetes config file.
+                limiter: ratelimit.RateLimiter applied to AWS API calls, keyed
+                    by the instance's aws_keys name
         '''
         self._name = name
         self._instances = secret_maps
         self._keys = aws_keys
         self._kubeconfig = kubeconfig
-    @abc.abstractmethod
+        self._limiter = limiter
+    @property
+    def name(self):
+        ''' Return the name of the secret
+        '''
+        return self._name
+    @property
+    def instances(self):
+        ''' Return the instance configurations of the secret
+        '''
+        return self._instances
+    @property
+    def kubeconfig(self):
+        ''' Return the path of the kubernetes config file
+        '''
+        return self._kubeconfig
     def create(self):
+        ''' Create (refresh) every instance of the secret, then update each
+            cluster once
+        '''
+        LOGGER.info('Refreshing instances for secret "%s"', self._name)
+        self.update_k8s([(i, self.prepare(i)) for i in self._instances])
+    @abc.abstractmethod
+    def prepare(self, instance):
         ''' Abstract method not implemented here, but must be implemented by
-            subclasses. Secrets should be create()able.
+            subclasses. Refresh the AWS side of a single instance of the secret
+            and return the bytes to store in its K8s secret; must be safe to
+            call for several instances at once.
         '''
         pass
-    def update_k8s(self, instance, content):
-        ''' Update the kubernetes cluster with the secret's content.
-            Overridable, but generic enough (if the secrets map is correct)
-            that it should be unnecessary.
+    def throttle(self, instance):
+        ''' Return a function to call before each AWS API call made for an
+            instance, which waits for the instance's aws_keys budget
+        '''
+        if not self._limiter:
+            return lambda: None
+        return lambda: self._limiter.acquire(instance['aws_keys'])
+    def manifest(self, instance, content):
+        ''' Return the K8s secret document for an instance
             Positional Arguments:
                 instance:
                     Dictionary configuration for a copy of a secret, e.g. on a
@@ -93,31 +274,26 @@ class SharedSecret(object):
                     plaintext AWS secret/access keys in INI format
         '''
         content = base64.urlsafe_b64encode(content)
-        kube = k8s.JustOKKube(instance['cluster'], self._kubeconfig)
-        kwargs = {'name': self._name,
-                  'namespace': instance['namespace'],
-                  'key': instance['key'],
-                  'content': content.decode('ascii')}
-        k8s_secret = K8S_SECRET.format(**kwargs)
-        secretfile = kube.kubefile(k8s_secret)
-        delete = ('delete secret %s --namespace %s'
-                  % (self._name, instance['namespace']))
-        try:
-            LOGGER.info('Trying to delete secret "%s" on cluster "%s", \
-namespace "%s"',
-                        self._name,
-                        instance['cluster'],
-                        instance['namespace'])
-            kube.run_raw(delete)
-        except k8s.KubeProcError as err:
-            if 'NotFound' not in str(err):
-                raise
-        LOGGER.info('Trying to recreate secret "%s" on cluster "%s", \
-namespace "%s"',
-                    self._name,
-                    instance['cluster'],
-                    instance['namespace'])
-        kube.create_file(secretfile)
+        return K8S_SECRET.format(name=self._name,
+                                 namespace=instance['namespace'],
+                                 key=instance['key'],
+                                 content=content.decode('ascii'))
+    def update_k8s(self, contents):
+        ''' Update the kubernetes clusters with the secret's content, with
+            apply_secrets(), raising the first cluster's error once every
+            cluster has been tried.
+            Overridable, but generic enough (if the secrets map is correct)
+            that it should be unnecessary.
+            Positional Arguments:
+                contents: List of (instance, content) tuples; see manifest()
+        '''
+        results = apply_secrets([(instance['cluster'],
+                                  self._kubeconfig,
+                                  self.manifest(instance, content))
+                                 for instance, content in contents])
+        for error, _ in results.values():
+            if error is not None:
+                raise error
 class MakoLemurSecret(SharedSecret):
     ''' This secret is comprised of a base64-encoded, 256 byte string stored in
         an S3 bucket and a K8s secret, provided at instantiation by a map
@@ -128,25 +304,26 @@ class MakoLemurSecret(SharedSecret):
                  'Key': None,
                  'ServerSideEncryption': 'AES256'}
 
-    def create(self):
+    def prepare(self, instance):
         ''' Must-be-overridden method:
-            Create the S3 and K8s secret(s) from map
+            Create the S3 secret for one instance from map and return its
+            content for the K8s secret
         '''
-        LOGGER.info('Refreshing instances for secret "%s"', self._name)
-        for instance in self._instances:
-            botocreds = self._keys[instance['aws_keys']]
-            content = secret_bytes()
-            self._put_s3(botocreds, instance, content)
-            self.update_k8s(instance, content)
+        botocreds = self._keys[instance['aws_keys']]
+        content = secret_bytes()
+        self._put_s3(botocreds, instance, content, self.throttle(instance))
+        return content
     @staticmethod
-    def _put_s3(creds, instance, content):
+    def _put_s3(creds, instance, content, throttle=None):
         ''' Send the secret's content to the S3 bucket.
         '''
-        client = boto3.client('s3', **creds)
-        kwargs = MakoLemurSecret.S3_OBJECT
+        client = aws_client('s3', creds)
+        kwargs = dict(MakoLemurSecret.S3_OBJECT)
         kwargs['Body'] = content
         kwargs['Bucket'] = instance['bucket']
         kwargs['Key'] = instance['key']
+        if throttle:
+            throttle()
         response = client.put_object(**kwargs)
         LOGGER.info('HTTP result of putting S3 object: %s',
                     response['ResponseMetadata']['HTTPStatusCode'])
@@ -154,49 +331,75 @@ class MakoIAMSecret(SharedSecret):
     ''' This secret is comprised of AWS IAM secret/access keys stored in
         multiple k8s secrets.
     '''
-    def create(self):
-        ''' Create the secret according to its configuration from the secrets
-            map
+    def __init__(self, *args, **kwargs):
+        ''' Initialization method. See SharedSecret.
         '''
-        LOGGER.info('Refreshing instances for secret "%s"', self._name)
-        refreshed_users = []
-        for instance in self._instances:
-            # A given iam_user is managed by a set of aws_keys (which signify
-            # an account). If an iam_user has been updated by a set of
-            # aws_keys, do not update it again. However, if the same name
-            # exists in a different account (a different aws_keys), update the
-            # iam_user.
-            if {instance['aws_keys']: instance['iam_user']} not in refreshed_users:
-                LOGGER.info('IAM user %s has not been refreshed for secret \
+        SharedSecret.__init__(self, *args, **kwargs)
+        self._refreshed = {}
+        self._refresh_lock = threading.Lock()
+    def prepare(self, instance):
+        ''' Return fresh keys for the instance's IAM user
+        '''
+        return self._new_secret(instance)
+    def _new_secret(self, instance):
+        ''' Return new credentials for the instance's IAM user.
+            A given iam_user is managed by a set of aws_keys (which signify an
+            account). If an iam_user has been updated by a set of aws_keys, do
+            not update it again; instances rotated at the same time wait for
+            the one update. However, if the same name exists in a different
+            account (a different aws_keys), update the iam_user.
+        '''
+        user_key = (instance['aws_keys'], instance['iam_user'])
+        with self._refresh_lock:
+            future = self._refreshed.get(user_key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._refreshed[user_key] = future
+        if owner:
+            LOGGER.info('IAM user %s has not been refreshed for secret \
 %s.  Refreshing.', instance['iam_user'], self._name)
+            try:
                 botocreds = self._keys[instance['aws_keys']]
-                new_secret = self._update_keys(botocreds, instance['iam_user'])
-                refreshed_users.append({instance['aws_keys']: instance['iam_user']})
-            self.update_k8s(instance, new_secret)
+                future.set_result(self._update_keys(botocreds,
+                                                    instance['iam_user'],
+                                                    self.throttle(instance)))
+            # The error belongs to every instance sharing this IAM user
+            # pylint: disable=broad-except
+            except BaseException as err:
+                future.set_exception(err)
+        return future.result()
     @staticmethod
-    def _update_keys(creds, username):
-        ''' Regenerate IAM secret/access keys and call update_k8s() on the
-            result. If the user is at their quota for keys, delete the oldest
+    def _update_keys(creds, username, throttle=None):
+        ''' Regenerate IAM secret/access keys and return them for the K8s
+            secret. If the user is at their quota for keys, delete the oldest
             key.
             Positional Arguments:
                 creds: Dictionary of IAM credentials (secret/access key values)
                     for editing IAM keys
                 username:
                     Name of IAM user for whom to refresh secrets
+            Keyword Arguments:
+                throttle: Called before every IAM API call
         '''
-        iam = boto3.client('iam', **creds)
+        throttle = throttle or (lambda: None)
+        iam = aws_client('iam', creds)
         try:
+            throttle()
             newkey = iam.create_access_key(UserName=username)['AccessKey']
         # botocore.errorfactory.LimitExceededException does exist
         # pylint: disable=no-member
         except botocore.exceptions.ClientError as err:
             if 'LimitExceeded' not in str(err):
                 raise
+            throttle()
             previouskeys = iam.list_access_keys(UserName=username)
             oldest = min(previouskeys['AccessKeyMetadata'],
                          key=lambda x: x['CreateDate'])
+            throttle()
             iam.delete_access_key(AccessKeyId=oldest['AccessKeyId'],
                                   UserName=username)
+            throttle()
             newkey = iam.create_access_key(UserName=username)['AccessKey']
         creds = (defaults
                  .KEYREFRESH_CREDS_FMT
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+''' Stay resident, check clusters on a schedule and serve the results as
+    Prometheus metrics
+'''
+
+import concurrent.futures
+import http.server
+import logging
+import os
+import random
+import threading
+import time
+from library import check, defaults, kubeapi, metrics
+from library import kubeconfig as kubeconfig_index
+import yaml
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+
+class ScheduleError(Exception):
+    ''' Error for an unusable schedule file
+    '''
+    pass
+
+class Schedule(object):
+    ''' How often each cluster is checked, and by how much each interval is
+        randomly stretched or shrunk so checks do not line up
+    '''
+    def __init__(self,
+                 interval=defaults.SERVE_INTERVAL,
+                 jitter=defaults.SERVE_JITTER,
+                 clusters=None):
+        ''' Initialization method
+            Keyword Arguments:
+                interval: Seconds between checks of a cluster
+                jitter: Fraction, 0 to 1, of the interval added or taken away
+                        at random
+                clusters: Dictionary of cluster name to a dictionary with its
+                          own "interval" and/or "jitter"
+        '''
+        self._interval = float(interval)
+        self._jitter = float(jitter)
+        self._clusters = clusters or {}
+        for name, values in [(None, {'interval': interval, 'jitter': jitter})] \
+                + sorted(self._clusters.items()):
+            if float(values.get('interval', 1)) <= 0:
+                raise ScheduleError('Interval of %s must be positive'
+                                    % (name or 'the schedule'))
+            if not 0 <= float(values.get('jitter', 0)) < 1:
+                raise ScheduleError('Jitter of %s must be from 0 up to 1'
+                                    % (name or 'the schedule'))
+    @classmethod
+    def from_path(cls, path, interval, jitter):
+        ''' Read a schedule file, a YAML mapping such as
+                interval: 300
+                jitter: 0.1
+                clusters:
+                  prod-us-east-1: {interval: 60}
+            Anything it leaves out comes from interval and jitter.
+        '''
+        try:
+            with open(path, 'r') as data:
+                raw = yaml.safe_load(data) or {}
+        except (IOError, yaml.YAMLError) as err:
+            raise ScheduleError('Unable to read schedule %s: %s' % (path, err))
+        if not isinstance(raw, dict) or \
+                not isinstance(raw.get('clusters') or {}, dict):
+            raise ScheduleError('Schedule %s must be a mapping with an \
+optional "clusters" mapping' % path)
+        try:
+            return cls(raw.get('interval', interval),
+                       raw.get('jitter', jitter),
+                       {k: dict(v or {})
+                        for k, v in (raw.get('clusters') or {}).items()})
+        except (TypeError, ValueError) as err:
+            raise ScheduleError('Bad value in schedule %s: %s' % (path, err))
+    def interval(self, cluster):
+        ''' Return the seconds between checks of a cluster
+        '''
+        return float(self._clusters.get(cluster, {})
+                     .get('interval', self._interval))
+    def jitter(self, cluster):
+        ''' Return the jitter of a cluster's interval
+        '''
+        return float(self._clusters.get(cluster, {})
+                     .get('jitter', self._jitter))
+    def delay(self, cluster, rand=random):
+        ''' Return the seconds until the next check of a cluster
+        '''
+        jitter = self.jitter(cluster)
+        return self.interval(cluster) * (1 + rand.uniform(-jitter, jitter))
+
+class CheckDaemon(object):
+    ''' Check every cluster of a kubectl config file over and over, each on
+        its own schedule, with a bounded number of checks in flight. The
+        process, and with it connection pools, parsed configs and client
+        certificates, is shared by every check.
+    '''
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self,
+                 kubeconfig=defaults.KUBECONFIG,
+                 clusters=None,
+                 dd_api_key=None,
+                 concurrency=defaults.FLEET_CONCURRENCY,
+                 schedule=None,
+                 interval=defaults.SERVE_INTERVAL,
+                 jitter=defaults.SERVE_JITTER,
+                 check_metrics=None,
+                 runner=check.run_guarded,
+                 clock=time.monotonic,
+                 rand=None,
+                 **kube_kwargs):
+        ''' Initialization method
+            Keyword Arguments:
+                kubeconfig: Path to kubernetes config file
+                clusters: Clusters to check. Every context in the kubectl
+                          config file is checked when not given.
+                dd_api_key: Datadog API key used for per-cluster events
+                concurrency: Maximum number of clusters checked at once
+                schedule: Path to a schedule file (see Schedule.from_path).
+                          Raises ScheduleError if it cannot be used.
+                interval: Seconds between checks, unless scheduled otherwise
+                jitter: Fraction of the interval to vary it by at random
+                check_metrics: metrics.CheckMetrics the results go to
+                runner: Function run like check.run_guarded, for testing
+                clock: Monotonic clock, for testing
+                rand: random.Random used for jitter, for testing
+            Any other keyword arguments are passed on to k8s.JustOKKube
+        '''
+        self._kubeconfig = kubeconfig
+        self._wanted = list(clusters) if clusters else None
+        self._dd_api_key = dd_api_key
+        self._schedule_path = schedule
+        self._interval = interval
+        self._jitter = jitter
+        self._metrics = check_metrics or metrics.CheckMetrics()
+        self._runner = runner
+        self._clock = clock
+        self._rand = rand or random.Random()
+        self._kube_kwargs = kube_kwargs
+        if schedule:
+            self._schedule = Schedule.from_path(schedule, interval, jitter)
+        else:
+            self._schedule = Schedule(interval, jitter)
+        self._stamps = {}
+        self._next_reload = None
+        self._due = {}
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, concurrency))
+    @property
+    def metrics(self):
+        ''' Return the metrics the results go to
+        '''
+        return self._metrics
+    @property
+    def clusters(self):
+        ''' Return the clusters being checked
+        '''
+        with self._lock:
+            return sorted(self._due)
+    @property
+    def busy(self):
+        ''' Return the clusters with a check under way
+        '''
+        with self._lock:
+            return sorted(self._running)
+    @property
+    def schedule(self):
+        ''' Return the schedule in use
+        '''
+        return self._schedule
+    @staticmethod
+    def _stamp(path):
+        ''' Return the (mtime, size) of a file, or None if it is missing
+        '''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    def reload(self):
+        ''' Read the kubectl config file and schedule file again if either
+            changed on disk since they were last read. Return whether
+            anything was reloaded. A file which cannot be used is logged and
+            the previous one kept.
+        '''
+        now = self._clock()
+        if self._next_reload is not None and now < self._next_reload:
+            return False
+        self._next_reload = now + defaults.SERVE_RELOAD
+        stamps = {'kubeconfig': self._stamp(self._kubeconfig),
+                  'schedule': (self._stamp(self._schedule_path)
+                               if self._schedule_path else None)}
+        if stamps == self._stamps:
+            return False
+        changed = self._stamps != {}
+        if stamps['schedule'] != self._stamps.get('schedule') and \
+                self._schedule_path:
+            try:
+                self._schedule = Schedule.from_path(self._schedule_path,
+                                                    self._interval,
+                                                    self._jitter)
+            except ScheduleError:
+                LOGGER.exception('Keeping the previous schedule')
+        try:
+            known = (kubeconfig_index.KubeConfig.load(self._kubeconfig)
+                     .context_names)
+        except (IOError, KeyError, TypeError):
+            LOGGER.exception('Unable to read clusters from %s, keeping the \
+previous ones', self._kubeconfig)
+            known = None
+        if known is not None:
+            if stamps['kubeconfig'] != self._stamps.get('kubeconfig'):
+                # Servers, certificates or tokens may have changed
+                kubeapi.KubeApiClient.clear(self._kubeconfig)
+            self._set_clusters([i for i in known
+                                if self._wanted is None or i in self._wanted],
+                               now)
+        self._stamps = stamps
+        if changed:
+            LOGGER.warning('Reloaded configuration, checking %d cluster(s)',
+                           len(self._due))
+            self._metrics.reloaded()
+        return True
+    def _set_clusters(self, clusters, now):
+        ''' Start scheduling new clusters, a random part of their interval
+            from now so they are spread out, and stop scheduling removed ones
+        '''
+        with self._lock:
+            for cluster in clusters:
+                if cluster not in self._due:
+                    self._due[cluster] = now + self._rand.uniform(
+                        0, self._schedule.interval(cluster))
+            for cluster in list(self._due):
+                if cluster not in clusters:
+                    del self._due[cluster]
+            self._metrics.set_clusters(clusters)
+        unknown = sorted(set(self._wanted or []) - set(clusters))
+        if unknown:
+            LOGGER.warning('Unknown cluster(s) "%s" in kubectl config file \
+"%s"', ', '.join(unknown), self._kubeconfig)
+    def tick(self):
+        ''' Start the checks which are due. Return the seconds until the next
+            one is, or until configuration changes should be looked for.
+        '''
+        self.reload()
+        now = self._clock()
+        with self._lock:
+            due = [k for k, v in self._due.items()
+                   if v <= now and k not in self._running]
+            self._running.update(due)
+        for cluster in sorted(due):
+            self._metrics.started(cluster)
+            future = self._pool.submit(self._runner,
+                                       cluster,
+                                       self._kubeconfig,
+                                       self._dd_api_key,
+                                       **self._kube_kwargs)
+            future.add_done_callback(
+                lambda done, cluster=cluster: self._finished(cluster, done))
+        with self._lock:
+            waiting = [v for k, v in self._due.items()
+                       if k not in self._running]
+        return max(0, min(waiting + [self._next_reload]) - now)
+    def _finished(self, cluster, future):
+        ''' Record a finished check and schedule the cluster's next one
+        '''
+        try:
+            result = future.result()
+        # The runner is expected to catch everything; a check which got past
+        # it must still not stop the cluster being scheduled
+        # pylint: disable=broad-except
+        except Exception as error:
+            LOGGER.exception('Check on cluster "%s" failed unexpectedly',
+                             cluster)
+            result = check.CheckResult(cluster,
+                                       '%s: %s' % (type(error).__name__,
+                                                   error),
+                                       'error',
+                                       0)
+        self._metrics.record(result)
+        LOGGER.info('Cluster "%s" %s in %.3fs',
+                    cluster,
+                    'passed' if result.ok else 'failed',
+                    result.elapsed)
+        with self._lock:
+            self._running.discard(cluster)
+            if cluster in self._due:
+                self._due[cluster] = (self._clock() +
+                                      self._schedule.delay(cluster,
+                                                           self._rand))
+        self._wake.set()
+    def run(self):
+        ''' Schedule checks until stop is called, then wait for the ones
+            under way to finish
+        '''
+        try:
+            while not self._stopping.is_set():
+                wait = self.tick()
+                self._wake.wait(wait)
+                self._wake.clear()
+        finally:
+            self._pool.shutdown(wait=True)
+    def stop(self):
+        ''' Make run return once the checks under way have finished
+        '''
+        self._stopping.set()
+        self._wake.set()
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    ''' Serve /metrics in the Prometheus text format and /healthz
+    '''
+    def do_GET(self):
+        ''' Answer a GET request
+        '''
+        # Named by BaseHTTPRequestHandler
+        # pylint: disable=invalid-name
+        path = self.path.split('?', 1)[0]
+        if path == '/metrics':
+            body = self.server.check_metrics.render().encode('utf-8')
+            content_type = metrics.CONTENT_TYPE
+        elif path == '/healthz':
+            body = b'ok\n'
+            content_type = 'text/plain; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, fmt, *args):
+        ''' Log requests at debug level instead of to stderr
+        '''
+        # pylint: disable=arguments-differ
+        LOGGER.debug('%s %s', self.address_string(), fmt % args)
+
+class MetricsServer(http.server.ThreadingHTTPServer):
+    ''' HTTP server exposing a metrics.CheckMetrics
+    '''
+    daemon_threads = True
+    def __init__(self, check_metrics, address='127.0.0.1',
+                 port=defaults.SERVE_PORT):
+        ''' Initialization method
+            Positional Arguments:
+                check_metrics: metrics.CheckMetrics to serve
+            Keyword Arguments:
+                address: Address to listen on
+                port: Port to listen on, 0 for any free one
+        '''
+        self.check_metrics = check_metrics
+        super(MetricsServer, self).__init__((address, port), MetricsHandler)
+    def start(self):
+        ''' Serve requests in a background thread
+        '''
+        thread = threading.Thread(target=self.serve_forever,
+                                  name='metrics-server',
+                                  daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+''' Find and delete the check workloads left behind on clusters, e.g. by a
+    check which was killed before its teardown or whose teardown failed
+'''
+
+import concurrent.futures
+import logging
+import time
+from library import defaults, k8s
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+
+class SweepResult(object):
+    ''' Outcome of a sweep of one cluster
+    '''
+    # pylint: disable=too-many-arguments
+    def __init__(self, cluster, stale, deleted, elapsed, error=None):
+        ''' Initialization method
+            Positional Arguments:
+                cluster: Name of the cluster that was swept
+                stale: Live objects old enough to be deleted
+                deleted: Whether deletion of the stale objects was requested
+                elapsed: Wall-clock seconds the sweep took
+            Keyword Arguments:
+                error: Message of the error which stopped the sweep, if any
+        '''
+        self._cluster = cluster
+        self._stale = stale
+        self._deleted = deleted
+        self._elapsed = elapsed
+        self._error = error
+    @property
+    def cluster(self):
+        ''' Return the cluster
+        '''
+        return self._cluster
+    @property
+    def stale(self):
+        ''' Return the stale objects
+        '''
+        return self._stale
+    @property
+    def deleted(self):
+        ''' Return whether the stale objects were deleted
+        '''
+        return self._deleted
+    @property
+    def error(self):
+        ''' Return the error message, if the sweep failed
+        '''
+        return self._error
+    @property
+    def ok(self):
+        ''' Return whether or not the sweep succeeded
+        '''
+        # pylint: disable=invalid-name
+        return self._error is None
+    def record(self):
+        ''' Return a machine-readable record of the result
+        '''
+        record = {'cluster': self._cluster,
+                  'ok': self.ok,
+                  'stale': ['/'.join(j for j in (i.get('kind'),
+                                                 i['metadata'].get('namespace'),
+                                                 i['metadata']['name']) if j)
+                            for i in self._stale],
+                  'deleted': self._deleted,
+                  'seconds': round(self._elapsed, 3)}
+        if self._error:
+            record['error'] = self._error
+        return record
+
+def to_delete(stale):
+    ''' Return the stale objects which have to be deleted: those in a stale
+        Namespace go with it
+    '''
+    namespaces = set(i['metadata']['name'] for i in stale
+                     if i.get('kind') == 'Namespace')
+    return [i for i in stale if i.get('kind') == 'Namespace' or
+            i['metadata'].get('namespace') not in namespaces]
+
+def reference(obj):
+    ''' Return the least of a live object's manifest needed to delete it
+    '''
+    return {'apiVersion': obj['apiVersion'],
+            'kind': obj['kind'],
+            'metadata': {'name': obj['metadata']['name'],
+                         'namespace': obj['metadata'].get('namespace')}}
+
+class Sweeper(object):
+    ''' Sweep a set of clusters with a bounded number of sweeps in flight
+    '''
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 clusters,
+                 kubeconfig=defaults.KUBECONFIG,
+                 max_age=defaults.SWEEP_AGE,
+                 concurrency=defaults.FLEET_CONCURRENCY,
+                 dry_run=False,
+                 **kube_kwargs):
+        ''' Initialization method
+            Positional Arguments:
+                clusters: List of cluster (kubeconfig context) names
+            Keyword Arguments:
+                kubeconfig: Path to kubernetes config file
+                max_age: Seconds after which a check's objects are stale. Keep
+                         this above the longest a check can take, or checks
+                         under way will lose their workload.
+                concurrency: Maximum number of clusters swept at once
+                dry_run: Only report stale objects, without deleting them
+            Any other keyword arguments are passed on to k8s.JustOKKube
+        '''
+        self._clusters = list(clusters)
+        self._kubeconfig = kubeconfig
+        self._max_age = max_age
+        self._concurrency = max(1, concurrency)
+        self._dry_run = dry_run
+        self._kube_kwargs = kube_kwargs
+        self._results = []
+        self._elapsed = None
+    @property
+    def clusters(self):
+        ''' Return the clusters to be swept
+        '''
+        return self._clusters
+    @property
+    def results(self):
+        ''' Return the results collected so far
+        '''
+        return self._results
+    def sweep_one(self, cluster):
+        ''' List the check objects on one cluster with one call, and delete
+            the stale ones with one more, without waiting for the deletion to
+            finish
+        '''
+        started = time.monotonic()
+        stale = []
+        try:
+            kube = k8s.JustOKKube(cluster, self._kubeconfig, **self._kube_kwargs)
+            stale = [i for i in kube.list_managed()
+                     if kube.age(i) >= self._max_age]
+            if stale and not self._dry_run:
+                LOGGER.warning('Deleting %s from cluster "%s"',
+                               kube.names(stale),
+                               cluster)
+                kube.delete_workload([reference(i) for i in to_delete(stale)])
+            return SweepResult(cluster,
+                               stale,
+                               bool(stale) and not self._dry_run,
+                               time.monotonic() - started)
+        # One bad cluster cannot stop the sweep of the others
+        # pylint: disable=broad-except
+        except Exception as error:
+            LOGGER.exception('Sweep of cluster "%s" failed', cluster)
+            return SweepResult(cluster,
+                               stale,
+                               False,
+                               time.monotonic() - started,
+                               '%s: %s' % (type(error).__name__, error))
+    def run(self):
+        ''' Sweep every cluster, yielding each result as soon as it finishes
+        '''
+        started = time.monotonic()
+        workers = min(self._concurrency, len(self._clusters)) or 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self.sweep_one, cluster)
+                       for cluster in self._clusters]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                self._results.append(result)
+                yield result
+        self._elapsed = time.monotonic() - started
+    def summary(self):
+        ''' Return a machine-readable summary of the results so far
+        '''
+        failed = sorted(i.cluster for i in self._results if not i.ok)
+        return {'total': len(self._clusters),
+                'stale': sum(len(i.stale) for i in self._results),
+                'deleted': sum(len(i.stale) for i in self._results
+                               if i.deleted),
+                'failed': failed,
+                'seconds': round(self._elapsed or 0, 3)}
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+''' Time the phases of a check on a monotonic clock
+'''
+
+import contextlib
+import logging
+import time
+from library import defaults
+from library import trace
+
+LOGGER = logging.getLogger(defaults.LOGGER)
+# Metric each phase duration is reported under, tagged with phase:<name>
+PHASE_METRIC = 'end2end_k8s.phase.seconds'
+
+class PhaseTimer(object):
+    ''' Record how long each named phase of a check took
+    '''
+    def __init__(self, cluster, clock=time.monotonic):
+        ''' Initialization method
+            Positional Arguments:
+                cluster: Name of the cluster the phases ran against
+            Keyword Arguments:
+                clock: Monotonic clock, for testing
+        '''
+        self._cluster = cluster
+        self._clock = clock
+        self._phases = {}
+        self._failed = []
+    @property
+    def cluster(self):
+        ''' Return the cluster
+        '''
+        return self._cluster
+    @property
+    def phases(self):
+        ''' Return a dictionary of phase name to seconds taken
+        '''
+        return dict(self._phases)
+    @contextlib.contextmanager
+    def phase(self, name):
+        ''' Time the enclosed block as the named phase. Phases which raise are
+            recorded too, and remembered as failed. Spans traced in the block
+            carry the cluster and phase.
+        '''
+        started = self._clock()
+        try:
+            with trace.attributes(cluster=self._cluster, phase=name), \
+                    trace.span(name, 'phase'):
+                yield
+        except BaseException:
+            self._failed.append(name)
+            raise
+        finally:
+            self.add(name, self._clock() - started)
+    def add(self, name, seconds):
+        ''' Record a phase measured elsewhere, unless it was already recorded
+        '''
+        if name not in self._phases:
+            self._phases[name] = seconds
+            LOGGER.info('Phase "%s" on cluster "%s" took %.3fs',
+                        name, self._cluster, seconds)
+    def record(self):
+        ''' Return a machine-readable record of the timings
+        '''
+        return {'cluster': self._cluster,
+                'phases': {k: round(v, 3) for k, v in self._phases.items()},
+                'failed_phases': list(self._failed)}
+    def send(self, dd_client):
+        ''' Queue every phase duration as a metric on a dd.DDBatchClient
+        '''
+        for name, seconds in self._phases.items():
+            dd_client.send_metric(PHASE_METRIC,
+                                  seconds,
+                                  tags=['k8s_cluster:%s' % self._cluster,
+                                        'phase:%s' % name])
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+''' Record spans of work (kubectl and API calls, HTTP requests, sleeps) as
+    Chrome trace events, for --trace
+'''
+
+import collections
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+# Attributes (cluster, phase) of the work under way, added to every span
+_ATTRIBUTES = contextvars.ContextVar('trace_attributes', default={})
+_TRACER = None
+_SHARED_LOCK = threading.Lock()
+# Most events a Tracer keeps (a few hundred bytes each); older ones are
+# dropped, so tracing a long-running "serve" holds its latest activity only
+MAX_EVENTS = 100000
+
+class Tracer(object):
+    ''' Collect complete ("X") trace events from every thread, to be loaded
+        into chrome://tracing or Perfetto
+    '''
+    def __init__(self, clock=time.perf_counter, max_events=MAX_EVENTS):
+        ''' Initialization method
+            Keyword Arguments:
+                clock: Monotonic clock in seconds, for testing
+                max_events: Most events kept; the oldest are dropped to make
+                            room for new ones
+        '''
+        self._clock = clock
+        self._started = clock()
+        self._pid = os.getpid()
+        self._events = collections.deque(maxlen=max_events)
+        self._dropped = 0
+        self._threads = {}
+        self._lock = threading.Lock()
+    @property
+    def events(self):
+        ''' Return the events kept so far
+        '''
+        with self._lock:
+            return list(self._events)
+    @property
+    def dropped(self):
+        ''' Return how many of the oldest events were dropped to stay within
+            max_events
+        '''
+        return self._dropped
+    def now(self):
+        ''' Return the current time on the tracer's clock
+        '''
+        return self._clock()
+    def add(self, name, category, started, ended=None, **args):
+        ''' Record a span which started (and ended, by default now) at times
+            from now(), on the current thread. The current attributes are
+            added to args.
+        '''
+        ended = self._clock() if ended is None else ended
+        thread = threading.current_thread()
+        event = {'name': name,
+                 'cat': category,
+                 'ph': 'X',
+                 'ts': round((started - self._started) * 1e6, 1),
+                 'dur': round((ended - started) * 1e6, 1),
+                 'pid': self._pid,
+                 'tid': thread.ident,
+                 'args': dict(_ATTRIBUTES.get(), **args)}
+        with self._lock:
+            if len(self._events) == self._events.maxlen:
+                self._dropped += 1
+            self._events.append(event)
+            self._threads[thread.ident] = thread.name
+    def record(self):
+        ''' Return the trace as a Chrome trace-event JSON object, with the
+            threads named and the number of events dropped
+        '''
+        with self._lock:
+            tids = set(i['tid'] for i in self._events)
+            names = [{'name': 'thread_name',
+                      'ph': 'M',
+                      'pid': self._pid,
+                      'tid': k,
+                      'args': {'name': v}} for k, v in self._threads.items()
+                     if k in tids]
+            return {'traceEvents': names + list(self._events),
+                    'displayTimeUnit': 'ms',
+                    'otherData': {'dropped_events': self._dropped}}
+    def write(self, path):
+        ''' Write the trace to a file
+        '''
+        with open(path, 'w') as data:
+            json.dump(self.record(), data)
+
+def start(**kwargs):
+    ''' Start recording spans for the whole process and return the Tracer.
+        Keyword arguments are passed on to Tracer.
+    '''
+    # pylint: disable=global-statement
+    global _TRACER
+    with _SHARED_LOCK:
+        _TRACER = Tracer(**kwargs)
+        return _TRACER
+
+def stop():
+    ''' Stop recording spans and return the Tracer which recorded them, if
+        there was one
+    '''
+    # pylint: disable=global-statement
+    global _TRACER
+    with _SHARED_LOCK:
+        tracer, _TRACER = _TRACER, None
+        return tracer
+
+def now():
+    ''' Return the time on the current tracer's clock, or None if nothing is
+        being traced
+    '''
+    tracer = _TRACER
+    return tracer.now() if tracer else None
+
+def add(name, category, started, ended=None, **args):
+    ''' Record a span measured elsewhere with now(), if anything is being
+        traced
+    '''
+    tracer = _TRACER
+    if tracer and started is not None:
+        tracer.add(name, category, started, ended, **args)
+
+@contextlib.contextmanager
+def span(name, category, **args):
+    ''' Record the enclosed block as a span, if anything is being traced.
+        Blocks which raise are recorded with the error.
+    '''
+    tracer = _TRACER
+    if not tracer:
+        yield
+        return
+    started = tracer.now()
+    try:
+        yield
+    except BaseException as err:
+        args['error'] = '%s: %s' % (type(err).__name__, err)
+        raise
+    finally:
+        tracer.add(name, category, started, **args)
+
+@contextlib.contextmanager
+def attributes(**attrs):
+    ''' Add attributes to every span recorded in the enclosed block, on this
+        thread and on any function passed to bind() in it
+    '''
+    token = _ATTRIBUTES.set(dict(_ATTRIBUTES.get(), **attrs))
+    try:
+        yield
+    finally:
+        _ATTRIBUTES.reset(token)
+
+def bind(func):
+    ''' Return func, wrapped to run with the current attributes wherever it
+        is called, e.g. on a worker thread
+    '''
+    return functools.partial(contextvars.copy_context().run, func)
+
+def traced(category):
+    ''' Create a decorator recording each call of a method as a span named
+        after its class and itself
+    '''
+    def decorator(func):
+        ''' Wrap func in a span
+        '''
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            ''' Call func inside a span
+            '''
+            with span('%s.%s' % (type(self).__name__, func.__name__),
+                      category):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,3 +1,8 @@
 ''' define the value of __all__ for import *
 '''
-__all__ = ['test_kube_choices']
+__all__ = ['test_kube_choices', 'test_retry', 'test_certcache',
+           'test_kubeconfig', 'test_ratelimit', 'test_secret',
+           'test_manifests', 'test_startup', 'test_metrics', 'test_serve',
+           'test_k8s', 'test_pipeline', 'test_sweep', 'test_loadprobe',
+           'test_trace', 'test_fleet', 'test_kubeapi',
+           'test_lemur', 'test_dd', 'test_timing']
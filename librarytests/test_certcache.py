@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Tests CertCache objects
+
+Example:
+    import unittest
+    suite = test_certcache.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from library import certcache
+
+class CertCacheTestCase(unittest.TestCase):
+    ''' Test cases for library.certcache
+    '''
+    def setUp(self):
+        ''' Create a cache in a temporary directory with a settable clock
+        '''
+        self.now = 1000000
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = certcache.CertCache(self.tmpdir,
+                                         margin=60,
+                                         clock=lambda: self.now)
+        self.paths = {os.path.join(self.tmpdir, 'cert.pem'): 'cert',
+                      os.path.join(self.tmpdir, 'key.pem'): 'key'}
+    def tearDown(self):
+        ''' Clean up after ourselves, remove temporary directory
+        '''
+        shutil.rmtree(self.tmpdir)
+    def test_parse_time(self):
+        ''' Test Lemur timestamps and manifest dates are understood
+        '''
+        self.assertEqual(certcache.parse_time('1970-01-02T00:00:00+00:00'),
+                         86400)
+        self.assertEqual(certcache.parse_time('1970-01-02'), 86400)
+        self.assertRaises(ValueError, certcache.parse_time, None)
+    def test_missing_entry(self):
+        ''' Test an empty cache has nothing valid
+        '''
+        self.assertFalse(self.cache.valid('user:abc', self.paths))
+    def test_store_and_reuse(self):
+        ''' Test stored certificates are written and valid until the margin
+        '''
+        with self.cache.lock():
+            self.cache.store('user:abc', self.paths, self.now + 3600)
+        with open(os.path.join(self.tmpdir, 'key.pem')) as data:
+            self.assertEqual(data.read(), 'key')
+        self.assertTrue(self.cache.valid('user:abc', self.paths))
+        self.assertFalse(self.cache.valid('user:def', self.paths))
+        self.now += 3600 - 60
+        self.assertFalse(self.cache.valid('user:abc', self.paths))
+    def test_changed_files_invalid(self):
+        ''' Test files changed behind the cache's back are not reused
+        '''
+        self.cache.store('user:abc', self.paths, self.now + 3600)
+        certcache.atomic_write(os.path.join(self.tmpdir, 'cert.pem'), 'other')
+        self.assertFalse(self.cache.valid('user:abc', self.paths))
+    def test_expired_entries_pruned(self):
+        ''' Test storing a new entry drops expired ones
+        '''
+        self.cache.store('user:old', self.paths, self.now + 10)
+        self.now += 20
+        self.cache.store('user:new', self.paths, self.now + 3600)
+        # pylint: disable=protected-access
+        self.assertEqual(list(self.cache._read_index()), ['user:new'])
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(CertCacheTestCase)
+    return the_suite
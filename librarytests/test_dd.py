@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""Tests submitting events and metrics to Datadog in the background
+
+Example:
+    import unittest
+    suite = test_dd.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import gzip
+import json
+import threading
+import unittest
+from library import dd
+import requests
+
+class FakeSession(object):
+    ''' Stand-in for the shared session which records posts, and can hold
+        them until let through
+    '''
+    def __init__(self):
+        ''' Initialization method
+        '''
+        self.posts = []
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+    def post(self, url, params=None, headers=None, data=None, timeout=None):
+        ''' Record the post and answer 202
+        '''
+        # pylint: disable=unused-argument,too-many-arguments
+        self.entered.set()
+        self.gate.wait(10)
+        self.posts.append((url, params, headers, data))
+        result = requests.Response()
+        result.status_code = 202
+        return result
+    def series(self):
+        ''' Return the metric series of each series post
+        '''
+        return [json.loads(gzip.decompress(data).decode('utf-8'))['series']
+                for url, _, _, data in self.posts if url.endswith('/series')]
+    def events(self):
+        ''' Return the payload of each event post
+        '''
+        return [json.loads(data)
+                for url, _, _, data in self.posts if url.endswith('/events')]
+
+class BatchClientTestCase(unittest.TestCase):
+    ''' Test cases for library.dd.DDBatchClient, over a fake session
+    '''
+    def setUp(self):
+        ''' Stand in for the shared session
+        '''
+        # pylint: disable=protected-access
+        self.saved = dd._SESSION
+        self.session = dd._SESSION = FakeSession()
+        self.clients = []
+    def tearDown(self):
+        ''' Stop the clients and put the session back
+        '''
+        self.session.gate.set()
+        for client in self.clients:
+            client.close()
+        # pylint: disable=protected-access
+        dd._SESSION = self.saved
+    def client(self, **kwargs):
+        ''' Return a client which only sends when asked to
+        '''
+        kwargs.setdefault('flush_interval', 60)
+        client = dd.DDBatchClient('apikey', **kwargs)
+        self.clients.append(client)
+        return client
+    def test_batched(self):
+        ''' Test metric points go out together, as gzipped v2 series
+        '''
+        client = self.client()
+        for value in range(3):
+            client.send_metric('end2end_k8s.test', value, tags=['a:b'],
+                               timestamp=100)
+        self.assertTrue(client.flush(5))
+        self.assertEqual(len(self.session.posts), 1)
+        url, _, headers, _ = self.session.posts[0]
+        self.assertEqual(url, dd.DD_API + '/v2/series')
+        self.assertEqual((headers['Content-Encoding'], headers['DD-API-KEY']),
+                         ('gzip', 'apikey'))
+        self.assertEqual(self.session.series(), [[
+            {'metric': 'end2end_k8s.test',
+             'type': dd.METRIC_TYPES['gauge'],
+             'points': [{'timestamp': 100, 'value': value}],
+             'tags': ['end2end_k8s', 'a:b']} for value in range(3)]])
+    def test_batch_size(self):
+        ''' Test no request carries more than batch_size points
+        '''
+        client = self.client(batch_size=2)
+        for value in range(5):
+            client.send_metric('end2end_k8s.test', value)
+        client.flush(5)
+        self.assertEqual([len(i) for i in self.session.series()], [2, 2, 1])
+    def test_flush(self):
+        ''' Test flushing waits for everything queued before it to be sent
+        '''
+        client = self.client()
+        client.send_event('hello', alert_type='error')
+        client.send_metric('end2end_k8s.test', 1)
+        self.assertEqual(self.session.posts, [])
+        self.assertTrue(client.flush(5))
+        self.assertEqual([(i['text'], i['alert_type'])
+                          for i in self.session.events()],
+                         [('hello', 'error')])
+        self.assertEqual(self.session.posts[0][1], {'api_key': 'apikey'})
+        self.assertEqual(len(self.session.series()), 1)
+    def test_events(self):
+        ''' Test events go out one per request, uncompressed, as the v1
+            events endpoint takes them
+        '''
+        client = self.client()
+        client.send_event('one')
+        client.send_event('two')
+        client.flush(5)
+        self.assertEqual([i['text'] for i in self.session.events()],
+                         ['one', 'two'])
+        for url, _, headers, _ in self.session.posts:
+            self.assertEqual(url, dd.DD_API + '/v1/events')
+            self.assertNotIn('Content-Encoding', headers)
+    def test_close(self):
+        ''' Test closing sends what is queued and stops the thread
+        '''
+        client = self.client()
+        client.send_event('bye')
+        client.send_metric('end2end_k8s.test', 1)
+        client.close(5)
+        # pylint: disable=protected-access
+        self.assertFalse(client._thread.is_alive())
+        self.assertEqual(len(self.session.events()), 1)
+        self.assertEqual(len(self.session.series()), 1)
+        client.close(5)
+    def test_full_queue(self):
+        ''' Test items are dropped and counted, without blocking the caller,
+            while the queue is full
+        '''
+        client = self.client(max_queue=2)
+        self.session.gate.clear()
+        client.send_event('stuck')
+        threading.Thread(target=client.flush, args=(5,), daemon=True).start()
+        self.assertTrue(self.session.entered.wait(5))
+        for value in range(4):
+            client.send_metric('end2end_k8s.test', value)
+        self.assertEqual(client.dropped, 2)
+        self.session.gate.set()
+        self.assertTrue(client.flush(5))
+        self.assertEqual([[i['points'][0]['value'] for i in series]
+                          for series in self.session.series()], [[0, 1]])
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(BatchClientTestCase)
+    return the_suite
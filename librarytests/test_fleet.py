@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Tests checking many clusters at once
+
+Example:
+    import unittest
+    suite = test_fleet.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import argparse
+import contextlib
+import io
+import json
+import threading
+import time
+import unittest
+import end2end_k8s
+from library import check, fleet, kube_choices
+
+class FleetCheckTestCase(unittest.TestCase):
+    ''' Test cases for library.fleet.FleetCheck, with the check stood in for
+    '''
+    def setUp(self):
+        ''' Stand in for check.run_guarded with one which records how many
+            checks run at once and fails clusters named "bad-*"
+        '''
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most = 0
+        self.delays = {}
+        self.run_guarded = check.run_guarded
+        check.run_guarded = self.fake_run_guarded
+    def tearDown(self):
+        ''' Put the check back
+        '''
+        check.run_guarded = self.run_guarded
+    def fake_run_guarded(self, cluster, kubeconfig, dd_api_key, **_):
+        ''' Take a while, then pass or fail by name
+        '''
+        with self.lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        time.sleep(self.delays.get(cluster, 0.05))
+        with self.lock:
+            self.running -= 1
+        failed = cluster.startswith('bad')
+        return check.CheckResult(cluster,
+                                 'broken' if failed else 'fine',
+                                 'error' if failed else 'info',
+                                 0.05)
+    def test_concurrency(self):
+        ''' Test no more than concurrency clusters are checked at once, and
+            that many are
+        '''
+        fleet_check = fleet.FleetCheck(['c%s' % i for i in range(8)],
+                                       concurrency=3)
+        self.assertEqual(len(list(fleet_check.run())), 8)
+        self.assertEqual(self.most, 3)
+    def test_streaming(self):
+        ''' Test results come back as each check finishes, not in order
+        '''
+        self.delays = {'slow': 0.5, 'fast': 0}
+        fleet_check = fleet.FleetCheck(['slow', 'fast'], concurrency=2)
+        self.assertEqual([i.cluster for i in fleet_check.run()],
+                         ['fast', 'slow'])
+    def test_summary(self):
+        ''' Test the summary counts passes and names failures
+        '''
+        fleet_check = fleet.FleetCheck(['good', 'bad-b', 'bad-a'])
+        list(fleet_check.run())
+        summary = fleet_check.summary()
+        self.assertEqual((summary['total'], summary['passed'],
+                          summary['failed']),
+                         (3, 1, ['bad-a', 'bad-b']))
+    def test_exit_status(self):
+        ''' Test the command exits non-zero only if a cluster failed, after
+            printing every record and the summary
+        '''
+        from_path = kube_choices.KubeChoice.__dict__['from_path']
+        kube_choices.KubeChoice.from_path = staticmethod(
+            lambda _: ['good', 'bad'])
+        args = argparse.Namespace(all=False, clusters='good,bad',
+                                  kubeconfig='kubeconfig', dd_api_key=None,
+                                  concurrency=2, load=False, backend='kubectl',
+                                  watch=False, retry_strategy='fixed',
+                                  persistent=False, full_every=60,
+                                  ephemeral_namespace=False,
+                                  load_max_error_rate=0)
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out):
+                with self.assertRaises(SystemExit) as exited:
+                    end2end_k8s.run_fleet(args)
+                self.assertEqual(exited.exception.code, 1)
+                args.clusters = 'good'
+                end2end_k8s.run_fleet(args)
+        finally:
+            kube_choices.KubeChoice.from_path = from_path
+        lines = [json.loads(i) for i in out.getvalue().splitlines()]
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[2]['summary']['failed'], ['bad'])
+        self.assertEqual(lines[4]['summary']['failed'], [])
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(FleetCheckTestCase)
+    return the_suite
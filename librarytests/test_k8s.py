@@ -0,0 +1,517 @@
+#!/usr/bin/env python
+"""Tests JustOKKube's handling of the workload on a cluster
+
+Example:
+    import unittest
+    suite = test_k8s.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import http.server
+import io
+import json
+import socket
+import threading
+import time
+import unittest
+from library import k8s, kubeapi, manifests, pipeline, retry, trace
+import yaml
+
+class WorkloadTestCase(unittest.TestCase):
+    ''' Test cases for library.k8s.JustOKKube, with kubectl stood in for
+    '''
+    def setUp(self):
+        ''' Stand in for kubectl with a dictionary of objects
+        '''
+        self.objects = {}
+        self.commands = []
+        self.listed = {'pods': [], 'events': []}
+        self.run_it = k8s.JustOKKube.run_it
+        k8s.JustOKKube.run_it = staticmethod(self.fake_run_it)
+    def tearDown(self):
+        ''' Put kubectl back
+        '''
+        k8s.JustOKKube.run_it = self.run_it
+    def fake_run_it(self, cmd, stdin=None):
+        ''' Create, get or delete the objects in stdin
+        '''
+        verb = cmd.split('--context cluster ')[1].split()[0]
+        if not stdin:
+            which = cmd.split(' get ')[1].split()[0]
+            if which == 'svc':
+                found = self.objects.get(('Service',
+                                          cmd.split(' svc ')[1].split()[0]))
+                return json.dumps(found).encode() if found else b''
+            return json.dumps({'kind': 'List',
+                               'items': self.listed[which]}).encode()
+        docs = list(yaml.safe_load_all(stdin))
+        self.commands.append((verb, [i['kind'] for i in docs]))
+        keys = [(i['kind'], i['metadata']['name']) for i in docs]
+        if verb == 'get':
+            found = [self.objects[i] for i in keys if i in self.objects]
+            return json.dumps({'kind': 'List', 'items': found}).encode() \
+                if found else b''
+        for key, doc in zip(keys, docs):
+            if verb == 'create':
+                doc['metadata']['creationTimestamp'] = time.strftime(
+                    '%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+                self.objects[key] = doc
+            else:
+                self.objects.pop(key, None)
+        return b''
+    def kube(self, workload=None):
+        ''' Return a JustOKKube which needs no certificates
+        '''
+        kube = k8s.JustOKKube('cluster',
+                              'kubeconfig',
+                              strategy=retry.Fixed(0),
+                              workload=workload)
+        kube.setup = True
+        return kube
+    def test_create_then_reuse(self):
+        ''' Test the canary is created once, then only looked at
+        '''
+        self.assertEqual(self.kube().reconcile_workload(), 'created')
+        self.assertEqual(self.commands, [('get', ['Deployment', 'Service']),
+                                         ('create', ['Deployment',
+                                                     'Service'])])
+        del self.commands[:]
+        self.assertEqual(self.kube().reconcile_workload(), 'reused')
+        self.assertEqual(self.commands, [('get', ['Deployment', 'Service'])])
+    def test_drift(self):
+        ''' Test only the object which drifted is replaced, and one which
+            disappeared is created again
+        '''
+        self.kube().reconcile_workload()
+        del self.commands[:]
+        kube = self.kube(manifests.Workload(image='nginx:1.13'))
+        self.assertEqual(kube.reconcile_workload(), 'recreated')
+        self.assertIn(('delete', ['Deployment']), self.commands)
+        self.assertIn(('create', ['Deployment']), self.commands)
+        self.assertEqual(self.objects[('Deployment', kube.workload.name)]
+                         ['spec']['template']['spec']['containers'][0]
+                         ['image'], 'nginx:1.13')
+        del self.objects[('Service', kube.workload.name)]
+        del self.commands[:]
+        self.assertEqual(kube.reconcile_workload(), 'recreated')
+        self.assertEqual(self.commands[-1], ('create', ['Service']))
+    def test_full_cycle(self):
+        ''' Test a canary past its age is deleted and created again
+        '''
+        self.kube().reconcile_workload()
+        del self.commands[:]
+        self.assertEqual(self.kube().reconcile_workload(max_age=3600),
+                         'reused')
+        self.assertEqual(self.kube().reconcile_workload(max_age=0), 'cycled')
+        self.assertIn(('delete', ['Deployment', 'Service']), self.commands)
+        self.assertEqual(len(self.objects), 2)
+    def test_own_namespace(self):
+        ''' Test a workload with its own Namespace creates it first, has its
+            Deployment's pods checked, and is deleted by deleting the
+            Namespace alone
+        '''
+        kube = self.kube(manifests.Workload(run_id='abcd1234',
+                                            own_namespace=True))
+        kube.create_workload()
+        self.objects[('Deployment', kube.workload.name)]['status'] = {
+            'availableReplicas': kube.workload.replicas}
+        self.assertEqual(kube.verify_pods(1), kube.workload.replicas)
+        kube.delete_workload()
+        self.assertEqual(self.commands, [('create', ['Namespace',
+                                                     'Deployment',
+                                                     'Service']),
+                                         ('get', ['Deployment']),
+                                         ('delete', ['Namespace'])])
+    def test_ingress(self):
+        ''' Test the LoadBalancer address is read from the Service's status,
+            and a missing Service is told apart from a pending LoadBalancer
+        '''
+        kube = self.kube()
+        self.assertRaises(k8s.KubeSvcNotFoundError, kube.get_svc)
+        kube.create_workload()
+        self.assertRaises(k8s.KubeIngressNotFoundError, kube.ingress_address,
+                          0)
+        service = self.objects[('Service', kube.workload.name)]
+        service['status'] = {'loadBalancer': {'ingress': [{'ip': '10.0.0.1'}]}}
+        self.assertEqual(kube.ingress_address(0), 'http://10.0.0.1')
+    def test_pods(self):
+        ''' Test pods count as ready once every replica is available
+        '''
+        kube = self.kube()
+        kube.reconcile_workload()
+        deployment = self.objects[('Deployment', kube.workload.name)]
+        deployment['status'] = {'availableReplicas': 1}
+        self.assertRaises(k8s.KubePodsNotReadyError, kube.verify_pods, 0)
+        deployment['status'] = {'availableReplicas': 2}
+        self.assertEqual(kube.verify_pods(0), 2)
+    def test_pod_failures(self):
+        ''' Test pods which cannot start fail the check at once
+        '''
+        kube = self.kube()
+        kube.reconcile_workload()
+        waiting = {'waiting': {'reason': 'ImagePullBackOff',
+                               'message': 'Back-off pulling image'}}
+        self.listed['pods'] = [
+            {'metadata': {'name': 'pod-1'},
+             'status': {'containerStatuses': [{'name': 'nginx',
+                                               'state': waiting}]}},
+            {'metadata': {'name': 'pod-2'},
+             'status': {'conditions': [{'type': 'PodScheduled',
+                                        'status': 'False',
+                                        'reason': 'Unschedulable',
+                                        'message': '0/3 nodes are \
+available'}]}},
+            {'metadata': {'name': 'pod-3', 'deletionTimestamp': 'now'},
+             'status': {'containerStatuses': [{'name': 'nginx',
+                                               'state': waiting}]}}]
+        failures = kube.pod_failures()
+        self.assertEqual(len(failures), 2)
+        self.assertIn('pod-1', failures[0])
+        self.assertIn('ImagePullBackOff', failures[0])
+        self.assertIn('0/3 nodes', failures[1])
+        self.assertRaises(k8s.KubePodsFailedError, kube.verify_pods, 30)
+    def test_lb_failures(self):
+        ''' Test only warnings about this Service's LoadBalancer count
+        '''
+        kube = self.kube()
+        self.listed['events'] = [
+            {'type': 'Warning', 'reason': 'CreatingLoadBalancerFailed',
+             'message': 'old', 'involvedObject': {'uid': 'old-uid'}},
+            {'type': 'Normal', 'reason': 'EnsuringLoadBalancer',
+             'message': 'fine', 'involvedObject': {'uid': 'uid'}},
+            {'type': 'Warning', 'reason': 'SyncLoadBalancerFailed',
+             'message': 'quota', 'involvedObject': {'uid': 'uid'}}]
+        self.assertEqual(kube.lb_failures('uid'),
+                         ['SyncLoadBalancerFailed: quota'])
+    def test_lb_events(self):
+        ''' Test the LoadBalancer stage reads the Service's uid once, then
+            only lists events, failing on a warning about that Service
+        '''
+        kube = self.kube()
+        kube.create_workload()
+        key = ('Service', kube.workload.name)
+        self.objects[key]['metadata']['uid'] = 'uid'
+        # pylint: disable=protected-access
+        self.assertRaises(k8s.KubeIngressNotFoundError, kube._lb_failed)
+        # Reading the Service again would now raise KubeSvcNotFoundError
+        del self.objects[key]
+        self.assertRaises(k8s.KubeIngressNotFoundError, kube._lb_failed)
+        self.listed['events'] = [
+            {'type': 'Warning', 'reason': 'CreatingLoadBalancerFailed',
+             'message': 'quota', 'involvedObject': {'uid': 'uid'}}]
+        with self.assertRaises(k8s.KubeLoadBalancerError) as raised:
+            kube.watch_lb_events(5)
+        self.assertIn('CreatingLoadBalancerFailed: quota',
+                      str(raised.exception))
+
+class IngressTestCase(unittest.TestCase):
+    ''' Test cases for JustOKKube's DNS-aware probing of the LoadBalancer,
+        with a local HTTP server as its one working node
+    '''
+    def setUp(self):
+        ''' Serve 200s to requests for the LoadBalancer's hostname, and stand
+            in for DNS
+        '''
+        hosts = self.hosts = []
+        class Handler(http.server.BaseHTTPRequestHandler):
+            ''' Answer like nginx behind a LoadBalancer
+            '''
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                ''' Answer a GET, remembering the Host header
+                '''
+                hosts.append(self.headers.get('Host'))
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            def log_message(self, *args):
+                ''' Stay quiet
+                '''
+                pass
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.lookups = []
+        self.saved = (k8s.resolve, k8s.DNS_POLL, k8s.NODE_GRACE)
+        k8s.resolve = self.resolve
+        k8s.DNS_POLL = 0.01
+        k8s.NODE_GRACE = 0.3
+    def tearDown(self):
+        ''' Stop serving and put DNS back
+        '''
+        k8s.resolve, k8s.DNS_POLL, k8s.NODE_GRACE = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+    def resolve(self, host, port):
+        ''' Resolve nothing for the first two lookups, then the addresses
+            set by the test
+        '''
+        self.lookups.append((host, port))
+        if len(self.lookups) < 3:
+            raise socket.gaierror(-2, 'Name or service not known')
+        return self.addresses
+    def kube(self):
+        ''' Return a JustOKKube whose LoadBalancer is already assigned
+        '''
+        kube = k8s.JustOKKube('cluster',
+                              'kubeconfig',
+                              strategy=retry.Fixed(0.05))
+        # pylint: disable=protected-access
+        kube._ingress = 'http://lb.example:%s' % self.server.server_port
+        return kube
+    def test_dns_lag(self):
+        ''' Test DNS is polled until it resolves, then the address is probed
+            with the LoadBalancer's hostname as Host header
+        '''
+        self.addresses = ['127.0.0.1']
+        kube = self.kube()
+        self.assertEqual(kube.verify_ingress(5), 'Service ingress returned \
+200 from all 1 LoadBalancer node(s)')
+        self.assertEqual(len(self.lookups), 3)
+        self.assertEqual(self.hosts, ['lb.example:%s'
+                                      % self.server.server_port])
+        phases = kube.timer.phases
+        for phase in ('dns', 'first_200', 'all_nodes_200'):
+            self.assertIn(phase, phases)
+        self.assertLessEqual(phases['dns'], phases['first_200'])
+        self.assertEqual(list(kube.ingress_nodes), ['127.0.0.1'])
+    def test_bad_node(self):
+        ''' Test a node which does not answer is named, without failing the
+            check, once the others have answered
+        '''
+        self.addresses = ['127.0.0.1', '127.0.0.2']
+        kube = self.kube()
+        self.assertIn('from 1 of 2 LoadBalancer nodes (not 127.0.0.2)',
+                      kube.verify_ingress(5))
+        self.assertIsNone(kube.ingress_nodes['127.0.0.2'])
+        self.assertNotIn('all_nodes_200', kube.timer.phases)
+    def test_node_span(self):
+        ''' Test each node's probe is traced with the cluster and phase it
+            was started in
+        '''
+        self.addresses = ['127.0.0.1']
+        kube = self.kube()
+        tracer = trace.start()
+        try:
+            with kube.timer.phase('ingress'):
+                kube.verify_ingress(5)
+        finally:
+            trace.stop()
+        spans = [i for i in tracer.events if i['name'] == 'probe node']
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]['args'], {'cluster': 'cluster',
+                                            'phase': 'ingress',
+                                            'address': '127.0.0.1'})
+        self.assertNotEqual(spans[0]['tid'], threading.get_ident())
+    def test_no_node(self):
+        ''' Test the check fails if no node answers
+        '''
+        self.addresses = ['127.0.0.2']
+        self.assertRaises(k8s.KubeRequestError, self.kube().verify_ingress, 1)
+
+class FakeProcess(object):
+    ''' Stand-in for a kubectl watch which prints its lines and then never
+        exits until killed
+    '''
+    def __init__(self, lines=(), returncode=None, err=b''):
+        ''' Initialization method
+        '''
+        self.lines = [i + b'\n' for i in lines]
+        self.returncode = returncode
+        self.killed = threading.Event()
+        self.stdout = self
+        self.stderr = io.BytesIO(err)
+    def readline(self):
+        ''' Return the next line, then block until killed or the command
+            exits by itself
+        '''
+        if self.lines:
+            return self.lines.pop(0)
+        if self.returncode is None:
+            self.killed.wait(30)
+        return b''
+    def kill(self):
+        ''' Kill the command
+        '''
+        self.returncode = -9
+        self.killed.set()
+    def poll(self):
+        ''' Return the exit status, or None while running
+        '''
+        return self.returncode
+    def wait(self):
+        ''' Return the exit status once it is known
+        '''
+        if self.returncode is None:
+            self.killed.wait(30)
+        return self.returncode
+    def close(self):
+        ''' Nothing to close
+        '''
+        pass
+
+class WatchTestCase(unittest.TestCase):
+    ''' Test cases for JustOKKube's streaming kubectl watches, with a
+        command which never exits on its own
+    '''
+    def setUp(self):
+        ''' Stand in for subprocess.Popen
+        '''
+        self.procs = []
+        self.replies = []
+        self.popen = k8s.subprocess.Popen
+        k8s.subprocess.Popen = self.fake_popen
+    def tearDown(self):
+        ''' Put subprocess.Popen back
+        '''
+        k8s.subprocess.Popen = self.popen
+    def fake_popen(self, *_, **__):
+        ''' Start the next fake process
+        '''
+        proc = self.replies.pop(0) if self.replies else FakeProcess()
+        self.procs.append(proc)
+        return proc
+    def test_deadline(self):
+        ''' Test the watch yields what it has, stops at its deadline and
+            kills the command
+        '''
+        self.replies.append(FakeProcess([b'one', b'two']))
+        started = time.monotonic()
+        lines = list(k8s.JustOKKube.watch_it('kubectl get svc -w', 0.3))
+        self.assertEqual(lines, ['one', 'two'])
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertTrue(self.procs[0].killed.is_set())
+    def test_abort(self):
+        ''' Test the watch stops and kills the command once aborted
+        '''
+        abort = pipeline.Abort()
+        threading.Timer(0.1, abort.set).start()
+        started = time.monotonic()
+        self.assertEqual(list(k8s.JustOKKube.watch_it('kubectl get svc -w',
+                                                      30,
+                                                      abort)),
+                         [])
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertTrue(self.procs[0].killed.is_set())
+    def test_failure(self):
+        ''' Test a command which fails by itself raises its stderr
+        '''
+        self.replies.append(FakeProcess(returncode=1, err=b'forbidden'))
+        with self.assertRaises(k8s.KubeProcError) as raised:
+            list(k8s.JustOKKube.watch_it('kubectl get svc -w', 30))
+        self.assertIn('forbidden', str(raised.exception))
+    def test_watch_ingress(self):
+        ''' Test watching a Service which never gets its LoadBalancer gives
+            up at the timeout, with every kubectl watch killed
+        '''
+        kube = k8s.JustOKKube('cluster',
+                              'kubeconfig',
+                              strategy=retry.Fixed(0.05))
+        kube.setup = True
+        started = time.monotonic()
+        self.assertRaises(k8s.KubeIngressNotFoundError,
+                          kube.watch_ingress,
+                          0.5)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertTrue(self.procs)
+        for proc in self.procs:
+            self.assertTrue(proc.killed.is_set())
+
+class ApiWatchTestCase(unittest.TestCase):
+    ''' Test cases for watching the Service over the Kubernetes API, with
+        an API server which never sends a watch event
+    '''
+    def setUp(self):
+        ''' Serve a Service without a LoadBalancer, watches which stay
+            idle, and a pod which cannot pull its image once the Service is
+            being watched
+        '''
+        released = self.released = threading.Event()
+        watches = self.watches = []
+        class Handler(http.server.BaseHTTPRequestHandler):
+            ''' Answer like an API server
+            '''
+            def do_GET(self):
+                ''' Answer a get, list or watch
+                '''
+                if 'watch=1' in self.path:
+                    watches.append(self.path)
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.end_headers()
+                    self.wfile.flush()
+                    released.wait(30)
+                    return
+                if '/pods' in self.path and not watches:
+                    body = {'items': []}
+                elif '/pods' in self.path:
+                    body = {'items': [{'metadata': {'name': 'pod'},
+                                       'status': {'containerStatuses': [
+                                           {'name': 'nginx',
+                                            'state': {'waiting': {
+                                                'reason': 'ImagePullBackOff',
+                                                'message': 'no'}}}]}}]}
+                elif '/events' in self.path:
+                    body = {'items': []}
+                else:
+                    body = {'kind': 'Service',
+                            'metadata': {'name': 'web',
+                                         'uid': 'uid',
+                                         'resourceVersion': '1'}}
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            def log_message(self, *args):
+                ''' Stay quiet
+                '''
+                pass
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    def tearDown(self):
+        ''' Let the watches go and stop serving
+        '''
+        self.released.set()
+        self.server.shutdown()
+        self.server.server_close()
+    def test_abort(self):
+        ''' Test a failing pods stage ends an idle watch straight away
+        '''
+        kube = k8s.JustOKKube('cluster',
+                              'kubeconfig',
+                              backend='api',
+                              watch=True,
+                              strategy=retry.Fixed(0.05))
+        kube.setup = True
+        # pylint: disable=protected-access
+        kube._client = kubeapi.KubeApiClient('http://127.0.0.1:%s'
+                                             % self.server.server_port)
+        before = set(threading.enumerate())
+        started = time.monotonic()
+        self.assertRaises(k8s.KubePodsFailedError, kube.verify_workload, 60)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            stages = [i for i in set(threading.enumerate()) - before
+                      if i.name.startswith('stage')]
+            if not stages:
+                break
+            time.sleep(0.05)
+        self.assertEqual(stages, [])
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertTrue(self.watches)
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    loader = unittest.TestLoader()
+    the_suite = loader.loadTestsFromTestCase(WorkloadTestCase)
+    the_suite.addTests(loader.loadTestsFromTestCase(IngressTestCase))
+    the_suite.addTests(loader.loadTestsFromTestCase(WatchTestCase))
+    the_suite.addTests(loader.loadTestsFromTestCase(ApiWatchTestCase))
+    return the_suite
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""Tests the Kubernetes API client and the API backend of JustOKKube
+
+Example:
+    import unittest
+    suite = test_kubeapi.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from library import k8s, kubeapi
+import requests
+import yaml
+
+class FakeAdapter(requests.adapters.BaseAdapter):
+    ''' Transport which records requests and answers them from a queue of
+        (status, body) pairs
+    '''
+    def __init__(self):
+        ''' Initialization method
+        '''
+        requests.adapters.BaseAdapter.__init__(self)
+        self.requests = []
+        self.replies = []
+    def send(self, request, **_):
+        ''' Record the request and return the next reply
+        '''
+        self.requests.append(request)
+        status, body = self.replies.pop(0) if self.replies else (200, {})
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode('utf-8')
+        response.url = request.url
+        response.request = request
+        return response
+    def close(self):
+        ''' Nothing to close
+        '''
+        pass
+
+class ResourcePathTestCase(unittest.TestCase):
+    ''' Test cases for library.kubeapi.resource_path
+    '''
+    def test_paths(self):
+        ''' Test core and group kinds, plurals, cluster-scoped kinds and
+            collections across every namespace
+        '''
+        self.assertEqual(kubeapi.resource_path('v1', 'Service', 'web', 'x'),
+                         '/api/v1/namespaces/web/services/x')
+        self.assertEqual(kubeapi.resource_path('apps/v1', 'Deployment'),
+                         '/apis/apps/v1/namespaces/default/deployments')
+        self.assertEqual(kubeapi.resource_path('networking.k8s.io/v1',
+                                               'Ingress', 'web'),
+                         '/apis/networking.k8s.io/v1/namespaces/web/ingresses')
+        self.assertEqual(kubeapi.resource_path('v1', 'Endpoints', 'web'),
+                         '/api/v1/namespaces/web/endpoints')
+        self.assertEqual(kubeapi.resource_path('v1', 'Namespace', 'ignored',
+                                               'web'),
+                         '/api/v1/namespaces/web')
+        self.assertEqual(kubeapi.resource_path('v1', 'Service',
+                                               all_namespaces=True),
+                         '/api/v1/services')
+
+class KubeApiClientTestCase(unittest.TestCase):
+    ''' Test cases for library.kubeapi.KubeApiClient, over a fake transport
+    '''
+    def setUp(self):
+        ''' Build a client on the fake transport
+        '''
+        self.adapter = FakeAdapter()
+        self.client = kubeapi.KubeApiClient('http://api.test/')
+        # pylint: disable=protected-access
+        self.client._session.mount('http://', self.adapter)
+    def test_create_and_delete(self):
+        ''' Test objects are created in their collection and deleted with
+            background propagation
+        '''
+        manifest = {'apiVersion': 'v1', 'kind': 'Service',
+                    'metadata': {'name': 'web', 'namespace': 'apps'}}
+        self.client.create(manifest)
+        self.client.delete(manifest)
+        create, delete = self.adapter.requests
+        self.assertEqual((create.method, create.url),
+                         ('POST', 'http://api.test/api/v1/namespaces/apps/'
+                                  'services'))
+        self.assertEqual(json.loads(create.body.decode('utf-8')), manifest)
+        self.assertEqual((delete.method, delete.url),
+                         ('DELETE', 'http://api.test/api/v1/namespaces/apps/'
+                                    'services/web'))
+        self.assertEqual(json.loads(delete.body.decode('utf-8'))
+                         ['propagationPolicy'], 'Background')
+    def test_list(self):
+        ''' Test selectors are passed as query parameters and the items
+            returned
+        '''
+        self.adapter.replies.append((200, {'items': [{'kind': 'Pod'}]}))
+        items = self.client.list('v1', 'Pod', 'apps', label_selector='a=b')
+        self.assertEqual(items, [{'kind': 'Pod'}])
+        self.assertEqual(self.adapter.requests[0].url,
+                         'http://api.test/api/v1/namespaces/apps/pods?'
+                         'labelSelector=a%3Db')
+    def test_errors(self):
+        ''' Test failed Status responses are raised with their status and
+            reason, 404 as KubeApiNotFoundError
+        '''
+        self.adapter.replies.append((404, {'kind': 'Status',
+                                           'reason': 'NotFound',
+                                           'message': 'services "x" not found'}))
+        with self.assertRaises(kubeapi.KubeApiNotFoundError) as raised:
+            self.client.get('v1', 'Service', 'x')
+        self.assertEqual((raised.exception.status, raised.exception.reason),
+                         (404, 'NotFound'))
+        self.adapter.replies.append((403, {'kind': 'Status',
+                                           'reason': 'Forbidden',
+                                           'message': 'no'}))
+        with self.assertRaises(kubeapi.KubeApiError) as raised:
+            self.client.get('v1', 'Service', 'x')
+        self.assertNotIsInstance(raised.exception,
+                                 kubeapi.KubeApiNotFoundError)
+        self.assertEqual(str(raised.exception), 'no')
+    def test_kube_errors(self):
+        ''' Test the API backend of JustOKKube reads a missing object as None
+            and raises other API failures as a KubeError
+        '''
+        kube = k8s.JustOKKube('cluster', 'kubeconfig', backend='api')
+        kube.setup = True
+        # pylint: disable=protected-access
+        kube._client = self.client
+        self.adapter.replies.append((404, {'reason': 'NotFound'}))
+        self.assertEqual(kube.get_workload([kube.workload.service()]),
+                         [None])
+        self.adapter.replies.append((500, {'message': 'etcd is down'}))
+        with self.assertRaises(k8s.KubeError) as raised:
+            kube.create_workload()
+        self.assertIsInstance(raised.exception, k8s.KubeApiRequestError)
+        self.assertIn('etcd is down', str(raised.exception))
+
+class ClientCacheTestCase(unittest.TestCase):
+    ''' Test cases for the clients shared per kubeconfig and context
+    '''
+    def setUp(self):
+        ''' Write a kubectl config file with two contexts
+        '''
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'config')
+        with open(self.path, 'w') as data:
+            yaml.safe_dump({
+                'clusters': [{'name': i, 'cluster': {
+                    'server': 'https://%s.test' % i,
+                    'certificate-authority': '%s-ca.pem' % i}}
+                             for i in ('alpha', 'beta')],
+                'users': [{'name': 'user', 'user': {
+                    'client-certificate': 'cert.pem',
+                    'client-key': 'key.pem'}}],
+                'contexts': [{'name': i, 'context': {'cluster': i,
+                                                     'user': 'user'}}
+                             for i in ('alpha', 'beta')]}, data)
+        kubeapi.KubeApiClient.clear()
+    def tearDown(self):
+        ''' Forget the clients and remove the file
+        '''
+        kubeapi.KubeApiClient.clear()
+        shutil.rmtree(self.directory)
+    def test_shared(self):
+        ''' Test each (kubeconfig, context) gets one client until cleared
+        '''
+        alpha = kubeapi.KubeApiClient.for_context(self.path, 'alpha')
+        self.assertIs(kubeapi.KubeApiClient.for_context(self.path, 'alpha'),
+                      alpha)
+        beta = kubeapi.KubeApiClient.for_context(self.path, 'beta')
+        self.assertIsNot(beta, alpha)
+        self.assertEqual((alpha.server, beta.server),
+                         ('https://alpha.test', 'https://beta.test'))
+        kubeapi.KubeApiClient.clear(self.path)
+        self.assertIsNot(kubeapi.KubeApiClient.for_context(self.path,
+                                                           'alpha'),
+                         alpha)
+    def test_relative_paths(self):
+        ''' Test certificate paths are resolved against the kubeconfig's
+            directory
+        '''
+        client = kubeapi.KubeApiClient.for_context(self.path, 'alpha')
+        # pylint: disable=protected-access
+        self.assertEqual(client._session.verify,
+                         os.path.join(self.directory, 'alpha-ca.pem'))
+        self.assertEqual(client._session.cert,
+                         (os.path.join(self.directory, 'cert.pem'),
+                          os.path.join(self.directory, 'key.pem')))
+    def test_unknown_context(self):
+        ''' Test a context missing from the file is a KubeApiConfigError
+        '''
+        self.assertRaises(kubeapi.KubeApiConfigError,
+                          kubeapi.KubeApiClient.for_context,
+                          self.path,
+                          'gamma')
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    loader = unittest.TestLoader()
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(ResourcePathTestCase),
+        loader.loadTestsFromTestCase(KubeApiClientTestCase),
+        loader.loadTestsFromTestCase(ClientCacheTestCase)])
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""Tests KubeConfig objects
+
+Example:
+    import unittest
+    suite = test_kubeconfig.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import os
+import unittest
+from library import kubeconfig
+import yaml
+
+TMP_CONF = 'kubeconfig_conf'
+
+class KubeConfigTestCase(unittest.TestCase):
+    ''' Test cases for library.kubeconfig
+    '''
+    def setUp(self):
+        ''' Write a temporary kubectl config file
+        '''
+        self.config_yaml = {
+            'clusters': [{'name': 'c1',
+                          'cluster': {'server': 'https://c1.example.com',
+                                      'certificate-authority': 'ca.pem'}}],
+            'contexts': [{'name': 'ctx1',
+                          'context': {'cluster': 'c1', 'user': 'u1'}},
+                         {'name': 'ctx2',
+                          'context': {'cluster': 'c1', 'user': 'missing'}}],
+            'users': [{'name': 'u1',
+                       'user': {'client-certificate': 'client.pem',
+                                'client-key': 'key.pem'}}]}
+        self.write(self.config_yaml)
+    def write(self, config):
+        ''' Write config to the temporary file
+        '''
+        with open(TMP_CONF, 'w') as kube_yaml:
+            kube_yaml.write(yaml.dump(config))
+    def tearDown(self):
+        ''' Clean up after ourselves, remove temporary config file
+        '''
+        os.remove(TMP_CONF)
+        kubeconfig.KubeConfig.clear()
+    def test_context_names(self):
+        ''' Test contexts are listed in file order
+        '''
+        config = kubeconfig.KubeConfig.load(TMP_CONF)
+        self.assertEqual(config.context_names, ['ctx1', 'ctx2'])
+    def test_no_contexts(self):
+        ''' Test a missing or empty contexts section raises KeyError
+        '''
+        missing = dict(self.config_yaml)
+        del missing['contexts']
+        empty = dict(self.config_yaml, contexts=None)
+        for raw in (missing, empty):
+            config = kubeconfig.KubeConfig(TMP_CONF, raw)
+            with self.assertRaises(KeyError):
+                # pylint: disable=pointless-statement
+                config.context_names
+    def test_resolve(self):
+        ''' Test a context resolves to its cluster and user
+        '''
+        config = kubeconfig.KubeConfig.load(TMP_CONF)
+        cluster_name, cluster, user_name, user = config.resolve('ctx1')
+        self.assertEqual(cluster_name, 'c1')
+        self.assertEqual(cluster['server'], 'https://c1.example.com')
+        self.assertEqual(user_name, 'u1')
+        self.assertEqual(user['client-key'], 'key.pem')
+    def test_resolve_missing(self):
+        ''' Test missing contexts and users raise KeyError
+        '''
+        config = kubeconfig.KubeConfig.load(TMP_CONF)
+        self.assertRaises(KeyError, config.resolve, 'nope')
+        self.assertRaises(KeyError, config.resolve, 'ctx2')
+    def test_relative(self):
+        ''' Test paths are resolved against the config's directory
+        '''
+        config = kubeconfig.KubeConfig.load(TMP_CONF)
+        self.assertEqual(config.relative('ca.pem'),
+                         os.path.join(os.path.abspath('.'), 'ca.pem'))
+        self.assertEqual(config.relative(None), None)
+    def test_cached_until_changed(self):
+        ''' Test parses are shared until the file changes
+        '''
+        first = kubeconfig.KubeConfig.load(TMP_CONF)
+        self.assertTrue(kubeconfig.KubeConfig.load(TMP_CONF) is first)
+        self.config_yaml['contexts'].append({'name': 'ctx3',
+                                             'context': {'cluster': 'c1',
+                                                         'user': 'u1'}})
+        self.write(self.config_yaml)
+        stat = os.stat(TMP_CONF)
+        os.utime(TMP_CONF, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        second = kubeconfig.KubeConfig.load(TMP_CONF)
+        self.assertFalse(second is first)
+        self.assertEqual(second.context_names, ['ctx1', 'ctx2', 'ctx3'])
+    def test_missing_file(self):
+        ''' Test a missing file raises IOError
+        '''
+        self.assertRaises(IOError, kubeconfig.KubeConfig.load, 'not_a_file')
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(KubeConfigTestCase)
+    return the_suite
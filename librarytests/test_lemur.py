@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+"""Tests talking to Lemur for client certificates
+
+Example:
+    import unittest
+    suite = test_lemur.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from library import lemur
+import requests
+import yaml
+
+URL = lemur.LEMUR_URL['test']
+
+def response(status, body):
+    ''' Build a response with a JSON body
+    '''
+    reply = requests.Response()
+    reply.status_code = status
+    # pylint: disable=protected-access
+    reply._content = json.dumps(body).encode('utf-8')
+    return reply
+
+class FakeSession(object):
+    ''' Stand-in for Lemur behind a session, which hands out a new token on
+        each login and only accepts the latest one
+    '''
+    def __init__(self):
+        ''' Initialization method
+        '''
+        self.logins = 0
+        self.calls = []
+        self.reject = False
+        self.error = None
+    def request(self, method, url, headers=None, **_):
+        ''' Answer a login, a certificate search or a key request, or raise
+            the error given for anything but a login
+        '''
+        self.calls.append((method, url))
+        if self.error and not url.endswith('/auth/login'):
+            raise self.error
+        if url.endswith('/auth/login'):
+            self.logins += 1
+            return response(200, {'token': 'token-%s' % self.logins})
+        if (self.reject or headers['Authorization']
+                != 'Bearer token-%s' % self.logins):
+            return response(401, {'message': 'Token expired'})
+        if url.endswith('/key'):
+            return response(200, {'key': 'KEY'})
+        return response(200, {'total': 1,
+                              'items': [{'id': 7,
+                                         'chain': 'CA',
+                                         'body': 'CERT',
+                                         'notAfter':
+                                             '2030-01-01T00:00:00+00:00'}]})
+
+class SessionTestCase(unittest.TestCase):
+    ''' Test cases for the sessions and tokens shared by Lemur clients
+    '''
+    def setUp(self):
+        ''' Start without shared sessions or tokens, with a fake session for
+            the test environment
+        '''
+        # pylint: disable=protected-access
+        self.saved = (dict(lemur._SESSIONS), dict(lemur._TOKENS))
+        lemur._SESSIONS.clear()
+        lemur._TOKENS.clear()
+        self.session = lemur._SESSIONS[URL] = FakeSession()
+    def tearDown(self):
+        ''' Put the shared sessions and tokens back
+        '''
+        # pylint: disable=protected-access
+        lemur._SESSIONS.clear()
+        lemur._TOKENS.clear()
+        lemur._SESSIONS.update(self.saved[0])
+        lemur._TOKENS.update(self.saved[1])
+    def lookups(self):
+        ''' Return the certificate requests made, logins aside
+        '''
+        return [i for i in self.session.calls
+                if not i[1].endswith('/auth/login')]
+    def test_session_for(self):
+        ''' Test each Lemur URL gets one pooled session, shared by clients
+        '''
+        # pylint: disable=protected-access
+        del lemur._SESSIONS[URL]
+        session = lemur.session_for(URL)
+        self.assertIsInstance(session, requests.Session)
+        self.assertIs(lemur.session_for(URL), session)
+        self.assertIsNot(lemur.session_for(lemur.LEMUR_URL['prod']), session)
+        self.assertIs(lemur.Lemur('test')._session, session)
+    def test_one_login(self):
+        ''' Test clients of one environment and user log in once between them
+        '''
+        for _ in range(3):
+            certs = lemur.Lemur('test').get_or_create_cert()
+        self.assertEqual(self.session.logins, 1)
+        self.assertEqual(len(self.lookups()), 6)
+        self.assertEqual((certs['ca'], certs['cert'], certs['key']),
+                         ('CA', 'CERT', 'KEY'))
+        # pylint: disable=protected-access
+        self.assertEqual(list(lemur._TOKENS.values()), ['token-1'])
+    def test_relogin(self):
+        ''' Test a rejected token means exactly one more login, and the
+            request is made again with the new token
+        '''
+        client = lemur.Lemur('test')
+        client.get_or_create_cert()
+        # Lemur forgets the token, as it does when it expires
+        self.session.logins += 1
+        self.assertEqual(client.cert_key(7), 'KEY')
+        self.assertEqual(self.session.logins, 3)
+        key_url = URL + '/api/1/certificates/7/key'
+        self.assertEqual(self.lookups()[-2:], [('GET', key_url)] * 2)
+    def test_no_retry_loop(self):
+        ''' Test a request rejected again after logging in again is returned
+            as it is, not retried
+        '''
+        client = lemur.Lemur('test')
+        client.authenticate()
+        self.session.reject = True
+        # pylint: disable=protected-access
+        reply = client._authed_request('GET', URL + '/api/1/certificates')
+        self.assertEqual(reply.status_code, 401)
+        self.assertEqual(self.session.logins, 2)
+        self.assertEqual(len(self.lookups()), 2)
+    def test_no_repeated_create(self):
+        ''' Test a certificate request which timed out waiting for Lemur's
+            answer is raised, not sent again
+        '''
+        client = lemur.Lemur('test')
+        client.authenticate()
+        self.session.error = requests.exceptions.ReadTimeout('slow')
+        self.assertRaises(requests.exceptions.ReadTimeout, client.create_cert)
+        self.assertEqual(self.lookups(),
+                         [('POST', URL + '/api/1/certificates')])
+
+class FakeLemur(object):
+    ''' Stand-in for Lemur which takes a while to hand out certificates, or
+        fails to
+    '''
+    lock = threading.Lock()
+    calls = 0
+    error = None
+    lifetime = 86400
+    def __init__(self, environment):
+        ''' Initialization method
+        '''
+        self.environment = environment
+        self.digest = 'digest'
+    def get_or_create_cert(self):
+        ''' Count the call, then return certificates or raise
+        '''
+        with self.lock:
+            FakeLemur.calls += 1
+        time.sleep(0.2)
+        if self.error:
+            raise self.error
+        return {'ca': 'CA', 'cert': 'CERT', 'key': 'KEY',
+                'not_after': time.time() + self.lifetime}
+
+def write_kubeconfig(path, clusters):
+    ''' Write a kubectl config file whose contexts share the user
+        "test-user", with a CA file per cluster
+    '''
+    with open(path, 'w') as data:
+        yaml.safe_dump({
+            'clusters': [{'name': i, 'cluster': {
+                'server': 'https://%s.test' % i,
+                'certificate-authority': '%s-ca.pem' % i}} for i in clusters],
+            'users': [{'name': 'test-user', 'user': {
+                'client-certificate': 'cert.pem',
+                'client-key': 'key.pem'}}],
+            'contexts': [{'name': i, 'context': {'cluster': i,
+                                                 'user': 'test-user'}}
+                         for i in clusters]}, data)
+
+class ProvisionTestCase(unittest.TestCase):
+    ''' Test cases for library.lemur.ProvisionRegistry, with Lemur stood in
+        for
+    '''
+    def setUp(self):
+        ''' Write a kubeconfig with two clusters and stand in for Lemur
+        '''
+        self.directory = tempfile.mkdtemp()
+        self.kubeconfig = os.path.join(self.directory, 'config')
+        write_kubeconfig(self.kubeconfig, ['alpha', 'beta'])
+        FakeLemur.calls = 0
+        FakeLemur.error = None
+        FakeLemur.lifetime = 86400
+        self.lemur = lemur.Lemur
+        lemur.Lemur = FakeLemur
+        self.now = time.time()
+        self.registry = lemur.ProvisionRegistry(margin=0,
+                                                clock=lambda: self.now)
+    def tearDown(self):
+        ''' Put Lemur back and remove the files
+        '''
+        lemur.Lemur = self.lemur
+        shutil.rmtree(self.directory)
+    def provision_together(self, count, cluster='alpha'):
+        ''' Provision from count threads at once, returning what each got
+        '''
+        barrier = threading.Barrier(count)
+        results = [None] * count
+        def provision(index):
+            ''' Provision once every thread is ready
+            '''
+            barrier.wait()
+            try:
+                results[index] = self.registry.provision(cluster,
+                                                         self.kubeconfig)
+            # The error is the result under test
+            # pylint: disable=broad-except
+            except Exception as err:
+                results[index] = err
+        threads = [threading.Thread(target=provision, args=(i,))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+    def test_single_flight(self):
+        ''' Test callers wanting the same certificates at once share one
+            fetch and get its result
+        '''
+        results = self.provision_together(8)
+        self.assertEqual(FakeLemur.calls, 1)
+        self.assertEqual(len(set(results)), 1)
+        with open(os.path.join(self.directory, 'alpha-ca.pem')) as data:
+            self.assertEqual(data.read(), 'CA')
+        self.registry.provision('alpha', self.kubeconfig)
+        self.assertEqual(FakeLemur.calls, 1)
+    def test_failure(self):
+        ''' Test a failed fetch is raised to every waiting caller and not
+            remembered
+        '''
+        FakeLemur.error = requests.exceptions.ConnectionError('down')
+        results = self.provision_together(5)
+        self.assertEqual(FakeLemur.calls, 1)
+        for result in results:
+            self.assertIsInstance(result, requests.exceptions.ConnectionError)
+        FakeLemur.error = None
+        self.registry.provision('alpha', self.kubeconfig)
+        self.assertEqual(FakeLemur.calls, 2)
+    def test_expiry(self):
+        ''' Test certificates are provisioned again once they expire
+        '''
+        FakeLemur.lifetime = 60
+        self.registry.provision('alpha', self.kubeconfig)
+        self.registry.provision('alpha', self.kubeconfig)
+        self.assertEqual(FakeLemur.calls, 1)
+        self.now += 120
+        self.registry.provision('alpha', self.kubeconfig)
+        self.assertEqual(FakeLemur.calls, 2)
+    def test_ca_files(self):
+        ''' Test clusters sharing a user each get their own CA file
+        '''
+        self.registry.provision('alpha', self.kubeconfig)
+        self.registry.provision('beta', self.kubeconfig)
+        for cluster in ('alpha', 'beta'):
+            self.assertTrue(os.path.exists(os.path.join(self.directory,
+                                                        '%s-ca.pem'
+                                                        % cluster)))
+
+class CertificateSetTestCase(unittest.TestCase):
+    ''' Test cases for library.lemur.CertificateSet
+    '''
+    def setUp(self):
+        ''' Write a sample kubeconfig
+        '''
+        self.directory = tempfile.mkdtemp()
+        self.kubeconfig = os.path.join(self.directory, 'config')
+        write_kubeconfig(self.kubeconfig, ['alpha', 'beta'])
+    def tearDown(self):
+        ''' Remove the files
+        '''
+        shutil.rmtree(self.directory)
+    def test_paths(self):
+        ''' Test the file paths are read from the cluster's context
+        '''
+        certset = lemur.CertificateSet('beta', self.kubeconfig)
+        self.assertEqual((certset.ca, certset.cert, certset.key),
+                         ('beta-ca.pem', 'cert.pem', 'key.pem'))
+        self.assertEqual(certset.user, 'test-user')
+        self.assertEqual(certset.lemur_env, 'test')
+        self.assertEqual(certset.directory, self.directory)
+    def test_cached_per_files(self):
+        ''' Test clusters sharing a user, but not their files, each keep
+            their own cached certificates
+        '''
+        saved = lemur.Lemur
+        lemur.Lemur = FakeLemur
+        FakeLemur.calls = 0
+        FakeLemur.error = None
+        FakeLemur.lifetime = 86400
+        try:
+            for cluster in ('alpha', 'beta', 'alpha', 'beta'):
+                lemur.CertificateSet(cluster, self.kubeconfig).run()
+        finally:
+            lemur.Lemur = saved
+        self.assertEqual(FakeLemur.calls, 2)
+    def test_errors(self):
+        ''' Test a missing file or cluster raises a CertificateSetError
+        '''
+        self.assertRaises(lemur.CertificateSetConfigNotFoundError,
+                          lemur.CertificateSet,
+                          'alpha',
+                          os.path.join(self.directory, 'missing'))
+        self.assertRaises(lemur.CertificateSetConfigError,
+                          lemur.CertificateSet,
+                          'gamma',
+                          self.kubeconfig)
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    loader = unittest.TestLoader()
+    the_suite = loader.loadTestsFromTestCase(SessionTestCase)
+    the_suite.addTests(loader.loadTestsFromTestCase(ProvisionTestCase))
+    the_suite.addTests(loader.loadTestsFromTestCase(CertificateSetTestCase))
+    return the_suite
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Tests LoadProbe objects
+
+Example:
+    import unittest
+    suite = test_loadprobe.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import collections
+import http.server
+import itertools
+import threading
+import unittest
+from library import loadprobe
+
+class LoadProbeTestCase(unittest.TestCase):
+    ''' Test cases for library.loadprobe, against a local HTTP server
+    '''
+    def setUp(self):
+        ''' Serve 200s from two "pods" in turn, and a 503 every tenth request
+        '''
+        turns = itertools.count()
+        lock = threading.Lock()
+        class Handler(http.server.BaseHTTPRequestHandler):
+            ''' Answer like nginx behind a LoadBalancer
+            '''
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                ''' Answer a GET
+                '''
+                with lock:
+                    turn = next(turns)
+                self.send_response(503 if turn % 10 == 9 else 200)
+                self.send_header('Content-Length', '2')
+                self.send_header('X-Backend-Pod', 'pod-%s' % (turn % 2))
+                self.end_headers()
+                self.wfile.write(b'ok')
+            def log_message(self, *args):
+                ''' Stay quiet
+                '''
+                pass
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%s/' % self.server.server_port
+    def tearDown(self):
+        ''' Stop serving
+        '''
+        self.server.shutdown()
+        self.server.server_close()
+    def test_probe(self):
+        ''' Test every request is counted, failures included, and the pods
+            which answered are told apart
+        '''
+        probe = loadprobe.LoadProbe(self.url,
+                                    concurrency=4,
+                                    duration=30,
+                                    requests_total=100)
+        result = probe.run()
+        self.assertEqual(result.requests, 100)
+        self.assertEqual(result.errors, 10)
+        self.assertAlmostEqual(result.error_rate, 0.1)
+        self.assertEqual(sorted(result.pods), ['pod-0', 'pod-1'])
+        record = result.record()
+        self.assertEqual(record['statuses'], {'200': 90, '503': 10})
+        self.assertLessEqual(record['latency']['p50'],
+                             record['latency']['p99'])
+        self.assertEqual(sorted(record['connection']),
+                         ['connect', 'dns', 'ttfb'])
+    def test_connection_timings(self):
+        ''' Test a new connection is timed step by step, TLS only for https
+        '''
+        timings = loadprobe.connection_timings(self.url, proxies={})
+        self.assertEqual(sorted(timings), ['connect', 'dns', 'ttfb'])
+        self.assertTrue(all(i >= 0 for i in timings.values()))
+    def test_result(self):
+        ''' Test percentiles and the summary of a result
+        '''
+        result = loadprobe.LoadResult([i / 100.0 for i in range(1, 101)],
+                                      0,
+                                      collections.Counter({200: 100}),
+                                      collections.Counter({'pod-0': 100}),
+                                      [{'dns': 0.01, 'connect': 0.02},
+                                       {'dns': 0.03, 'connect': 0.04}],
+                                      2.0)
+        self.assertEqual(result.latency(), {'p50': 0.5,
+                                            'p95': 0.95,
+                                            'p99': 0.99,
+                                            'max': 1.0})
+        self.assertEqual(result.connection(), {'dns': 0.01,
+                                               'connect': 0.02})
+        self.assertEqual(result.rate, 50)
+        self.assertEqual(result.summary(), '100 requests at 50.0/s, p99 \
+990ms, 0.0% errors, 1 pod(s) answered')
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(LoadProbeTestCase)
+    return the_suite
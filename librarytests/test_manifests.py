@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Tests Workload objects
+
+Example:
+    import unittest
+    suite = test_manifests.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import unittest
+from library import defaults, manifests
+import yaml
+
+class WorkloadTestCase(unittest.TestCase):
+    ''' Test cases for library.manifests
+    '''
+    def test_defaults(self):
+        ''' Test the default workload is the one checks have always used
+        '''
+        workload = manifests.Workload()
+        self.assertEqual(workload.name, defaults.WORKLOAD['name'])
+        deployment, service = workload.objects()
+        self.assertEqual(deployment['kind'], 'Deployment')
+        self.assertEqual(deployment['spec']['replicas'], 2)
+        self.assertEqual(service['spec']['type'], 'LoadBalancer')
+        self.assertEqual(service['spec']['selector'],
+                         deployment['spec']['template']['metadata']['labels'])
+    def test_parameters(self):
+        ''' Test every parameter ends up in the manifests
+        '''
+        workload = manifests.Workload(name='canary',
+                                      namespace='e2e',
+                                      image='nginx:1.13',
+                                      replicas='3',
+                                      port=8080)
+        deployment, service = workload.objects()
+        container = deployment['spec']['template']['spec']['containers'][0]
+        self.assertEqual(container['image'], 'nginx:1.13')
+        self.assertEqual(container['ports'], [{'containerPort': 8080}])
+        self.assertEqual(deployment['spec']['replicas'], 3)
+        self.assertEqual(service['spec']['ports'], [{'port': 8080}])
+        for obj in (deployment, service):
+            self.assertEqual(obj['metadata']['name'], 'canary')
+            self.assertEqual(obj['metadata']['namespace'], 'e2e')
+        self.assertRaises(ValueError, manifests.Workload, replicas=0)
+    def test_pod_header(self):
+        ''' Test the image runs as it is unless the pods should name
+            themselves in a response header
+        '''
+        self.assertEqual(sorted(manifests.Workload().container()),
+                         ['image', 'name', 'ports'])
+        container = manifests.Workload(pod_header='X-Pod').container()
+        self.assertEqual(container['command'][:2], ['sh', '-c'])
+        self.assertIn('add_header X-Pod $hostname', container['command'][2])
+    def test_labels(self):
+        ''' Test both objects carry the label "sweep" looks for, and only the
+            canary is marked persistent
+        '''
+        key, value = defaults.MANAGED_LABEL
+        for obj in manifests.Workload().objects():
+            self.assertEqual(obj['metadata']['labels'][key], value)
+            self.assertNotIn('end2end-k8s/persistent',
+                             obj['metadata']['labels'])
+        for obj in manifests.Workload(**defaults.CANARY).objects():
+            self.assertEqual(obj['metadata']['labels']
+                             ['end2end-k8s/persistent'], 'true')
+    def test_run_id(self):
+        ''' Test a run's objects are named and labelled after it, and an own
+            Namespace comes first and is all that has to be deleted
+        '''
+        workload = manifests.Workload(run_id='abcd1234')
+        self.assertEqual(workload.name, '%s-abcd1234'
+                         % defaults.WORKLOAD['name'])
+        self.assertEqual(workload.namespace, defaults.WORKLOAD['namespace'])
+        for obj in workload.objects():
+            self.assertEqual(obj['metadata']['labels'][manifests.RUN_LABEL],
+                             'abcd1234')
+        self.assertEqual(workload.teardown_objects(), workload.objects())
+        self.assertNotEqual(manifests.run_id(), manifests.run_id())
+        workload = manifests.Workload(run_id='abcd1234', own_namespace=True)
+        namespace, deployment, service = workload.objects()
+        self.assertEqual(namespace['kind'], 'Namespace')
+        self.assertEqual(namespace['metadata']['name'], workload.name)
+        self.assertNotIn('namespace', namespace['metadata'])
+        for obj in (deployment, service):
+            self.assertEqual(obj['metadata']['namespace'], workload.name)
+        self.assertEqual(workload.teardown_objects(),
+                         [workload.namespace_object()])
+    def test_render(self):
+        ''' Test the rendered YAML holds both objects, in creation order
+        '''
+        workload = manifests.Workload()
+        documents = list(yaml.safe_load_all(workload.render()))
+        self.assertEqual(documents, workload.objects())
+    def test_drift(self):
+        ''' Test live objects are matched to the manifests they came from
+        '''
+        deployment, service = manifests.Workload().objects()
+        live = dict(service, status={'loadBalancer': {}})
+        self.assertFalse(manifests.drifted(service, live))
+        self.assertTrue(manifests.drifted(deployment, service))
+        other = manifests.Workload(image='nginx:1.13').deployment()
+        self.assertTrue(manifests.drifted(manifests.annotate(other),
+                                          deployment))
+        edited = dict(deployment, spec=dict(deployment['spec'], replicas=9))
+        self.assertTrue(manifests.drifted(deployment, edited))
+        self.assertFalse(manifests.drifted(deployment,
+                                           manifests.annotate(deployment)))
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(WorkloadTestCase)
+    return the_suite
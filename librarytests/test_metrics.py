@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Tests Histogram and CheckMetrics objects
+
+Example:
+    import unittest
+    suite = test_metrics.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import collections
+import unittest
+from library import check, loadprobe, metrics, timing
+
+class MetricsTestCase(unittest.TestCase):
+    ''' Test cases for library.metrics
+    '''
+    def result(self, cluster, ok, elapsed):
+        ''' Return a check result with a create phase
+        '''
+        # pylint: disable=invalid-name,no-self-use
+        timer = timing.PhaseTimer(cluster)
+        timer.add('create', elapsed / 2)
+        return check.CheckResult(cluster,
+                                 'message',
+                                 'info' if ok else 'error',
+                                 elapsed,
+                                 timer)
+    def test_histogram(self):
+        ''' Test buckets are cumulative and end with +Inf
+        '''
+        histogram = metrics.Histogram((1, 5))
+        for value in (0.5, 1, 3, 7):
+            histogram.observe(value)
+        self.assertEqual(histogram.samples('h', cluster='a'),
+                         ['h_bucket{cluster="a",le="1"} 2',
+                          'h_bucket{cluster="a",le="5"} 3',
+                          'h_bucket{cluster="a",le="+Inf"} 4',
+                          'h_sum{cluster="a"} 11.5',
+                          'h_count{cluster="a"} 4'])
+    def test_escape(self):
+        ''' Test label values are escaped
+        '''
+        self.assertEqual(metrics.labels(cluster='a"b\\c\nd'),
+                         '{cluster="a\\"b\\\\c\\nd"}')
+    def test_render(self):
+        ''' Test results show up as status, counters and histograms
+        '''
+        store = metrics.CheckMetrics(buckets=(1, 10), clock=lambda: 1000.0)
+        store.set_clusters(['a', 'b'])
+        store.started('b')
+        store.record(self.result('a', True, 2.0))
+        store.record(self.result('a', False, 4.0))
+        text = store.render()
+        for line in ('end2end_k8s_clusters 2',
+                     'end2end_k8s_check_running{cluster="a"} 0',
+                     'end2end_k8s_check_running{cluster="b"} 1',
+                     'end2end_k8s_check_up{cluster="a"} 0',
+                     'end2end_k8s_check_last_run_timestamp_seconds\
+{cluster="a"} 1000.0',
+                     'end2end_k8s_checks_total{cluster="a",result="fail"} 1',
+                     'end2end_k8s_checks_total{cluster="a",result="pass"} 1',
+                     'end2end_k8s_check_duration_seconds_bucket\
+{cluster="a",le="10"} 2',
+                     'end2end_k8s_phase_duration_seconds_count\
+{cluster="a",phase="create"} 2',
+                     '# TYPE end2end_k8s_check_duration_seconds histogram'):
+            self.assertIn(line + '\n', text)
+        self.assertNotIn('check_up{cluster="b"}', text)
+    def test_load(self):
+        ''' Test the last load probe of a cluster shows up as gauges
+        '''
+        store = metrics.CheckMetrics()
+        store.set_clusters(['a'])
+        load = loadprobe.LoadResult([0.01, 0.02],
+                                    2,
+                                    collections.Counter({200: 2, 503: 2}),
+                                    collections.Counter({'pod-0': 2}),
+                                    [],
+                                    2.0)
+        store.record(check.CheckResult('a', 'message', 'info', 1.0,
+                                       load=load))
+        text = store.render()
+        for line in ('end2end_k8s_load_latency_seconds\
+{cluster="a",quantile="0.99"} 0.02',
+                     'end2end_k8s_load_requests_per_second{cluster="a"} 2.0',
+                     'end2end_k8s_load_error_ratio{cluster="a"} 0.5'):
+            self.assertIn(line + '\n', text)
+        store.record(self.result('a', False, 1.0))
+        self.assertNotIn('load_error_ratio{', store.render())
+    def test_removed_cluster(self):
+        ''' Test clusters no longer checked are forgotten
+        '''
+        store = metrics.CheckMetrics()
+        store.set_clusters(['a'])
+        store.record(self.result('a', True, 1.0))
+        store.set_clusters(['b'])
+        store.record(self.result('a', True, 1.0))
+        self.assertNotIn('cluster="a"', store.render())
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(MetricsTestCase)
+    return the_suite
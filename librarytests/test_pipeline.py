@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Tests running the stages of a check at the same time
+
+Example:
+    import unittest
+    suite = test_pipeline.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import time
+import unittest
+from library import pipeline
+
+class PipelineTestCase(unittest.TestCase):
+    ''' Test cases for library.pipeline
+    '''
+    def test_results(self):
+        ''' Test every stage's result is returned by name
+        '''
+        results = pipeline.run_stages([('one', lambda: 1),
+                                       ('two', lambda: 2)])
+        self.assertEqual(results, {'one': 1, 'two': 2})
+    def test_fail_fast(self):
+        ''' Test the first failure is raised without waiting for the other
+            stages, which are told to stop
+        '''
+        abort = pipeline.Abort()
+        stopped = []
+        def slow():
+            ''' Wait for a long time unless aborted
+            '''
+            try:
+                abort.sleep(30)
+            except pipeline.PipelineAbortedError:
+                stopped.append(True)
+                raise
+        def failing():
+            ''' Fail at once
+            '''
+            raise ValueError('broken')
+        started = time.monotonic()
+        self.assertRaises(ValueError,
+                          pipeline.run_stages,
+                          [('slow', slow), ('failing', failing)],
+                          abort)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertTrue(abort.is_set())
+        self.assertTrue(isinstance(abort.reason, ValueError))
+        deadline = time.monotonic() + 5
+        while not stopped and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(stopped, [True])
+    def test_sleep(self):
+        ''' Test sleeping only raises once aborted
+        '''
+        abort = pipeline.Abort()
+        abort.sleep(0)
+        abort.set()
+        self.assertRaises(pipeline.PipelineAbortedError, abort.sleep, 30)
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(PipelineTestCase)
+    return the_suite
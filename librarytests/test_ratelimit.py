@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Tests TokenBucket and RateLimiter objects
+
+Example:
+    import unittest
+    suite = test_ratelimit.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import unittest
+from library import ratelimit
+
+class RateLimitTestCase(unittest.TestCase):
+    ''' Test cases for library.ratelimit
+    '''
+    def setUp(self):
+        ''' Create a fake clock which only moves when something sleeps
+        '''
+        self.now = 0.0
+    def clock(self):
+        ''' Return the current fake time
+        '''
+        return self.now
+    def sleep(self, seconds):
+        ''' Advance the fake time
+        '''
+        self.now += seconds
+    def test_bad_arguments(self):
+        ''' Test buckets need a positive rate and capacity
+        '''
+        self.assertRaises(ValueError, ratelimit.TokenBucket, 0, 1)
+        self.assertRaises(ValueError, ratelimit.TokenBucket, 1, 0)
+    def test_burst_then_rate(self):
+        ''' Test a full bucket allows a burst, then waits for the rate
+        '''
+        bucket = ratelimit.TokenBucket(2, 3, clock=self.clock, sleep=self.sleep)
+        waits = [bucket.acquire() for _ in range(5)]
+        self.assertEqual(waits[:3], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(waits[3], 0.5)
+        self.assertAlmostEqual(self.now, 1.0)
+    def test_refill_capped(self):
+        ''' Test an idle bucket refills no further than its capacity
+        '''
+        bucket = ratelimit.TokenBucket(10, 2, clock=self.clock, sleep=self.sleep)
+        bucket.acquire()
+        bucket.acquire()
+        self.now += 100
+        waits = [bucket.acquire() for _ in range(3)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertTrue(waits[2] > 0)
+    def test_limiter_keys_independent(self):
+        ''' Test each key gets its own bucket
+        '''
+        limiter = ratelimit.RateLimiter(1, 1, clock=self.clock, sleep=self.sleep)
+        self.assertEqual(limiter.acquire('sandbox'), 0.0)
+        self.assertEqual(limiter.acquire('super-prod'), 0.0)
+        self.assertTrue(limiter.bucket('sandbox') is limiter.bucket('sandbox'))
+        self.assertAlmostEqual(limiter.acquire('sandbox'), 1.0)
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(RateLimitTestCase)
+    return the_suite
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""Tests retry strategies and the Retry poller
+
+Example:
+    import unittest
+    suite = test_retry.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import itertools
+import unittest
+from library import retry
+
+class FakeClock(object):
+    ''' Clock which only moves when something sleeps
+    '''
+    def __init__(self):
+        ''' Initialization method
+        '''
+        self.now = 0.0
+        self.slept = []
+    def clock(self):
+        ''' Return the current fake time
+        '''
+        return self.now
+    def sleep(self, seconds):
+        ''' Advance the fake time
+        '''
+        self.slept.append(seconds)
+        self.now += seconds
+
+class RetryTestCase(unittest.TestCase):
+    ''' Test cases for library.retry
+    '''
+    def setUp(self):
+        ''' Create a fake clock for the poller
+        '''
+        self.fake = FakeClock()
+        self.calls = 0
+    def flaky(self, failures, cost=0):
+        ''' Return a callable which fails a number of times, taking cost
+            seconds per call, before succeeding
+        '''
+        def func():
+            ''' Fail until enough calls have been made
+            '''
+            self.calls += 1
+            self.fake.now += cost
+            if self.calls <= failures:
+                raise ValueError('not yet')
+            return 'done'
+        return func
+    def poller(self, timeout, strategy, **kwargs):
+        ''' Build a Retry on the fake clock
+        '''
+        return retry.Retry(timeout,
+                           strategy,
+                           retry_on=(ValueError,),
+                           clock=self.fake.clock,
+                           sleep=self.fake.sleep,
+                           **kwargs)
+    def test_fixed(self):
+        ''' Test the fixed strategy repeats its interval
+        '''
+        delays = retry.Fixed(5).delays()
+        self.assertEqual(list(itertools.islice(delays, 3)), [5, 5, 5])
+    def test_exponential_no_jitter(self):
+        ''' Test the exponential strategy grows up to its cap
+        '''
+        delays = retry.Exponential(base=1, cap=5, jitter=False).delays()
+        self.assertEqual(list(itertools.islice(delays, 5)), [1, 2, 4, 5, 5])
+    def test_exponential_jitter(self):
+        ''' Test jitter scales the delay by the random source
+        '''
+        delays = retry.Exponential(base=4, rand=lambda: 0.5).delays()
+        self.assertEqual(list(itertools.islice(delays, 2)), [2.0, 4.0])
+    def test_fast_then_slow(self):
+        ''' Test the fast interval is used until fast_for has passed
+        '''
+        delays = retry.FastThenSlow(fast=2, fast_for=6, slow=10).delays()
+        self.assertEqual(list(itertools.islice(delays, 5)), [2, 2, 2, 10, 10])
+    def test_strategy_from_str(self):
+        ''' Test strategies can be chosen by name and bad names are rejected
+        '''
+        self.assertTrue(isinstance(retry.strategy_from_str('fixed'),
+                                   retry.Fixed))
+        self.assertRaises(ValueError, retry.strategy_from_str, 'nope')
+    def test_returns_result(self):
+        ''' Test the result of a successful attempt is returned
+        '''
+        result = self.poller(60, retry.Fixed(1)).call(self.flaky(2))
+        self.assertEqual(result, 'done')
+        self.assertEqual(self.calls, 3)
+    def test_deadline_counts_attempt_time(self):
+        ''' Test time spent inside attempts counts towards the timeout
+        '''
+        poller = self.poller(10, retry.Fixed(1))
+        with self.assertRaises(retry.RetryTimeoutError) as context:
+            poller.call(self.flaky(100, cost=4))
+        self.assertTrue(isinstance(context.exception.last_error, ValueError))
+        self.assertEqual(context.exception.attempts, 3)
+        self.assertTrue(self.fake.now < 15)
+    def test_last_sleep_truncated(self):
+        ''' Test the final wait is cut short at the deadline
+        '''
+        poller = self.poller(3, retry.Fixed(10))
+        self.assertRaises(retry.RetryTimeoutError,
+                          poller.call,
+                          self.flaky(100))
+        self.assertEqual(self.fake.slept, [3])
+    def test_unexpected_error_not_retried(self):
+        ''' Test errors outside retry_on are raised immediately
+        '''
+        def func():
+            ''' Always fail with an error we do not retry
+            '''
+            self.calls += 1
+            raise KeyError('nope')
+        self.assertRaises(KeyError, self.poller(60, retry.Fixed(1)).call, func)
+        self.assertEqual(self.calls, 1)
+    def test_on_attempt_hook(self):
+        ''' Test the hook is called once per failed attempt
+        '''
+        seen = []
+        poller = self.poller(60,
+                             retry.Fixed(1),
+                             on_attempt=lambda *args: seen.append(args[0]))
+        poller.call(self.flaky(2))
+        self.assertEqual(seen, [1, 2])
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(RetryTestCase)
+    return the_suite
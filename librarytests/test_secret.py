@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""Tests applying batches of secrets to a cluster
+
+Example:
+    import unittest
+    suite = test_secret.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import unittest
+from library import k8s, secret
+
+NOT_FOUND = b'''Error from server (NotFound): error when replacing "STDIN": \
+secrets "%s" not found'''
+
+class ApplySecretsTestCase(unittest.TestCase):
+    ''' Test cases for library.secret.apply_secrets
+    '''
+    def setUp(self):
+        ''' Record kubectl calls instead of making them
+        '''
+        self.calls = []
+        self.errors = []
+        self.run_raw = k8s.JustOKKube.run_raw
+        k8s.JustOKKube.run_raw = self.fake_run_raw
+        self.manifests = [secret.K8S_SECRET.format(name=i,
+                                                   namespace='default',
+                                                   key='creds',
+                                                   content='c2VjcmV0')
+                          for i in ('alpha', 'beta')]
+    def tearDown(self):
+        ''' Put kubectl back
+        '''
+        k8s.JustOKKube.run_raw = self.run_raw
+    def fake_run_raw(self, command, stdin=None):
+        ''' Record the command and raise the next queued error, if any
+        '''
+        self.calls.append((command, stdin))
+        if self.errors:
+            raise k8s.KubeProcError(self.errors.pop(0))
+        return b''
+    def secrets(self, cluster='cluster'):
+        ''' Return the manifests as bound for one cluster
+        '''
+        return [(cluster, 'kubeconfig', i) for i in self.manifests]
+    def test_one_replace(self):
+        ''' Test every secret goes to the cluster in one replace from stdin
+        '''
+        self.assertEqual(list(secret.apply_secrets(self.secrets())),
+                         [('cluster', 'kubeconfig')])
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.calls[0][0], 'replace -f -')
+        self.assertEqual(self.calls[0][1], '\n---\n'.join(self.manifests))
+    def test_create_missing(self):
+        ''' Test only the secrets which do not exist yet are created
+        '''
+        self.errors.append(NOT_FOUND % b'beta')
+        secret.apply_secrets(self.secrets())
+        self.assertEqual([i[0] for i in self.calls],
+                         ['replace -f -', 'create -f -'])
+        self.assertEqual(self.calls[1][1], self.manifests[1])
+    def test_other_errors(self):
+        ''' Test errors other than missing secrets are returned as the
+            cluster's error, not taken for missing secrets
+        '''
+        self.errors.append(NOT_FOUND % b'beta' +
+                           b'\nerror: You must be logged in to the server')
+        error, _ = secret.apply_secrets(self.secrets())[('cluster',
+                                                          'kubeconfig')]
+        self.assertIsInstance(error, k8s.KubeProcError)
+        self.assertEqual(len(self.calls), 1)
+    def test_clusters(self):
+        ''' Test each cluster gets one replace of its own secrets, and a
+            cluster which fails does not stop the others
+        '''
+        self.errors.append(b'error: You must be logged in to the server')
+        results = secret.apply_secrets(self.secrets('alpha') +
+                                       self.secrets('beta')[:1])
+        self.assertEqual([i[1] for i in self.calls],
+                         ['\n---\n'.join(self.manifests), self.manifests[0]])
+        self.assertIsInstance(results[('alpha', 'kubeconfig')][0],
+                              k8s.KubeProcError)
+        self.assertIsNone(results[('beta', 'kubeconfig')][0])
+
+class AwsClientTestCase(unittest.TestCase):
+    ''' Test cases for library.secret.aws_client
+    '''
+    def setUp(self):
+        ''' Start without shared boto3 sessions or clients
+        '''
+        # pylint: disable=protected-access
+        self.saved = (dict(secret._BOTO_SESSIONS), dict(secret._BOTO_CLIENTS))
+        secret._BOTO_SESSIONS.clear()
+        secret._BOTO_CLIENTS.clear()
+    def tearDown(self):
+        ''' Put the shared sessions and clients back
+        '''
+        # pylint: disable=protected-access
+        secret._BOTO_SESSIONS.clear()
+        secret._BOTO_CLIENTS.clear()
+        secret._BOTO_SESSIONS.update(self.saved[0])
+        secret._BOTO_CLIENTS.update(self.saved[1])
+    @staticmethod
+    def creds(key_id):
+        ''' Return credentials for an access key
+        '''
+        return {'aws_access_key_id': key_id,
+                'aws_secret_access_key': 'secret',
+                'region_name': 'us-west-2'}
+    def test_cache(self):
+        ''' Test equal credentials share a client per service, and other
+            credentials or services get their own
+        '''
+        client = secret.aws_client('s3', self.creds('alpha'))
+        self.assertIs(secret.aws_client('s3', self.creds('alpha')), client)
+        self.assertIsNot(secret.aws_client('s3', self.creds('beta')), client)
+        iam = secret.aws_client('iam', self.creds('alpha'))
+        self.assertIsNot(iam, client)
+        self.assertEqual(iam.meta.service_model.service_name, 'iam')
+        # pylint: disable=protected-access
+        self.assertEqual(len(secret._BOTO_SESSIONS), 2)
+        self.assertEqual(len(secret._BOTO_CLIENTS), 3)
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = (unittest
+                 .TestLoader()
+                 .loadTestsFromTestCase(ApplySecretsTestCase))
+    the_suite.addTests(unittest
+                       .TestLoader()
+                       .loadTestsFromTestCase(AwsClientTestCase))
+    return the_suite
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""Tests Schedule and CheckDaemon objects
+
+Example:
+    import unittest
+    suite = test_serve.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import os
+import random
+import time
+import unittest
+from library import check, kubeconfig, serve
+import yaml
+
+TMP_CONF = 'serve_conf'
+TMP_SCHEDULE = 'serve_schedule'
+
+class CheckDaemonTestCase(unittest.TestCase):
+    ''' Test cases for library.serve
+    '''
+    def setUp(self):
+        ''' Write a kubectl config file with two contexts, and set up a fake
+            clock and a runner which only records what it was asked to check
+        '''
+        self.now = 0.0
+        self.checked = []
+        self.write_config(['ctx1', 'ctx2'])
+    def tearDown(self):
+        ''' Clean up after ourselves, remove temporary files
+        '''
+        for path in (TMP_CONF, TMP_SCHEDULE):
+            if os.path.exists(path):
+                os.remove(path)
+        kubeconfig.KubeConfig.clear()
+    @staticmethod
+    def touch(path, document):
+        ''' Write a YAML document, making sure its mtime changes
+        '''
+        stamp = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+        with open(path, 'w') as data:
+            data.write(yaml.dump(document))
+        os.utime(path, ns=(stamp + 10**9, stamp + 10**9))
+    def write_config(self, contexts):
+        ''' Write a kubectl config file with the given contexts
+        '''
+        self.touch(TMP_CONF,
+                   {'contexts': [{'name': i,
+                                  'context': {'cluster': 'c', 'user': 'u'}}
+                                 for i in contexts]})
+    def clock(self):
+        ''' Return the current fake time
+        '''
+        return self.now
+    def runner(self, cluster, *_, **__):
+        ''' Pretend to check a cluster
+        '''
+        self.checked.append(cluster)
+        return check.CheckResult(cluster, 'ok', 'info', 1.5)
+    def daemon(self, **kwargs):
+        ''' Return a daemon on the fake clock and runner
+        '''
+        return serve.CheckDaemon(TMP_CONF,
+                                 interval=100,
+                                 jitter=0,
+                                 runner=self.runner,
+                                 clock=self.clock,
+                                 rand=random.Random(1),
+                                 **kwargs)
+    @staticmethod
+    def settle(daemon):
+        ''' Wait for the checks under way to finish
+        '''
+        deadline = time.monotonic() + 5
+        while daemon.busy and time.monotonic() < deadline:
+            time.sleep(0.01)
+    def test_schedule(self):
+        ''' Test every cluster is checked once per interval
+        '''
+        daemon = self.daemon()
+        self.assertLessEqual(daemon.tick(), 100)
+        self.assertEqual(daemon.clusters, ['ctx1', 'ctx2'])
+        for _ in range(3):
+            self.now += 100
+            daemon.tick()
+            self.settle(daemon)
+        self.assertEqual(sorted(self.checked), ['ctx1'] * 3 + ['ctx2'] * 3)
+        self.assertIn('end2end_k8s_checks_total{cluster="ctx1",result="pass"} \
+3', daemon.metrics.render())
+        daemon.stop()
+        daemon.run()
+    def test_cluster_filter(self):
+        ''' Test only the clusters asked for are checked
+        '''
+        daemon = self.daemon(clusters=['ctx2', 'ctx9'])
+        daemon.reload()
+        self.assertEqual(daemon.clusters, ['ctx2'])
+    def test_reload(self):
+        ''' Test clusters added to and removed from the kubectl config file
+            are picked up once the reload interval has passed
+        '''
+        daemon = self.daemon()
+        daemon.reload()
+        self.write_config(['ctx2', 'ctx3'])
+        self.assertFalse(daemon.reload())
+        self.now += 60
+        self.assertTrue(daemon.reload())
+        self.assertEqual(daemon.clusters, ['ctx2', 'ctx3'])
+        self.assertIn('end2end_k8s_config_reloads_total 1',
+                      daemon.metrics.render())
+    def test_schedule_file(self):
+        ''' Test per-cluster intervals from a schedule file, and a broken
+            schedule file keeping the previous schedule
+        '''
+        self.touch(TMP_SCHEDULE, {'clusters': {'ctx1': {'interval': 10}}})
+        daemon = self.daemon(schedule=TMP_SCHEDULE)
+        daemon.reload()
+        self.assertEqual(daemon.schedule.interval('ctx1'), 10)
+        self.assertEqual(daemon.schedule.interval('ctx2'), 100)
+        self.touch(TMP_SCHEDULE, {'jitter': 2})
+        self.now += 60
+        daemon.reload()
+        self.assertEqual(daemon.schedule.interval('ctx1'), 10)
+    def test_bad_schedule(self):
+        ''' Test unusable intervals and jitter are refused
+        '''
+        self.assertRaises(serve.ScheduleError, serve.Schedule, 0, 0.1)
+        self.assertRaises(serve.ScheduleError, serve.Schedule, 10, 1)
+        self.assertRaises(serve.ScheduleError,
+                          serve.Schedule,
+                          10,
+                          0.1,
+                          {'ctx1': {'interval': -1}})
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(CheckDaemonTestCase)
+    return the_suite
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Tests subcommands which do not need the AWS SDK or an HTTP client do not
+import them. How long startup takes is measured by the "startup" benchmark.
+
+Example:
+    import unittest
+    suite = test_startup.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import yaml
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))), 'end2end_k8s.py')
+HEAVY_MODULES = ('boto3', 'botocore', 'requests', 'urllib3')
+LOADED = '''import json, runpy, sys
+sys.argv = %r
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+finally:
+    print(json.dumps(sorted(i for i in %r if i in sys.modules)))
+'''
+
+class StartupTestCase(unittest.TestCase):
+    ''' Test cases for end2end_k8s.py startup
+    '''
+    def setUp(self):
+        ''' Write a kubectl config file with a couple of contexts
+        '''
+        handle, self.conf = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as data:
+            yaml.dump({'contexts': [{'name': 'alpha', 'context': {}},
+                                    {'name': 'beta', 'context': {}}]},
+                      data)
+        self.argv = [SCRIPT, '-k', self.conf, 'clusters', '-j']
+    def tearDown(self):
+        ''' Remove the kubectl config file
+        '''
+        os.remove(self.conf)
+    def test_clusters_imports(self):
+        ''' Test "clusters" does not import the AWS SDK or an HTTP client
+        '''
+        out = subprocess.check_output([sys.executable,
+                                       '-c',
+                                       LOADED % (self.argv, HEAVY_MODULES)])
+        lines = out.decode('utf-8').splitlines()
+        self.assertEqual(json.loads(lines[0]),
+                         [{'name': 'alpha', 'value': 'alpha'},
+                          {'name': 'beta', 'value': 'beta'}])
+        self.assertEqual(json.loads(lines[-1]), [])
+    def test_aws_limits(self):
+        ''' Test "refresh" rejects an AWS rate or burst which is not
+            greater than zero before doing anything
+        '''
+        for option in ('--aws_rate', '--aws_burst'):
+            result = subprocess.run([sys.executable, SCRIPT, 'refresh',
+                                     option, '0', '--all'],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            self.assertEqual(result.returncode, 2)
+            self.assertIn(b'0 is not greater than zero', result.stderr)
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(StartupTestCase)
+    return the_suite
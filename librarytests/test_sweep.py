@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Tests Sweeper objects
+
+Example:
+    import unittest
+    suite = test_sweep.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import json
+import time
+import unittest
+from library import defaults, k8s, lemur, sweep
+import yaml
+
+def live(kind, name, age):
+    ''' Return a live object created age seconds ago
+    '''
+    return {'apiVersion': 'v1',
+            'kind': kind,
+            'metadata': {'name': name,
+                         'namespace': 'default',
+                         'creationTimestamp': time.strftime(
+                             '%Y-%m-%dT%H:%M:%SZ',
+                             time.gmtime(time.time() - age))}}
+
+class SweeperTestCase(unittest.TestCase):
+    ''' Test cases for library.sweep, with kubectl stood in for
+    '''
+    def setUp(self):
+        ''' Stand in for kubectl with a list of objects per cluster, and for
+            Lemur with nothing
+        '''
+        self.objects = {'old': [live('Deployment', 'leaked', 7200),
+                                live('Service', 'leaked', 7200),
+                                live('Service', 'running', 60)],
+                        'new': [live('Service', 'running', 60)]}
+        self.listed = []
+        self.deleted = []
+        self.run_it = k8s.JustOKKube.run_it
+        k8s.JustOKKube.run_it = staticmethod(self.fake_run_it)
+        self.provision = lemur.provision
+        lemur.provision = lambda *_: None
+    def tearDown(self):
+        ''' Put kubectl and Lemur back
+        '''
+        k8s.JustOKKube.run_it = self.run_it
+        lemur.provision = self.provision
+    def fake_run_it(self, cmd, stdin=None):
+        ''' List the cluster's objects, or delete the ones in stdin
+        '''
+        cluster = cmd.split('--context ')[1].split()[0]
+        if cluster == 'broken':
+            raise k8s.KubeProcError(b'Unable to connect to the server')
+        if stdin:
+            self.deleted += [(cluster, i['kind'], i['metadata']['name'])
+                             for i in yaml.safe_load_all(stdin)]
+            return b''
+        self.listed.append(cmd.split('--selector ')[1].split()[0])
+        return json.dumps({'kind': 'List',
+                           'items': self.objects[cluster]}).encode()
+    @staticmethod
+    def sweeper(clusters, **kwargs):
+        ''' Return a Sweeper, and its results once it has run
+        '''
+        sweeper = sweep.Sweeper(clusters, 'kubeconfig', **kwargs)
+        return sweeper, list(sweeper.run())
+    def test_stale_only(self):
+        ''' Test only objects older than max_age are deleted, in one call
+            per cluster, and the persistent canary is never looked for
+        '''
+        sweeper, results = self.sweeper(['old', 'new'], max_age=3600)
+        self.assertEqual(self.deleted, [('old', 'Deployment', 'leaked'),
+                                        ('old', 'Service', 'leaked')])
+        self.assertEqual(self.listed, [defaults.SWEEP_SELECTOR] * 2)
+        self.assertIn('!end2end-k8s/persistent', defaults.SWEEP_SELECTOR)
+        records = {i.cluster: i.record() for i in results}
+        self.assertEqual(records['old']['stale'],
+                         ['Deployment/default/leaked',
+                          'Service/default/leaked'])
+        self.assertFalse(records['new']['deleted'])
+        self.assertEqual(sweeper.summary()['deleted'], 2)
+    def test_namespace(self):
+        ''' Test the objects in a stale Namespace are deleted with it, not on
+            their own
+        '''
+        namespace = live('Namespace', 'leaked-abcd1234', 7200)
+        del namespace['metadata']['namespace']
+        inside = live('Deployment', 'leaked-abcd1234', 7200)
+        inside['metadata']['namespace'] = 'leaked-abcd1234'
+        self.objects['old'] = [namespace, inside]
+        _, results = self.sweeper(['old'], max_age=3600)
+        self.assertEqual(self.deleted, [('old', 'Namespace',
+                                         'leaked-abcd1234')])
+        self.assertEqual(results[0].record()['stale'],
+                         ['Namespace/leaked-abcd1234',
+                          'Deployment/leaked-abcd1234/leaked-abcd1234'])
+    def test_dry_run(self):
+        ''' Test a dry run deletes nothing
+        '''
+        sweeper, _ = self.sweeper(['old'], max_age=3600, dry_run=True)
+        self.assertEqual(self.deleted, [])
+        self.assertEqual(sweeper.summary()['stale'], 2)
+        self.assertEqual(sweeper.summary()['deleted'], 0)
+    def test_failure(self):
+        ''' Test a cluster which cannot be swept does not stop the others
+        '''
+        sweeper, _ = self.sweeper(['broken', 'old'], max_age=3600)
+        self.assertEqual(sweeper.summary()['failed'], ['broken'])
+        self.assertEqual(len(self.deleted), 2)
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(SweeperTestCase)
+    return the_suite
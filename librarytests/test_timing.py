@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Tests PhaseTimer objects
+
+Example:
+    import unittest
+    suite = test_timing.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import unittest
+from library import dd, timing
+
+class FakeClock(object):
+    ''' Clock which only moves when told to
+    '''
+    def __init__(self):
+        ''' Initialization method
+        '''
+        self.now = 0.0
+    def __call__(self):
+        ''' Return the time
+        '''
+        return self.now
+
+class FakeDDClient(object):
+    ''' Stand-in for a dd.DDBatchClient which keeps what it is sent
+    '''
+    def __init__(self):
+        ''' Initialization method
+        '''
+        self.metrics = []
+    def send_metric(self, name, value, tags=None, metric_type='gauge'):
+        ''' Keep the metric's payload
+        '''
+        self.metrics.append(dd.DDClient.metric(name, value, tags, metric_type,
+                                               timestamp=100))
+
+class PhaseTimerTestCase(unittest.TestCase):
+    ''' Test cases for library.timing.PhaseTimer
+    '''
+    def setUp(self):
+        ''' Time phases on a fake clock
+        '''
+        self.clock = FakeClock()
+        self.timer = timing.PhaseTimer('alpha', clock=self.clock)
+    def test_phase(self):
+        ''' Test a block is timed on the clock
+        '''
+        with self.timer.phase('create'):
+            self.clock.now += 2.5
+        self.assertEqual(self.timer.phases, {'create': 2.5})
+        self.assertEqual(self.timer.record(),
+                         {'cluster': 'alpha',
+                          'phases': {'create': 2.5},
+                          'failed_phases': []})
+    def test_first_wins(self):
+        ''' Test a phase is only recorded the first time
+        '''
+        self.timer.add('dns', 1.0)
+        self.timer.add('dns', 3.0)
+        with self.timer.phase('dns'):
+            self.clock.now += 5
+        self.assertEqual(self.timer.phases, {'dns': 1.0})
+    def test_failed(self):
+        ''' Test a phase which raises is recorded and remembered as failed
+        '''
+        with self.assertRaises(ValueError):
+            with self.timer.phase('delete'):
+                self.clock.now += 1.23456
+                raise ValueError('broken')
+        record = self.timer.record()
+        self.assertEqual(record['phases'], {'delete': 1.235})
+        self.assertEqual(record['failed_phases'], ['delete'])
+    def test_send(self):
+        ''' Test each phase is sent as a gauge tagged with cluster and phase
+        '''
+        self.timer.add('create', 1.5)
+        self.timer.add('dns', 0.25)
+        client = FakeDDClient()
+        self.timer.send(client)
+        self.assertEqual(sorted(client.metrics, key=lambda i: i['tags']),
+                         [{'metric': 'end2end_k8s.phase.seconds',
+                           'type': dd.METRIC_TYPES['gauge'],
+                           'points': [{'timestamp': 100, 'value': value}],
+                           'tags': ['end2end_k8s', 'k8s_cluster:alpha',
+                                    'phase:%s' % name]}
+                          for name, value in (('create', 1.5),
+                                              ('dns', 0.25))])
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    the_suite = unittest.TestLoader().loadTestsFromTestCase(PhaseTimerTestCase)
+    return the_suite
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""Tests spans are recorded as Chrome trace events with their cluster and
+phase
+
+Example:
+    import unittest
+    suite = test_trace.suite()
+    unittest.TextTestRunner().run(suite)
+
+"""
+import json
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from library import pipeline, retry, timing, trace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILED = '''import sys, threading
+import end2end_k8s
+def worker_only():
+    sum(range(1000))
+end2end_k8s.start_profile(sys.argv[1])
+thread = threading.Thread(target=worker_only)
+thread.start()
+thread.join()
+'''
+
+class FakeClock(object):
+    ''' Clock which moves a second every time it is read
+    '''
+    def __init__(self):
+        ''' Initialization method
+        '''
+        self.now = 0.0
+    def clock(self):
+        ''' Return the current fake time, then move it on
+        '''
+        self.now += 1
+        return self.now
+
+class TraceTestCase(unittest.TestCase):
+    ''' Test cases for library.trace
+    '''
+    def setUp(self):
+        ''' Start tracing on a fake clock
+        '''
+        self.tracer = trace.start(clock=FakeClock().clock)
+    def tearDown(self):
+        ''' Stop tracing
+        '''
+        trace.stop()
+    def test_span(self):
+        ''' Test a span is a complete event in microseconds, with the
+            attributes around it and the error it raised
+        '''
+        with trace.attributes(cluster='alpha'):
+            with trace.span('kubectl get', 'kubectl', command='get'):
+                pass
+            with self.assertRaises(ValueError):
+                with trace.span('fails', 'test'):
+                    raise ValueError('nope')
+        with trace.span('outside', 'test'):
+            pass
+        first, failed, outside = self.tracer.events
+        self.assertEqual((first['name'], first['cat'], first['ph']),
+                         ('kubectl get', 'kubectl', 'X'))
+        self.assertEqual((first['ts'], first['dur']), (1e6, 1e6))
+        self.assertEqual(first['args'], {'cluster': 'alpha',
+                                         'command': 'get'})
+        self.assertEqual(failed['args'], {'cluster': 'alpha',
+                                          'error': 'ValueError: nope'})
+        self.assertEqual(outside['args'], {})
+    def test_phases_and_stages(self):
+        ''' Test spans in a phase carry its cluster and phase, including on
+            the threads of pipeline stages
+        '''
+        timer = timing.PhaseTimer('alpha')
+        def stage():
+            ''' Trace a call from a stage thread
+            '''
+            with trace.span('call', 'test'):
+                return threading.current_thread().name
+        with timer.phase('pods'):
+            names = pipeline.run_stages([('one', stage)])
+        self.assertNotEqual(names['one'], threading.current_thread().name)
+        call, phase = self.tracer.events
+        self.assertEqual(call['args'], {'cluster': 'alpha', 'phase': 'pods'})
+        self.assertEqual((phase['name'], phase['cat']), ('pods', 'phase'))
+        self.assertNotEqual(call['tid'], phase['tid'])
+    def test_retry_sleeps(self):
+        ''' Test each wait of a retry is a "sleep" span
+        '''
+        attempts = []
+        def flaky():
+            ''' Fail once
+            '''
+            attempts.append(True)
+            if len(attempts) < 2:
+                raise ValueError('not yet')
+            return 'done'
+        poller = retry.Retry(60,
+                             retry.Fixed(0),
+                             retry_on=(ValueError,),
+                             sleep=lambda _: None)
+        self.assertEqual(poller.call(flaky), 'done')
+        sleep, = self.tracer.events
+        self.assertEqual((sleep['name'], sleep['cat']), ('sleep', 'retry'))
+        self.assertEqual(sleep['args'], {'attempt': 1, 'error': 'not yet'})
+    def test_write(self):
+        ''' Test the trace is written as Chrome trace-event JSON with the
+            threads named
+        '''
+        with trace.span('one', 'test'):
+            pass
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            self.tracer.write(path)
+            with open(path) as data:
+                written = json.load(data)
+        finally:
+            os.remove(path)
+        self.assertEqual(written['displayTimeUnit'], 'ms')
+        meta, event = written['traceEvents']
+        self.assertEqual((meta['ph'], meta['args']['name']),
+                         ('M', threading.current_thread().name))
+        self.assertEqual(event['name'], 'one')
+        self.assertEqual(written['otherData'], {'dropped_events': 0})
+    def test_max_events(self):
+        ''' Test only the latest events are kept, and the rest counted
+        '''
+        tracer = trace.Tracer(clock=FakeClock().clock, max_events=3)
+        for index in range(5):
+            tracer.add('span-%s' % index, 'test', tracer.now())
+        self.assertEqual([i['name'] for i in tracer.events],
+                         ['span-2', 'span-3', 'span-4'])
+        self.assertEqual(tracer.dropped, 2)
+        self.assertEqual(tracer.record()['otherData'],
+                         {'dropped_events': 2})
+    def test_stopped(self):
+        ''' Test nothing is recorded once tracing stops
+        '''
+        self.assertIs(trace.stop(), self.tracer)
+        with trace.span('ignored', 'test'):
+            pass
+        trace.add('ignored', 'test', trace.now())
+        self.assertIsNone(trace.now())
+        self.assertEqual(self.tracer.events, [])
+
+class ProfileTestCase(unittest.TestCase):
+    ''' Test cases for --profile
+    '''
+    def test_threads(self):
+        ''' Test functions which only run on other threads are profiled
+        '''
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            subprocess.check_call([sys.executable, '-c', PROFILED, path],
+                                  cwd=ROOT)
+            names = [i[2] for i in pstats.Stats(path).stats]
+        finally:
+            os.remove(path)
+        self.assertIn('worker_only', names)
+
+def suite():
+    ''' Create a suite of tests
+    '''
+    loader = unittest.TestLoader()
+    the_suite = loader.loadTestsFromTestCase(TraceTestCase)
+    the_suite.addTests(loader.loadTestsFromTestCase(ProfileTestCase))
+    return the_suite